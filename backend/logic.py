@@ -1,9 +1,9 @@
 # backend/logic.py
 from pathlib import Path
-from fastapi import FastAPI
-from fastapi.responses import FileResponse, HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import uvicorn
 
 # project root
@@ -12,10 +12,17 @@ FRONTEND_DIR = PROJECT_ROOT / "frontend"
 
 # routers
 from .services.revgeo import router as revgeo_router
-from .services.wiki_place import router as wiki_router
-from .services.history_llm import router as history_router
-from .services.history_events import router as events_router 
+from .services.wiki_place import router as wiki_router, start_cache_sweeper, load_local_indexes
+from .services.history_llm import (
+    router as history_router, start_cache_sweeper as start_history_sweeper, warm_providers, aclose_providers,
+)
+from .services.history_events import router as events_router, start_parse_pool, shutdown_parse_pool
+from .services.warmup import router as warmup_router, start_warmup
+from .services.globe import router as globe_router, start_globe_bake
 from .utils.assets import ensure_assets
+from .utils.countries import load_country_index
+from .utils.http import aclose_clients, http_stats
+from .utils.static_build import build_into, open_static
 
 app = FastAPI(title="Time-Globe MVP")
 
@@ -25,21 +32,50 @@ app.add_middleware(
     allow_methods=["*"], allow_headers=["*"],
 )
 
-app.mount("/static", StaticFiles(directory=FRONTEND_DIR), name="static")
+# 有 build 時送 hash 檔名 + br/gzip 預壓縮版本（immutable）；沒有就直接送 frontend/
+static = open_static(FRONTEND_DIR)
+app.mount("/static", static, name="static")
 
 @app.get("/", response_class=HTMLResponse)
-def index():
-    return FileResponse(FRONTEND_DIR / "index.html")
+async def index(request: Request):
+    return await static.index_response(request.scope)
 
 # APIs
 app.include_router(revgeo_router, prefix="/api", tags=["revgeo"])
 app.include_router(wiki_router, prefix="/api", tags=["place"])
 app.include_router(history_router, prefix="/api", tags=["history"])
 app.include_router(events_router, prefix="/api", tags=["events"])
+app.include_router(warmup_router, prefix="/api", tags=["warmup"])
+app.include_router(globe_router, prefix="/api", tags=["globe"])
+
+@app.get("/api/http/stats")
+def http_pool_stats():
+    return http_stats()
 
 @app.on_event("startup")
 def _startup():
     ensure_assets(FRONTEND_DIR)
+    build_into(static, FRONTEND_DIR)
+    load_country_index(FRONTEND_DIR / "assets" / "countries.geojson")
+    start_cache_sweeper()
+    start_history_sweeper()
+    load_local_indexes()
+    start_parse_pool()
+
+@app.on_event("startup")
+async def _startup_warmup():
+    # 需要事件迴圈：在背景暖熱門地點的快取（WARMUP_FILE 未設定時不做事）
+    start_warmup()
+    # LLM 連線先打開（背景做，不拖慢啟動）
+    asyncio.get_running_loop().create_task(warm_providers())
+    # 底圖 + 國家 ID 圖在伺服器烤一次（有快取就直接用），前端不必自己畫 GeoJSON
+    asyncio.get_running_loop().create_task(start_globe_bake(FRONTEND_DIR / "assets" / "countries.geojson"))
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await aclose_clients()
+    await aclose_providers()
+    shutdown_parse_pool()
 
 if __name__ == "__main__":
     uvicorn.run("backend.main:app", host="127.0.0.1", port=8000, reload=True)
@@ -0,0 +1,54 @@
+# backend/services/globe.py — serve the server-baked base texture / country-ID raster / id table
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, Optional
+import os, asyncio
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
+
+from ..utils.globe_bake import GLOBE_BAKE_DIR, bake_globe
+
+router = APIRouter()
+
+GLOBE_BAKE = os.getenv("GLOBE_BAKE", "1") != "0"   # 0 = 前端自己把 GeoJSON 畫成貼圖（舊做法）
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+_manifest: Optional[Dict[str, Any]] = None
+_error: Optional[str] = None
+
+async def start_globe_bake(geojson: Path) -> None:
+    """Startup hook: bake in a worker thread (reuses the cached files when the GeoJSON is unchanged)."""
+    global _manifest, _error
+    if not GLOBE_BAKE:
+        return
+    try:
+        _manifest = await asyncio.to_thread(bake_globe, geojson, GLOBE_BAKE_DIR)
+    except Exception as e:
+        _error = f"{type(e).__name__}: {e}"
+        print(f"[globe] WARN: bake failed, clients will rasterize the GeoJSON themselves: {_error}")
+
+@router.get("/globe")
+def globe_manifest(request: Request):
+    """
+    {width, height, base, ids, encoding, countries}; base/ids are URLs of
+    immutable PNGs, countries[id - 1] = [name, iso3, bbox] where id is the
+    RGB-encoded pixel value of the ID raster (R = low byte, 0 = ocean).
+    """
+    if _manifest is None:
+        # 還沒烤好（或關掉）：前端改走舊的 GeoJSON 路徑
+        raise HTTPException(status_code=503, detail=_error or ("disabled" if not GLOBE_BAKE else "baking"),
+                            headers={"Retry-After": "5"})
+    etag = f'"{_manifest["key"]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    body = {**_manifest, "base": f"/api/globe/{_manifest['base']}", "ids": f"/api/globe/{_manifest['ids']}"}
+    return JSONResponse(body, headers=headers)
+
+@router.get("/globe/{name}")
+def globe_file(name: str):
+    if _manifest is None or name not in (_manifest["base"], _manifest["ids"]):
+        raise HTTPException(status_code=404, detail="not found")
+    # 檔名含內容 hash：永久快取
+    return FileResponse(GLOBE_BAKE_DIR / name, media_type="image/png", headers={"Cache-Control": IMMUTABLE})
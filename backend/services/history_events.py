@@ -1,15 +1,39 @@
 from __future__ import annotations
 
+import argparse
+import asyncio
+import importlib.util
 import json
+import os
 import re
-from typing import Dict, List, Optional
-from urllib.parse import urlencode, urljoin
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing as mp
+from contextlib import aclosing
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
 
-import requests
 from bs4 import BeautifulSoup, NavigableString, Tag
 
+from ..utils.breaker import _percentile
+from ..utils.cache import TTLCache
+from ..utils.events_index import EventsIndex, norm_query, open_events_index
+from ..utils.http import get_client
+from ..utils.ratelimit import RateLimiter
+from ..utils.streaming import STREAM_FORMATS, STREAM_HEADERS
+
 
 BASE_URL = "https://www.worldhistory.org"
+EVENTS_CACHE_TTL = float(os.getenv("EVENTS_CACHE_TTL", str(6 * 3600)))
+EVENTS_CACHE_MAX = int(os.getenv("EVENTS_CACHE_MAX", "2000"))
+
+# 只快取成功的結果；key = ("events", 小寫地名, only_textual)
+_cache = TTLCache(EVENTS_CACHE_MAX, EVENTS_CACHE_TTL)
 
 
 def _clean_text(s: str) -> str:
@@ -17,34 +41,120 @@ def _clean_text(s: str) -> str:
     return re.sub(r"\s+", " ", (s or "").strip())
 
 
+# ===================== Parser backends =====================
+# auto = 有 selectolax 用 selectolax，其次 lxml，最後退回純 Python 的 html.parser
+EVENTS_PARSER = os.getenv("EVENTS_PARSER", "auto")   # auto | selectolax | lxml | html.parser
+
+try:
+    from selectolax.lexbor import LexborHTMLParser  # pip install selectolax
+    _HAS_SELECTOLAX = True
+except ImportError:
+    _HAS_SELECTOLAX = False
+
+_HAS_LXML = importlib.util.find_spec("lxml") is not None   # BeautifulSoup 的 "lxml" tree builder
+
+
+def available_parsers() -> List[str]:
+    """Fastest first."""
+    out = []
+    if _HAS_SELECTOLAX:
+        out.append("selectolax")
+    if _HAS_LXML:
+        out.append("lxml")
+    out.append("html.parser")
+    return out
+
+
+_default_parser: Optional[str] = None
+
+
+def resolve_parser(name: Optional[str] = None) -> str:
+    """Parser to use for `name` (None = EVENTS_PARSER, resolved once)."""
+    global _default_parser
+    if name is None:
+        if _default_parser is None:
+            _default_parser = resolve_parser(EVENTS_PARSER or "auto")
+        return _default_parser
+    name = name.strip()
+    avail = available_parsers()
+    if name == "auto":
+        return avail[0]
+    if name not in avail:
+        print(f"[events] parser {name!r} not available, using {avail[0]}")
+        return avail[0]
+    return name
+
+
+def _split_author(type_text: str, author: Optional[str]) -> (Optional[str], Optional[str]):
+    if author is not None:
+        # 移除 "by " 開頭的字樣
+        author = re.sub(r"^\s*by\s+", "", _clean_text(author), flags=re.I)
+    return _clean_text(type_text), author
+
+
 def _extract_type_and_author(ci_type_name_el: Optional[Tag]) -> (Optional[str], Optional[str]):
     """
     節點長相大致為：
       <div class="ci_type_name">
         Image <span class="ci_author">by Taipei: National Palace Museum</span>
       </div>
-    需要把 type 與 author 拆開。
+    需要把 type 與 author 拆開：直接在原本的樹上跳過 author 的文字，不再重新 parse。
     """
     if not ci_type_name_el:
         return None, None
-
-    author = None
     author_el = ci_type_name_el.select_one(".ci_author")
-    if author_el:
-        author = _clean_text(author_el.get_text())
-        # 移除 "by " 開頭的字樣
-        author = re.sub(r"^\s*by\s+", "", author, flags=re.I)
+    if author_el is None:
+        return _split_author(ci_type_name_el.get_text(), None)
+    skip = {id(t) for t in author_el.strings}
+    type_text = "".join(t for t in ci_type_name_el.strings if id(t) not in skip)
+    return _split_author(type_text, author_el.get_text())
+
+
+def _slx_text_without(node, skip_id: int) -> str:
+    # selectolax：逐層收集文字節點，跳過 author 子樹
+    out = []
+    for child in node.iter(include_text=True):
+        if child.mem_id == skip_id:
+            continue
+        out.append(child.text(deep=False) if child.tag == "-text" else _slx_text_without(child, skip_id))
+    return "".join(out)
 
-    # 拿掉 author 子節點後取剩餘純文字當型別名稱
-    tmp = ci_type_name_el.encode_contents().decode("utf-8")
-    if author_el:
-        tmp = tmp.replace(str(author_el), "")
-    type_text = BeautifulSoup(tmp, "html.parser").get_text()
-    return _clean_text(type_text), author
 
+def _type_id(raw: Optional[str]) -> Optional[int]:
+    # 1=Definition, 2=Article, 3=Image (據頁面 data-ci-type-id 屬性)
+    try:
+        return int(raw) if raw is not None else None
+    except ValueError:
+        return None
 
-def _parse_search_html(html: str, only_textual: bool = True, base_url: str = BASE_URL) -> Dict:
-    soup = BeautifulSoup(html, "html.parser")
+
+def _item(href: str, title: Optional[str], type_name, author, ci_type_id, summary, image_url, base_url: str):
+    url = urljoin(base_url, href or "")
+    if not (title and url):
+        return None
+    return {
+        "title": title,
+        "summary": summary,
+        "url": url,
+        "image": urljoin(base_url, image_url) if image_url else None,
+        "author": author,
+        "type": type_name,
+        "ci_type_id": ci_type_id,
+    }
+
+
+def _result(query, items: List[Dict], next_page: Optional[str], base_url: str) -> Dict:
+    return {
+        "ok": True,
+        "query": query,
+        "count": len(items),
+        "next_page": urljoin(base_url, next_page) if next_page else None,
+        "items": items,
+    }
+
+
+def _parse_bs4(html: str, only_textual: bool, base_url: str, features: str) -> Dict:
+    soup = BeautifulSoup(html, features)
 
     # 解析查詢關鍵字
     query = None
@@ -54,128 +164,770 @@ def _parse_search_html(html: str, only_textual: bool = True, base_url: str = BAS
 
     items: List[Dict] = []
     for a in soup.select("#ci_search_results .ci_list .content_item"):
-        href = a.get("href") or ""
-        url = urljoin(base_url, href)
+        ci_type_id = _type_id(a.get("data-ci-type-id"))
+        # 只要文字內容的話，先過濾掉非 1/2，其餘欄位就不必解析
+        if only_textual and (ci_type_id not in (1, 2)):
+            continue
 
-        # 標題
         h3 = a.select_one(".ci_header h3")
-        title = _clean_text(h3.get_text()) if h3 else None
+        type_name, author = _extract_type_and_author(a.select_one(".ci_type_name"))
+        prev = a.select_one(".ci_preview")
+        img = a.select_one("img.ci_image")
+        item = _item(a.get("href"), _clean_text(h3.get_text()) if h3 else None, type_name, author, ci_type_id,
+                     _clean_text(prev.get_text(" ")) if prev else None, img.get("src") if img else None, base_url)
+        if item:
+            items.append(item)
 
-        # 內容型別 + 作者
-        type_name_el = a.select_one(".ci_type_name")
-        type_name, author = _extract_type_and_author(type_name_el)
+    # 解析下一頁
+    next_link_el = soup.select_one('nav.pagination a[rel*="next"]')
+    return _result(query, items, next_link_el.get("href") if next_link_el else None, base_url)
 
-        # type id
-        # 1=Definition, 2=Article, 3=Image (據頁面 data-ci-type-id 屬性)
-        ci_type_id_raw = a.get("data-ci-type-id")
-        try:
-            ci_type_id = int(ci_type_id_raw) if ci_type_id_raw is not None else None
-        except ValueError:
-            ci_type_id = None
 
-        # 只要文字內容的話，過濾掉非 1/2
+def _parse_selectolax(html: str, only_textual: bool, base_url: str) -> Dict:
+    tree = LexborHTMLParser(html)
+
+    q_el = tree.css_first('#content_main form input[name="q"]')
+    query = (q_el.attributes.get("value") or None) if q_el else None
+
+    items: List[Dict] = []
+    for a in tree.css("#ci_search_results .ci_list .content_item"):
+        attrs = a.attributes
+        ci_type_id = _type_id(attrs.get("data-ci-type-id"))
         if only_textual and (ci_type_id not in (1, 2)):
             continue
 
-        # 摘要
-        prev = a.select_one(".ci_preview")
-        summary = _clean_text(prev.get_text(" ")) if prev else None
+        h3 = a.css_first(".ci_header h3")
+        type_name = author = None
+        type_el = a.css_first(".ci_type_name")
+        if type_el is not None:
+            author_el = type_el.css_first(".ci_author")
+            if author_el is None:
+                type_name, author = _split_author(type_el.text(deep=True), None)
+            else:
+                type_name, author = _split_author(_slx_text_without(type_el, author_el.mem_id),
+                                                  author_el.text(deep=True))
+        prev = a.css_first(".ci_preview")
+        img = a.css_first("img.ci_image")
+        item = _item(attrs.get("href"), _clean_text(h3.text(deep=True)) if h3 else None, type_name, author,
+                     ci_type_id, _clean_text(prev.text(deep=True, separator=" ")) if prev else None,
+                     img.attributes.get("src") if img else None, base_url)
+        if item:
+            items.append(item)
+
+    next_link_el = tree.css_first('nav.pagination a[rel*="next"]')
+    return _result(query, items, next_link_el.attributes.get("href") if next_link_el else None, base_url)
+
+
+def _parse_search_html(html: str, only_textual: bool = True, base_url: str = BASE_URL,
+                       parser: Optional[str] = None) -> Dict:
+    parser = resolve_parser(parser)
+    if parser == "selectolax":
+        return _parse_selectolax(html, only_textual, base_url)
+    return _parse_bs4(html, only_textual, base_url, parser)
+
+
+# ===================== Parse execution =====================
+# inline = 事件迴圈上直接解析；thread = to_thread（仍受 GIL 影響）；process = 常駐的 process pool
+# auto = selectolax 夠快（~1 ms/頁）就 inline，BeautifulSoup 系列才送 process pool
+EVENTS_PARSE_MODE = os.getenv("EVENTS_PARSE_MODE", "auto")   # auto | inline | thread | process
+EVENTS_PARSE_WORKERS = int(os.getenv("EVENTS_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+EVENTS_PARSE_QUEUE = int(os.getenv("EVENTS_PARSE_QUEUE", "0")) or EVENTS_PARSE_WORKERS * 4   # 同時送進 pool 的上限
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()   # 第一批並發請求同時懶啟動時只建一個 pool
+_pool_sem: Optional[asyncio.Semaphore] = None
+_timings: Dict[str, deque] = {k: deque(maxlen=200) for k in ("fetch", "parse", "parse_cpu")}
+
+
+def parse_mode() -> str:
+    mode = EVENTS_PARSE_MODE.strip().lower()
+    if mode == "auto":
+        return "inline" if resolve_parser() == "selectolax" else "process"
+    return mode if mode in ("inline", "thread", "process") else "thread"
+
+
+def _parse_timed(html: str, only_textual: bool, base_url: str, parser: str) -> Tuple[Dict, float]:
+    # 在 worker 內計時：和外面量到的差就是排隊 + 序列化的成本
+    t0 = time.perf_counter()
+    data = _parse_search_html(html, only_textual=only_textual, base_url=base_url, parser=parser)
+    return data, time.perf_counter() - t0
+
+
+def _worker_init(parser: str) -> None:
+    # 先 import 並跑一次解析器，第一個真正的請求就不必付這筆
+    _parse_search_html("<html></html>", parser=parser)
+
+
+def start_parse_pool() -> Optional[ProcessPoolExecutor]:
+    """Startup hook: spawn the parse workers now (no-op unless the mode is process)."""
+    global _pool
+    if parse_mode() != "process" or _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is not None:
+            return _pool
+        # spawn 而不是 fork：主行程已有事件迴圈與執行緒，fork 容易帶著鎖進子行程
+        pool = ProcessPoolExecutor(max_workers=EVENTS_PARSE_WORKERS, mp_context=mp.get_context("spawn"),
+                                   initializer=_worker_init, initargs=(resolve_parser(),))
+        for f in [pool.submit(time.sleep, 0.05) for _ in range(EVENTS_PARSE_WORKERS)]:
+            f.result()   # 每個 worker 都啟動起來
+        _pool = pool   # 全部就緒才公開，其他請求不會拿到半啟動的 pool
+    print(f"[events] Parse pool ready: {EVENTS_PARSE_WORKERS} workers ({resolve_parser()})")
+    return _pool
+
+
+def shutdown_parse_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _run_parse(html: str, only_textual: bool) -> Tuple[Dict, float, str]:
+    """(data, cpu seconds in the parser, mode actually used)."""
+    global _pool_sem
+    mode, parser = parse_mode(), resolve_parser()
+    if mode == "inline":
+        return (*_parse_timed(html, only_textual, BASE_URL, parser), mode)
+    if mode == "process":
+        if _pool is None:
+            await asyncio.to_thread(start_parse_pool)
+        if _pool_sem is None:
+            _pool_sem = asyncio.Semaphore(EVENTS_PARSE_QUEUE)
+        async with _pool_sem:
+            try:
+                loop = asyncio.get_running_loop()
+                return (*await loop.run_in_executor(_pool, _parse_timed, html, only_textual, BASE_URL, parser), mode)
+            except BrokenProcessPool as e:
+                # worker 掛了：這次改用執行緒，下次請求重建 pool
+                print("[events] parse pool broken, rebuilding:", e)
+                shutdown_parse_pool()
+                mode = "thread"
+    return (*await asyncio.to_thread(_parse_timed, html, only_textual, BASE_URL, parser), mode)
+
+
+def _timing_stats() -> Dict[str, Any]:
+    out = {}
+    for k, d in _timings.items():
+        vals = sorted(d)
+        out[k] = {"p50": _ms(_percentile(vals, 0.5)), "p90": _ms(_percentile(vals, 0.9)), "n": len(vals)}
+    return out
+
+
+def _ms(v: Optional[float]) -> Optional[float]:
+    return round(v * 1000, 2) if v is not None else None
+
+
+# ===================== Local index (SQLite FTS5) =====================
+# 每次成功解析的結果都收進本地全文索引；熱門地點直接由索引回答（毫秒級），
+# 過期才在背景重抓；worldhistory.org 慢或擋 UA 時也能用索引頂著
+EVENTS_INDEX_DB = os.getenv(
+    "EVENTS_INDEX_DB", str(Path(__file__).resolve().parents[2] / ".cache" / "events_index.sqlite3"))
+EVENTS_INDEX_MODE = os.getenv("EVENTS_INDEX_MODE", "serve")   # serve | fallback | off
+EVENTS_INDEX_STALE = float(os.getenv("EVENTS_INDEX_STALE", str(7 * 24 * 3600)))   # 超過就背景重抓
+EVENTS_INDEX_LIMIT = int(os.getenv("EVENTS_INDEX_LIMIT", "60"))                   # 索引回答最多幾筆
+EVENTS_INDEX_REFRESH_PAGES = int(os.getenv("EVENTS_INDEX_REFRESH_PAGES", "3"))    # 背景重抓幾頁
+
+_index: Optional[EventsIndex] = None
+_index_opened = False
+_bg: set = set()                            # 背景 task 保留強參照，免得被 GC
+_refreshing: Dict[str, asyncio.Task] = {}   # 同一地點同時只重抓一次
+_ingesting: Dict[str, set] = {}             # 每個地點還沒寫完的分頁 ingest（記 harvest 前先等）
+_index_counts = {"served": 0, "fallback": 0, "refreshes": 0, "ingested": 0, "ingest_errors": 0}
+
+
+def _index_tier() -> Optional[EventsIndex]:
+    global _index, _index_opened
+    if EVENTS_INDEX_MODE == "off":
+        return None
+    if not _index_opened:
+        _index_opened = True
+        _index = open_events_index(EVENTS_INDEX_DB)
+    return _index
+
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.get_running_loop().create_task(coro)
+    _bg.add(task)
+    task.add_done_callback(_bg.discard)
+    return task
+
+
+async def _ingest(place: str, data: Dict) -> None:
+    idx = _index_tier()
+    if idx is None:
+        return
+    try:
+        _index_counts["ingested"] += await idx.aingest(place, data.get("items") or [])
+    except sqlite3.Error as e:
+        _index_counts["ingest_errors"] += 1
+        print(f"[events-index] WARN: ingest {place!r} failed: {e}")
+
+
+def _spawn_ingest(place: str, data: Dict) -> None:
+    key = norm_query(place)
+    pending = _ingesting.setdefault(key, set())
+    task = _spawn(_ingest(place, data))
+    pending.add(task)
+
+    def done(t: asyncio.Task) -> None:
+        pending.discard(t)
+        if not pending and _ingesting.get(key) is pending:
+            _ingesting.pop(key, None)
+    task.add_done_callback(done)
+
+
+async def _record_harvest(place: str, count: int, only_textual: bool) -> None:
+    # 每頁的 items 都寫進去之後，才把這個地點標成「收過」
+    idx = _index_tier()
+    if idx is None:
+        return
+    pending = list(_ingesting.get(norm_query(place), ()))
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    try:
+        await idx.arecord_harvest(place, count, textual=only_textual)
+    except sqlite3.Error as e:
+        _index_counts["ingest_errors"] += 1
+        print(f"[events-index] WARN: record harvest {place!r} failed: {e}")
 
-        # 縮圖
-        img = a.select_one("img.ci_image")
-        image_url = img.get("src") if img else None
-        if image_url:
-            image_url = urljoin(base_url, image_url)
-
-        if title and url:
-            items.append({
-                "title": title,
-                "summary": summary,
-                "url": url,
-                "image": image_url,
-                "author": author,
-                "type": type_name,
-                "ci_type_id": ci_type_id,
-            })
 
-    # 解析下一頁
-    next_link_el = soup.select_one('nav.pagination a[rel*="next"]')
-    next_page = next_link_el.get("href") if next_link_el else None
-    if next_page:
-        next_page = urljoin(base_url, next_page)
+async def _refresh(place: str) -> None:
+    # 抓全部類型，之後 only_textual=False 的查詢也能由索引回答
+    _index_counts["refreshes"] += 1
+    try:
+        async with aclosing(iter_event_pages(place, only_textual=False, pages=EVENTS_INDEX_REFRESH_PAGES,
+                                             fresh=True)) as it:
+            async for data in it:
+                if not data.get("ok") and data["page"] == 1:
+                    print(f"[events-index] WARN: refresh {place!r} failed: {data.get('error')}")
+                    return
+    except Exception as e:
+        print(f"[events-index] WARN: refresh {place!r} failed: {type(e).__name__}: {e}")
 
+
+def _schedule_refresh(place: str) -> None:
+    key = norm_query(place)
+    if key in _refreshing:
+        return
+    task = _spawn(_refresh(place))
+    _refreshing[key] = task
+    task.add_done_callback(lambda _: _refreshing.pop(key, None))
+
+
+async def search_index(place: str, *, only_textual: bool = True, limit: Optional[int] = None,
+                       harvested_only: bool = True) -> Optional[Dict]:
+    """
+    Answer from the local index, BM25-ranked, in the same shape as a live
+    search plus `source: "index"` and `index {harvested_at, age_s, stale}`.
+    None when the index is off, or when `harvested_only` and this place was
+    never harvested (for this only_textual setting), or nothing matches.
+    """
+    idx = _index_tier()
+    if idx is None:
+        return None
+    t0 = time.perf_counter()
+    try:
+        at, items = await idx.alookup(place, only_textual=only_textual, limit=limit or EVENTS_INDEX_LIMIT)
+    except sqlite3.Error as e:
+        print(f"[events-index] WARN: lookup {place!r} failed: {e}")
+        return None
+    if at is None and (harvested_only or not items):
+        return None
+    age = time.time() - at if at is not None else None
+    dt = _ms(time.perf_counter() - t0)
     return {
         "ok": True,
-        "query": query,
+        "query": place,
         "count": len(items),
-        "next_page": next_page,
+        "next_page": None,
         "items": items,
+        "source": "index",
+        "index": {"harvested_at": at, "age_s": round(age, 1) if age is not None else None,
+                  "stale": age is None or age > EVENTS_INDEX_STALE},
+        "timing": {"cached": False, "index_ms": dt, "total_ms": dt},
     }
 
 
-def search_history_events(place: str, *, only_textual: bool = True, timeout: int = 12) -> Dict:
+async def _index_first(place: str, only_textual: bool, limit: Optional[int], source: str) -> Optional[Dict]:
+    # source: auto = serve 模式下先查索引；index = 只查索引；live = 不查
+    if source == "index":
+        return await search_index(place, only_textual=only_textual, limit=limit, harvested_only=False)
+    if source != "auto" or EVENTS_INDEX_MODE != "serve":
+        return None
+    hit = await search_index(place, only_textual=only_textual, limit=limit)
+    if hit is not None:
+        _index_counts["served"] += 1
+        if hit["index"]["stale"]:
+            _schedule_refresh(place)
+    return hit
+
+
+async def _index_fallback(place: str, only_textual: bool, limit: Optional[int], source: str,
+                          error: str) -> Optional[Dict]:
+    # 線上抓取失敗（逾時、被擋、5xx）：索引裡有相關結果就先用
+    if source != "auto":
+        return None
+    hit = await search_index(place, only_textual=only_textual, limit=limit, harvested_only=False)
+    if hit is not None:
+        _index_counts["fallback"] += 1
+        hit["live_error"] = error
+    return hit
+
+
+def _index_stats() -> Dict[str, Any]:
+    idx = _index_tier()
+    out = {"mode": EVENTS_INDEX_MODE, "stale_after_s": EVENTS_INDEX_STALE, "refreshing": len(_refreshing),
+           **_index_counts}
+    if idx is not None:
+        try:
+            out.update(idx.stats())
+        except sqlite3.Error as e:
+            out["error"] = str(e)
+    return out
+
+
+# ===================== Fetch =====================
+EVENTS_MAX_PAGES = int(os.getenv("EVENTS_MAX_PAGES", "5"))                 # 一次最多抓幾頁
+EVENTS_PAGE_CONCURRENCY = int(os.getenv("EVENTS_PAGE_CONCURRENCY", "3"))   # 後續頁同時抓幾頁
+EVENTS_PAGE_RATE = float(os.getenv("EVENTS_PAGE_RATE", "4"))               # 後續頁每秒最多幾個請求（全行程共用）
+
+# 第 1 頁不限速（使用者在等）；之後的頁數對 worldhistory.org 保持禮貌
+_page_limiter = RateLimiter(EVENTS_PAGE_RATE, burst=EVENTS_PAGE_CONCURRENCY)
+
+_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                "(KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.8",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Referer": f"{BASE_URL}/search/",
+}
+
+
+def _page_param(next_page: str) -> Optional[str]:
+    # 從第 2 頁的連結找出分頁參數名（值為 "2" 的那個），例如 page=2
+    for k, v in parse_qsl(urlsplit(next_page).query):
+        if v == "2":
+            return k
+    return None
+
+
+def _with_page(url: str, param: str, page: int) -> str:
+    parts = urlsplit(url)
+    qs = [(k, str(page) if k == param else v) for k, v in parse_qsl(parts.query)]
+    return urlunsplit(parts._replace(query=urlencode(qs)))
+
+
+async def fetch_events_page(place: str, page: int = 1, *, only_textual: bool = True, timeout: int = 12,
+                            url: Optional[str] = None, fresh: bool = False) -> Dict:
+    """
+    One search-result page (cached per page); `url` overrides the page-1
+    search URL, `fresh` skips the memory cache. Parsed items also go into
+    the local index in the background; the harvest itself is recorded by
+    the caller once every page is in.
+    """
+    t_start = time.perf_counter()
+    key = ("events", place.lower(), bool(only_textual)) + ((page,) if page > 1 else ())
+    hit = None if fresh else _cache.get(key)
+    if hit is not None:
+        return {**hit, "page": page, "timing": {"cached": True, "total_ms": _ms(time.perf_counter() - t_start)}}
+
+    url = url or f"{BASE_URL}/search/?{urlencode({'q': place})}"
+    # 共用連線池：保持連線，不再每次重做 TLS 握手
+    cli = await get_client()
+    t_fetch = time.perf_counter()
+    resp = await cli.get(url, headers=_HEADERS, timeout=timeout)
+    fetch_s = time.perf_counter() - t_fetch
+    if resp.status_code != 200:
+        return {"ok": False, "error": f"HTTP {resp.status_code}", "url": url, "page": page}
+
+    # 解析是 CPU 工作：依 EVENTS_PARSE_MODE 在事件迴圈、執行緒或 process pool 上跑
+    html = resp.text
+    t_parse = time.perf_counter()
+    data, cpu_s, mode = await _run_parse(html, only_textual)
+    parse_s = time.perf_counter() - t_parse
+    _timings["fetch"].append(fetch_s)
+    _timings["parse"].append(parse_s)
+    _timings["parse_cpu"].append(cpu_s)
+    if data.get("ok"):
+        _cache.set(key, data)
+        _spawn_ingest(place, data)
+    return {**data, "page": page, "timing": {
+        "cached": False,
+        "fetch_ms": _ms(fetch_s),
+        "parse_ms": _ms(parse_s),          # 含排隊與跨行程傳遞
+        "parse_cpu_ms": _ms(cpu_s),        # 解析器本身
+        "bytes": len(html),
+        "mode": mode,
+        "parser": resolve_parser(),
+        "total_ms": _ms(time.perf_counter() - t_start),
+    }}
+
+
+async def iter_event_pages(place: str, *, only_textual: bool = True, pages: int = 1,
+                           timeout: int = 12, fresh: bool = False) -> AsyncIterator[Dict]:
+    """
+    Page 1 first; then pages 2..`pages` fetched concurrently (at most
+    EVENTS_PAGE_CONCURRENCY at once, EVENTS_PAGE_RATE per second) and
+    yielded as each one finishes. A failed later page is yielded with
+    ok=False instead of raising. Closing the generator cancels what is left.
+    Only when every page came back ok and the generator ran to the end is
+    the place recorded as harvested in the local index (total item count).
+    """
+    seen: set = set()
+    complete = True
+    async with aclosing(_iter_pages(place, only_textual=only_textual, pages=pages, timeout=timeout,
+                                    fresh=fresh)) as it:
+        async for data in it:
+            complete = complete and bool(data.get("ok"))
+            seen.update(i["url"] for i in data.get("items") or [])
+            yield data
+    if complete:
+        _spawn(_record_harvest(place, len(seen), only_textual))
+
+
+async def _iter_pages(place: str, *, only_textual: bool, pages: int, timeout: int,
+                      fresh: bool) -> AsyncIterator[Dict]:
+    pages = max(1, min(int(pages), EVENTS_MAX_PAGES))
+    first = await fetch_events_page(place, 1, only_textual=only_textual, timeout=timeout, fresh=fresh)
+    yield first
+    nxt = first.get("next_page") if first.get("ok") else None
+    if pages == 1 or not nxt:
+        return
+
+    async def one(n: int, url: str) -> Dict:
+        await _page_limiter.acquire()
+        try:
+            return await fetch_events_page(place, n, only_textual=only_textual, timeout=timeout, url=url,
+                                           fresh=fresh)
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}", "page": n}
+
+    param = _page_param(nxt)
+    if param is None:
+        # 不認得的分頁格式：只能照 next 連結一頁一頁走
+        for n in range(2, pages + 1):
+            data = await one(n, nxt)
+            yield data
+            nxt = data.get("next_page") if data.get("ok") else None
+            if not nxt:
+                return
+        return
+
+    sem = asyncio.Semaphore(max(1, EVENTS_PAGE_CONCURRENCY))
+
+    async def bounded(n: int) -> Dict:
+        async with sem:
+            return await one(n, _with_page(nxt, param, n))
+
+    tasks = [asyncio.create_task(bounded(n)) for n in range(2, pages + 1)]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for t in tasks:
+            t.cancel()
+
+
+def _new_items(data: Dict, seen: set) -> List[Dict]:
+    # 跨頁以 URL 去重（同一篇文章可能出現在兩頁）
+    out = []
+    for it in data.get("items") or []:
+        if it["url"] not in seen:
+            seen.add(it["url"])
+            out.append(it)
+    return out
+
+
+async def search_history_events(place: str, *, only_textual: bool = True, timeout: int = 12,
+                                pages: int = 1, limit: Optional[int] = None, source: str = "auto") -> Dict:
     """
     主函式：給定地點字串（如 'taipei'），回傳結構化 JSON（dict）。
+    pages > 1 時合併多頁結果（以 URL 去重），limit 限制總筆數。
+    source：auto（依 EVENTS_INDEX_MODE 用本地索引）、live（只抓線上）、index（只查索引）。
     """
     place = (place or "").strip()
     if not place:
         return {"ok": False, "error": "empty place"}
+    hit = await _index_first(place, only_textual, limit, source)
+    if hit is not None:
+        return hit
+    if source == "index":
+        return {"ok": False, "error": "not in local index"}
+    try:
+        data = await _search_live(place, only_textual=only_textual, timeout=timeout, pages=pages, limit=limit)
+    except Exception as e:
+        fb = await _index_fallback(place, only_textual, limit, source, f"{type(e).__name__}: {e}")
+        if fb is None:
+            raise
+        return fb
+    if not data.get("ok"):
+        fb = await _index_fallback(place, only_textual, limit, source, data.get("error", "fetch failed"))
+        if fb is not None:
+            return fb
+    return data
 
-    url = f"{BASE_URL}/search/?{urlencode({'q': place})}"
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                    "(KHTML, like Gecko) Chrome/124.0 Safari/537.36",
-        "Accept-Language": "en-US,en;q=0.8",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-        "Referer": f"{BASE_URL}/search/",
-        "Connection": "close",
-    }
-    resp = requests.get(url, headers=headers, timeout=timeout)
-    if resp.status_code != 200:
-        return {"ok": False, "error": f"HTTP {resp.status_code}", "url": url}
 
-    return _parse_search_html(resp.text, only_textual=only_textual, base_url=BASE_URL)
+async def _search_live(place: str, *, only_textual: bool, timeout: int, pages: int,
+                       limit: Optional[int]) -> Dict:
+    if pages <= 1 and not limit:
+        data = await fetch_events_page(place, 1, only_textual=only_textual, timeout=timeout)
+        if data.get("ok"):
+            _spawn(_record_harvest(place, data.get("count", 0), only_textual))
+        return data
+
+    t_start = time.perf_counter()
+    items: List[Dict] = []
+    seen: set = set()
+    first: Optional[Dict] = None
+    last_page: Dict = {}
+    page_timing = []
+    async with aclosing(iter_event_pages(place, only_textual=only_textual, pages=pages, timeout=timeout)) as it:
+        async for data in it:
+            if first is None:
+                first = data
+                if not data.get("ok"):
+                    return data
+            if data.get("ok") and data["page"] >= last_page.get("page", 0):
+                last_page = data
+            page_timing.append({"page": data["page"], "ok": data.get("ok", False), **(data.get("timing") or {})})
+            items.extend(_new_items(data, seen))
+            if limit and len(items) >= limit:
+                break
+    items = items[:limit] if limit else items
+    return {
+        "ok": True,
+        "query": first.get("query"),
+        "count": len(items),
+        "next_page": last_page.get("next_page"),
+        "pages": sorted(t["page"] for t in page_timing if t["ok"]),
+        "items": items,
+        "timing": {"total_ms": _ms(time.perf_counter() - t_start), "pages": page_timing},
+    }
 
 
-def parse_from_html_string(html: str, *, only_textual: bool = True) -> Dict:
+def parse_from_html_string(html: str, *, only_textual: bool = True, parser: Optional[str] = None) -> Dict:
     """
     若你已經離線存了 HTML（例如測試用的 history_test.txt），可用這個函式直接解析。
+    parser 預設照 EVENTS_PARSER（auto = 最快的可用解析器）。
     """
     if not html:
         return {"ok": False, "error": "empty html"}
-    return _parse_search_html(html, only_textual=only_textual, base_url=BASE_URL)
+    return _parse_search_html(html, only_textual=only_textual, base_url=BASE_URL, parser=parser)
 
 
 # --- FastAPI Router（加 GET 方便測，強化 headers） ---
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 
 router = APIRouter()
 
 class EventsReq(BaseModel):
     place: str
     only_textual: bool = True
+    pages: int = 1                # 抓幾頁（上限 EVENTS_MAX_PAGES）
+    limit: Optional[int] = None   # 最多回傳幾筆
+    source: str = Field("auto", pattern="^(auto|live|index)$")   # index = 本地全文索引
+
+
+def _server_timing(response: Response, data: Dict) -> None:
+    # 瀏覽器 DevTools 的 Timing 分頁直接看得到 fetch / parse 各花多少
+    t = data.get("timing") or {}
+    parts = [f"{k};dur={t[k + '_ms']}" for k in ("fetch", "parse", "parse_cpu", "index")
+             if t.get(k + "_ms") is not None]
+    parts.append(f"total;dur={t.get('total_ms', 0)}" + (';desc="cache"' if t.get("cached") else ""))
+    response.headers["Server-Timing"] = ", ".join(parts)
+
 
 @router.post("/history/events")
-def history_events_api(req: EventsReq):
+async def history_events_api(req: EventsReq, response: Response):
     try:
-        data = search_history_events(req.place, only_textual=req.only_textual)
+        data = await search_history_events(req.place, only_textual=req.only_textual,
+                                           pages=req.pages, limit=req.limit, source=req.source)
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
     if not data.get("ok"):
-        raise HTTPException(status_code=502, detail=data.get("error", "fetch failed"))
+        raise HTTPException(status_code=404 if req.source == "index" else 502,
+                            detail=data.get("error", "fetch failed"))
+    _server_timing(response, data)
     return data
 
 # 方便用瀏覽器直接打：/api/history/events?place=Taipei
 @router.get("/history/events")
-def history_events_api_get(
+async def history_events_api_get(
+    response: Response,
     place: str = Query(..., min_length=1),
-    only_textual: bool = Query(True)
+    only_textual: bool = Query(True),
+    pages: int = Query(1, ge=1),
+    limit: Optional[int] = Query(None, ge=1),
+    source: str = Query("auto", pattern="^(auto|live|index)$"),
 ):
     try:
-        data = search_history_events(place, only_textual=only_textual)
+        data = await search_history_events(place, only_textual=only_textual, pages=pages, limit=limit,
+                                           source=source)
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
     if not data.get("ok"):
-        raise HTTPException(status_code=502, detail=data.get("error", "fetch failed"))
+        raise HTTPException(status_code=404 if source == "index" else 502,
+                            detail=data.get("error", "fetch failed"))
+    _server_timing(response, data)
     return data
+
+def _stream_events(req: EventsReq, fmt: str) -> StreamingResponse:
+    """
+    Events: item {page, item} as soon as its page parses (deduplicated by
+    URL across pages), page {page, count, timing} after each page,
+    then done {count, pages}. Page 1 failing sends error {error}; a later
+    page failing sends page {page, ok: false, error} and the rest continues.
+    Answers from the local index arrive the same way, as a single page 1
+    with meta {source: "index"}.
+    """
+    encode, media_type = STREAM_FORMATS[fmt]
+    place = (req.place or "").strip()
+
+    def from_index(data: Dict):
+        yield encode("meta", {"query": place, "pages": 1, "source": "index", "index": data["index"],
+                              **({"live_error": data["live_error"]} if "live_error" in data else {})})
+        for item in data["items"]:
+            yield encode("item", {"page": 1, "item": item})
+        yield encode("page", {"page": 1, "ok": True, "count": data["count"], "timing": data["timing"]})
+        yield encode("done", {"count": data["count"], "pages": [1]})
+
+    async def events():
+        seen: set = set()
+        sent, done_pages = 0, []
+        hit = await _index_first(place, req.only_textual, req.limit, req.source)
+        if hit is not None:
+            for chunk in from_index(hit):
+                yield chunk
+            return
+        if req.source == "index":
+            yield encode("error", {"error": "not in local index"})
+            return
+        try:
+            async with aclosing(iter_event_pages(place, only_textual=req.only_textual, pages=req.pages)) as it:
+                async for data in it:
+                    page = data["page"]
+                    if not data.get("ok"):
+                        if page == 1:
+                            err = data.get("error", "fetch failed")
+                            fb = await _index_fallback(place, req.only_textual, req.limit, req.source, err)
+                            for chunk in from_index(fb) if fb else [encode("error", {"error": err})]:
+                                yield chunk
+                            return
+                        yield encode("page", {"page": page, "ok": False, "error": data.get("error")})
+                        continue
+                    if page == 1:
+                        yield encode("meta", {"query": data.get("query") or place, "source": "live",
+                                              "pages": min(req.pages, EVENTS_MAX_PAGES)})
+                    new = _new_items(data, seen)
+                    if req.limit:
+                        new = new[:max(0, req.limit - sent)]
+                    for item in new:
+                        # item 自己有 "type" 欄位：包一層，不和事件類型衝突
+                        yield encode("item", {"page": page, "item": item})
+                    sent += len(new)
+                    done_pages.append(page)
+                    yield encode("page", {"page": page, "ok": True, "count": len(new), "timing": data.get("timing")})
+                    if req.limit and sent >= req.limit:
+                        break
+        except Exception as e:
+            fb = None if sent else await _index_fallback(place, req.only_textual, req.limit, req.source, str(e))
+            for chunk in from_index(fb) if fb else [encode("error", {"error": str(e)})]:
+                yield chunk
+            return
+        yield encode("done", {"count": sent, "pages": sorted(done_pages)})
+
+    if not place:
+        raise HTTPException(status_code=400, detail="empty place")
+    return StreamingResponse(events(), media_type=media_type, headers=STREAM_HEADERS)
+
+
+@router.post("/history/events/stream")
+async def history_events_stream(req: EventsReq, format: str = Query("ndjson", pattern="^(sse|ndjson)$")):
+    """Multi-page results streamed item by item (NDJSON by default)."""
+    return _stream_events(req, format)
+
+@router.get("/history/events/stream")
+async def history_events_stream_get(
+    place: str = Query(..., min_length=1),
+    only_textual: bool = Query(True),
+    pages: int = Query(3, ge=1),
+    limit: Optional[int] = Query(None, ge=1),
+    source: str = Query("auto", pattern="^(auto|live|index)$"),
+    format: str = Query("ndjson", pattern="^(sse|ndjson)$"),
+):
+    return _stream_events(EventsReq(place=place, only_textual=only_textual, pages=pages, limit=limit,
+                                    source=source), format)
+
+@router.get("/history/events/stats")
+def history_events_stats():
+    return {
+        "cache": _cache.stats(),
+        "parser": resolve_parser(),
+        "available_parsers": available_parsers(),
+        "parse_mode": parse_mode(),
+        "pool": {"workers": EVENTS_PARSE_WORKERS, "running": _pool is not None, "max_inflight": EVENTS_PARSE_QUEUE},
+        "timing_ms": _timing_stats(),
+        "pages": {"max": EVENTS_MAX_PAGES, "concurrency": EVENTS_PAGE_CONCURRENCY, "rate": EVENTS_PAGE_RATE,
+                  "throttled_s": round(_page_limiter.waited, 2)},
+        "index": _index_stats(),
+    }
+
+
+# ---------- parse-only benchmark ----------
+# 存下來的 WorldHistory 搜尋頁（bench 沒給檔案時就用這些）
+BENCH_FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+
+def bench_parsers(paths: List[str], parsers: Optional[List[str]] = None, *,
+                  repeat: int = 10, only_textual: bool = True) -> List[Dict]:
+    """
+    Parse saved search pages with each backend via parse_from_html_string.
+    No network. Each row reports items/s and whether the output matches
+    the html.parser baseline.
+    """
+    docs = []
+    for p in paths:
+        with open(p, encoding="utf-8") as f:
+            docs.append(f.read())
+    parsers = parsers or available_parsers()
+    baseline = [parse_from_html_string(h, only_textual=only_textual, parser="html.parser") for h in docs]
+    rows = []
+    for name in parsers:
+        out = [parse_from_html_string(h, only_textual=only_textual, parser=name) for h in docs]   # 暖身 + 比對
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            for h in docs:
+                parse_from_html_string(h, only_textual=only_textual, parser=name)
+        dt = time.perf_counter() - t0
+        n_items = sum(d.get("count", 0) for d in out) * repeat
+        rows.append({
+            "parser": resolve_parser(name),
+            "docs": len(docs) * repeat,
+            "items": n_items,
+            "seconds": round(dt, 4),
+            "ms_per_doc": round(dt * 1000 / max(1, len(docs) * repeat), 3),
+            "items_per_s": round(n_items / dt) if dt > 0 else None,
+            "matches_baseline": out == baseline,
+        })
+    return rows
+
+
+# python -m backend.services.history_events bench backend/services/fixtures/*.html --repeat 20
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="WorldHistory search-page tools")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench", help="parse-only benchmark over saved HTML")
+    b.add_argument("files", nargs="*", help=f"saved search pages (default: {BENCH_FIXTURES}/*.html)")
+    b.add_argument("--parser", action="append", help="repeatable; default: every available parser")
+    b.add_argument("--repeat", type=int, default=10)
+    b.add_argument("--all-types", action="store_true", help="keep image results too (only_textual=False)")
+    args = ap.parse_args()
+
+    files = args.files or sorted(str(p) for p in BENCH_FIXTURES.glob("*.html"))
+    for row in bench_parsers(files, args.parser, repeat=args.repeat, only_textual=not args.all_types):
+        print(f"[events] {row['parser']:<12} {row['items_per_s'] or 0:>9} items/s  "
+              f"{row['ms_per_doc']:>8} ms/doc  match={row['matches_baseline']}")
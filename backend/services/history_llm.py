@@ -1,175 +1,380 @@
 from __future__ import annotations
-from typing import Optional
-import os
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import os, re, json, asyncio, hashlib, sqlite3, unicodedata
 from dotenv import load_dotenv
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 
+import httpx
 # --- OpenAI (Responses API) ---
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 
-# --- Google Gemini ---
-# pip install google-generativeai
-import google.generativeai as genai
+from ..utils.admission import AdmissionGate, QueueFull
+from ..utils.cache import MISS, TTLCache
+from ..utils.disk_cache import DiskCache, open_disk_cache
+from ..utils.llm import GeminiProvider, LLMError, LLMProvider, LLMRequest, LLMStream, OpenAIProvider, RoutingProfile
+from ..utils.singleflight import SingleFlight, StreamFlight
+from ..utils.streaming import STREAM_FORMATS, STREAM_HEADERS
+from .wiki_place import wikidata_names
 
 load_dotenv()
 router = APIRouter()
 
 # =========================
-# Gemini setup and helpers
+# Providers (long-lived clients)
 # =========================
 GEMINI_TOKEN = os.getenv("GEMINI_TOKEN")
 GEMINI_DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_DEFAULT_MODEL = "gpt-5"
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))   # 連線閒置多久才關（秒）
+LLM_PREWARM = os.getenv("LLM_PREWARM", "1") != "0"                       # 啟動時先把連線打開
 
+# 同一個 client / 連線池給所有 OpenAI 模型共用
+oa_client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20,
+                            keepalive_expiry=LLM_KEEPALIVE_EXPIRY)),
+)
 
-def _gemini_extract_text(resp) -> str:
-    """
-    Safely extract plain text from a Gemini response, even if Parts are present.
-    """
-    # 1) Aggregated .text from SDK
-    try:
-        t = getattr(resp, "text", None)
-        if t:
-            return t
-    except Exception:
-        pass
-    # 2) Fallback: manually join candidates' parts
-    try:
-        texts = []
-        for cand in getattr(resp, "candidates", []) or []:
-            content = getattr(cand, "content", None)
-            parts = getattr(content, "parts", None) if content else None
-            if parts:
-                for p in parts:
-                    pt = getattr(p, "text", None)
-                    if pt:
-                        texts.append(pt)
-        return "\n".join(texts).strip()
-    except Exception:
-        return ""
-
-
-def _gemini_chat(prompt: str, model: Optional[str] = None, temperature: float = 0.2) -> str:
-    """
-    Simple chat with Gemini. Returns plain text. Raises if API/key error.
-    Compatible with multiple google-generativeai SDK versions.
-    """
-    if not GEMINI_TOKEN:
-        raise RuntimeError(
-            "Missing GEMINI_TOKEN in environment. "
-            "Create one in Google AI Studio and set it in your .env."
-        )
-    genai.configure(api_key=GEMINI_TOKEN)
-    model_name = model or GEMINI_DEFAULT_MODEL
-    gmodel = genai.GenerativeModel(model_name=model_name)
-
-    gen_cfg = {"temperature": float(temperature)}
-    try:
-        resp = gmodel.generate_content(prompt, generation_config=gen_cfg)
-    except Exception as e:
-        # Some SDK versions are incompatible with generation_config; retry without it.
-        if "GenerationConfig" in str(e) or "generation_config" in str(e):
-            resp = gmodel.generate_content(prompt)
+# =========================================
+# Admission control: per-vendor concurrency + bounded queue
+# =========================================
+# LLM 呼叫全走 async client，不再佔用 threadpool；超出佇列就直接 429
+LLM_QUEUE_MAX_WAIT = float(os.getenv("LLM_QUEUE_MAX_WAIT", "20"))   # 排隊最多等幾秒
+_gates = {
+    "gemini": AdmissionGate("gemini", int(os.getenv("LLM_GEMINI_CONCURRENCY", "4")),
+                            int(os.getenv("LLM_GEMINI_QUEUE", "16")), LLM_QUEUE_MAX_WAIT),
+    "openai": AdmissionGate("openai", int(os.getenv("LLM_OPENAI_CONCURRENCY", "2")),
+                            int(os.getenv("LLM_OPENAI_QUEUE", "8")), LLM_QUEUE_MAX_WAIT),
+}
+
+def _busy(e: QueueFull) -> JSONResponse:
+    return JSONResponse(
+        {"ok": False, "error": f"{e.gate} is busy, retry later", "retry_after": e.retry_after},
+        status_code=429, headers={"Retry-After": str(e.retry_after)},
+    )
+
+_providers: Dict[str, LLMProvider] = {}
+
+def get_provider(spec: str) -> LLMProvider:
+    """Shared provider for "vendor:model" (built once, reused by every profile)."""
+    vendor, _, model = spec.strip().partition(":")
+    p = _providers.get(f"{vendor}:{model}")
+    if p is None:
+        if vendor == "gemini":
+            p = GeminiProvider(model or GEMINI_DEFAULT_MODEL, _gates["gemini"], GEMINI_TOKEN)
+        elif vendor == "openai":
+            p = OpenAIProvider(model or OPENAI_DEFAULT_MODEL, _gates["openai"], oa_client)
         else:
-            raise
-    text = _gemini_extract_text(resp)
-    return text or ""
+            raise ValueError(f"unknown LLM vendor in {spec!r}")
+        _providers[p.name] = p
+    return p
+
+def _route(spec: str) -> List[LLMProvider]:
+    return [get_provider(part) for part in spec.split(",") if part.strip()]
 
 
 # ==================================
-# 1) Gemini: offline knowledge mode
+# 1) Overview: offline knowledge mode
 # ==================================
-def make_history_info1(
+HISTORY1_PROMPT = (
+    "Task: Given a place name, summarize its historical background WITHOUT browsing the web.\n"
+    "Rules:\n"
+    "- Respond in {language}.\n"
+    "- Mention major historical events, battles, or treaties.\n"
+    "- Provide timeline context (centuries / years) when reasonably certain.\n"
+    "- Include cultural or architectural heritage if well-known.\n"
+    "- Avoid fabrication; if uncertain, state the uncertainty explicitly and end to generate.\n"
+    "\nPlace: {place}\n"
+    "Output style:\n"
+    "- Use paragraph formats; keep within ~700 words; add Gregorian years where helpful.\n"
+    "- Optionally end with 2–3 keywords as tags.\n"
+)
+HISTORY1_TEMPERATURE = 0.2
+
+def _overview_request(place: str, language: str, temperature: float = HISTORY1_TEMPERATURE) -> LLMRequest:
+    return LLMRequest(HISTORY1_PROMPT.format(language=language, place=place), temperature=temperature)
+
+
+# ================================
+# 2) Advanced: Responses + Web Search
+# ================================
+HISTORY2_DEV_PROMPT = (
+    "Given a place name, search and summarize its historical background.\n"
+    "- Highlight important civilizations, dynasties, or empires.\n"
+    "- Mention major historical events, battles, or treaties.\n"
+    "- Provide timeline context (centuries / years).\n"
+    "- If available, include cultural or architectural heritage.\n"
+    "- Respond paragraph formats in {language} within 700 words."
+)
+HISTORY2_USER_PROMPT = "Provide a complete historical summary of {place}"
+HISTORY2_TOOLS = OpenAIProvider.WEB_TOOLS
+HISTORY2_VERBOSITY = "medium"
+
+def _advanced_request(place: str, language: str) -> LLMRequest:
+    return LLMRequest(HISTORY2_USER_PROMPT.format(place=place),
+                      instructions=HISTORY2_DEV_PROMPT.format(language=language),
+                      web=True, verbosity=HISTORY2_VERBOSITY)
+
+
+# ================================
+# Routing profiles
+# ================================
+# "vendor:model" 依偏好排序：第一家是主要；它慢過自己的 p90 就加開下一家（hedge），出錯就換下一家
+HISTORY_OVERVIEW_ROUTE = os.getenv(
+    "HISTORY_OVERVIEW_ROUTE", f"gemini:{GEMINI_DEFAULT_MODEL},openai:gpt-5-mini")
+HISTORY_ADVANCED_ROUTE = os.getenv(
+    "HISTORY_ADVANCED_ROUTE", f"openai:{OPENAI_DEFAULT_MODEL},openai:gpt-5-mini,gemini:{GEMINI_DEFAULT_MODEL}")
+
+# name → (profile, build request)；hedge_* 是還沒有延遲樣本時的預設門檻（秒）
+PROFILES: Dict[str, Tuple[RoutingProfile, Callable[[str, str], LLMRequest]]] = {
+    "overview": (RoutingProfile("overview", _route(HISTORY_OVERVIEW_ROUTE), hedge_after=15, hedge_ttft=5),
+                 _overview_request),
+    "advanced": (RoutingProfile("advanced", _route(HISTORY_ADVANCED_ROUTE), hedge_after=45, hedge_ttft=20),
+                 _advanced_request),
+}
+
+
+# ================================
+# 3) Derived languages: translate the canonical text
+# ================================
+# 每個地點只在 pivot 語言做一次完整生成（含 web search），其他語言由它翻譯而來
+HISTORY_PIVOT_LANGUAGE = os.getenv("HISTORY_PIVOT_LANGUAGE", "English")
+HISTORY_DERIVE = os.getenv("HISTORY_DERIVE", "1") != "0"       # 0 = 每個語言各自完整生成
+HISTORY_TRANSLATE_ROUTE = os.getenv(
+    "HISTORY_TRANSLATE_ROUTE", "gemini:gemini-2.5-flash-lite,openai:gpt-5-nano")
+
+TRANSLATE_DEV_PROMPT = (
+    "Translate the user's text into {language}.\n"
+    "- Keep the paragraph structure, dates, numbers and any trailing tags.\n"
+    "- Use the names conventionally used in {language} for places, people, dynasties and events.\n"
+    "- Do not add, drop or comment on content. Output only the translation."
+)
+TRANSLATE_TEMPERATURE = 0.0
+
+def _translate_request(text: str, language: str) -> LLMRequest:
+    return LLMRequest(text, instructions=TRANSLATE_DEV_PROMPT.format(language=language),
+                      temperature=TRANSLATE_TEMPERATURE)
+
+_translator = RoutingProfile("translate", _route(HISTORY_TRANSLATE_ROUTE), hedge_after=8, hedge_ttft=2)
+
+async def warm_providers() -> None:
+    """Startup hook: open each provider's connection so the first user request does not pay for TLS."""
+    if not LLM_PREWARM:
+        return
+
+    async def one(p: LLMProvider):
+        try:
+            await asyncio.wait_for(p.warm(), 10)
+        except Exception as e:
+            print(f"[history] warm {p.name}: {type(e).__name__}: {e}")
+
+    await asyncio.gather(*[one(p) for p in _providers.values()])
+
+async def aclose_providers() -> None:
+    """Shutdown hook: close the OpenAI connection pool."""
+    await oa_client.close()
+
+
+async def make_history_info1(
     place: str,
     language: str = "中文",
     model: Optional[str] = None,
-    temperature: float = 0.2,
+    temperature: float = HISTORY1_TEMPERATURE,
 ) -> str:
     """
-    Generate a place's historical summary using Gemini WITHOUT web browsing.
+    Historical summary WITHOUT web browsing (Gemini unless `model` names another "vendor:model").
     - Emphasize known facts; avoid speculation.
-    - Return bullet-style, concise text in the requested language.
-    """
-    prompt = (
-        "Task: Given a place name, summarize its historical background WITHOUT browsing the web.\n"
-        "Rules:\n"
-        f"- Respond in {language}.\n"
-        "- Mention major historical events, battles, or treaties.\n"
-        "- Provide timeline context (centuries / years) when reasonably certain.\n"
-        "- Include cultural or architectural heritage if well-known.\n"
-        "- Avoid fabrication; if uncertain, state the uncertainty explicitly and end to generate.\n"
-        f"\nPlace: {place}\n"
-        "Output style:\n"
-        "- Use paragraph formats; keep within ~700 words; add Gregorian years where helpful.\n"
-        "- Optionally end with 2–3 keywords as tags.\n"
-    )
-    return _gemini_chat(prompt, model=model, temperature=temperature)
-
-
-# ================================
-# 2) OpenAI: Responses + Web Search
-# ================================
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-oa_client = OpenAI(api_key=OPENAI_API_KEY)
+    """
+    p = get_provider(model if model and ":" in model else f"gemini:{model or GEMINI_DEFAULT_MODEL}")
+    async with p.gate.slot():
+        return await p.complete(_overview_request(place, language, temperature))
 
 
-def make_history_info2(
+async def make_history_info2(
     place: str,
     language: str = "中文",
-    model: str = "gpt-5",
+    model: str = OPENAI_DEFAULT_MODEL,
 ) -> str:
     """
-    Generate a place's historical summary using OpenAI Responses API with web_search_preview.
-    - Bullet-style, concise text in the requested language.
+    Historical summary using the OpenAI Responses API with web_search_preview.
     - Citations are included in the model's reasoning context; we only extract the text here.
     """
-    resp = oa_client.responses.create(
-        model=model,
-        input=[
-            {
-                "role": "developer",
-                "content": [
-                    {
-                        "type": "input_text",
-                        "text": (
-                            "Given a place name, search and summarize its historical background.\n"
-                            "- Highlight important civilizations, dynasties, or empires.\n"
-                            "- Mention major historical events, battles, or treaties.\n"
-                            "- Provide timeline context (centuries / years).\n"
-                            "- If available, include cultural or architectural heritage.\n"
-                            f"- Respond paragraph formats in {language} within 700 words."
-                        ),
-                    }
-                ],
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "input_text",
-                        "text": f"Provide a complete historical summary of {place}",
-                    }
-                ],
-            },
-        ],
-        text={"format": {"type": "text"}, "verbosity": "medium"},
-        # reasoning removed for speed
-        tools=[{"type": "web_search_preview"}],
-        store=True,
-        include=["web_search_call.action.sources"],  # keep citations metadata on the server
-    )
+    p = get_provider(model if ":" in model else f"openai:{model}")
+    async with p.gate.slot():
+        return await p.complete(_advanced_request(place, language))
+
+
+# =========================================
+# Durable cache (memory LRU → SQLite) + single-flight
+# =========================================
+HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", str(30 * 24 * 3600)))   # 30 天
+HISTORY_CACHE_MAX = int(os.getenv("HISTORY_CACHE_MAX", "500"))                    # 記憶體層筆數
+HISTORY_CACHE_DB = os.getenv(
+    "HISTORY_CACHE_DB", str(Path(__file__).resolve().parents[2] / ".cache" / "history_llm.sqlite3"))
+HISTORY_CACHE_DB_MAX_ROWS = int(os.getenv("HISTORY_CACHE_DB_MAX_ROWS", "50000"))
+# 備援模型（非 profile 第一家）的回答只短暫快取，主要模型恢復後就換回來
+HISTORY_CACHE_FALLBACK_TTL = float(os.getenv("HISTORY_CACHE_FALLBACK_TTL", str(24 * 3600)))
+HISTORY_CACHE_SWEEP_INTERVAL = 3600
+HISTORY_QID_VERIFY_DEADLINE = float(os.getenv("HISTORY_QID_VERIFY_DEADLINE", "2"))   # 驗證 QID 最多等幾秒
+
+def _prompt_version(*parts) -> str:
+    # prompt 或生成設定一改，hash 就變，舊結果自然失效
+    return hashlib.sha1(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()[:10]
+
+PROMPT_VERSIONS = {
+    "overview": _prompt_version(HISTORY1_PROMPT, HISTORY1_TEMPERATURE),
+    "advanced": _prompt_version(HISTORY2_DEV_PROMPT, HISTORY2_USER_PROMPT, HISTORY2_TOOLS, HISTORY2_VERBOSITY),
+    "translate": _prompt_version(TRANSLATE_DEV_PROMPT, TRANSLATE_TEMPERATURE),
+}
+
+# key 形如 "overview|Q34600|繁體中文|gemini:gemini-2.5-flash|<hash>"；第一段即 namespace
+# 值是 {"text", "served"}：served 記錄當初由哪家 provider 生成
+_cache = TTLCache(HISTORY_CACHE_MAX, HISTORY_CACHE_TTL)
+_disk: DiskCache | None = None
+_disk_opened = False
+# 生成很貴：所有等待者都離開也讓它跑完，結果照樣進快取
+_flight = SingleFlight(cancel_abandoned=False)
+# 串流版：同一個 key 的並發請求訂閱同一條生成（全部斷線才取消上游）
+_stream_flight = StreamFlight()
+
+def _disk_tier() -> DiskCache | None:
+    global _disk, _disk_opened
+    if not _disk_opened:
+        _disk_opened = True
+        _disk = open_disk_cache(HISTORY_CACHE_DB, max_rows=HISTORY_CACHE_DB_MAX_ROWS)
+    return _disk
+
+def start_cache_sweeper():
+    _cache.start_sweeper(HISTORY_CACHE_SWEEP_INTERVAL)
+    disk = _disk_tier()
+    if disk is not None:
+        disk.start_sweeper(HISTORY_CACHE_SWEEP_INTERVAL)
+
+_QID_RE = re.compile(r"^Q[1-9]\d*$")
 
-    # Extract assistant text from Responses API output
-    output_texts = []
-    for item in resp.output:
-        if getattr(item, "type", None) == "message":
-            for c in getattr(item, "content", []) or []:
-                if getattr(c, "type", None) == "output_text":
-                    output_texts.append(getattr(c, "text", "") or "")
+def _norm_key_part(s: Optional[str]) -> str:
+    # 全形/半形、大小寫、空白差異都視為同一個地點
+    s = unicodedata.normalize("NFKC", s or "").casefold()
+    return " ".join(s.replace("|", " ").split())
 
-    return "\n".join(t for t in output_texts if t).strip()
+def history_key(kind: str, place: str, language: str, model: str, qid: Optional[str] = None) -> str:
+    """Verified Wikidata QID (so "Kyoto" and "京都" share an entry), else the normalized place."""
+    subject = qid.upper() if qid and _QID_RE.match(qid.upper()) else "p:" + _norm_key_part(place)
+    return "|".join([kind, subject, _norm_key_part(language), model, PROMPT_VERSIONS[kind]])
 
+async def verify_subject(req: "HistoryReq") -> "HistoryReq":
+    """
+    The client's QID is only a hint. It is kept when one of the entity's
+    Wikidata labels/aliases is the most specific part of `place` (the last
+    comma-separated component); the shared entry is then generated for
+    the entity's own label and description, not the client's text.
+    Otherwise the QID is dropped and the entry is keyed by the place.
+    """
+    qid = (req.qid or "").strip().upper()
+    if not _QID_RE.match(qid):
+        return req.model_copy(update={"qid": None}) if req.qid else req
+    names = {}
+    try:
+        names = await asyncio.wait_for(wikidata_names(qid), HISTORY_QID_VERIFY_DEADLINE)
+    except asyncio.TimeoutError:
+        pass
+    last = _norm_key_part(req.place.rsplit(",", 1)[-1])
+    if not last or last not in {_norm_key_part(n) for n in names.get("names") or []}:
+        return req.model_copy(update={"qid": None})
+    label, desc = names.get("label") or req.place.rsplit(",", 1)[-1].strip(), names.get("description")
+    return req.model_copy(update={"qid": qid, "place": f"{label} ({desc})" if desc else label})
+
+def _derived(language: str) -> bool:
+    return HISTORY_DERIVE and _norm_key_part(language) != _norm_key_part(HISTORY_PIVOT_LANGUAGE)
+
+def _profile_key(kind: str, req: "HistoryReq") -> str:
+    # 以 profile 的主要模型為準：換主要模型才讓快取失效，備援出手不會
+    key = history_key(kind, req.place, req.language, PROFILES[kind][0].primary.name, req.qid)
+    if _derived(req.language):
+        key += "|tr:" + PROMPT_VERSIONS["translate"]   # 翻譯 prompt 一改，衍生版本跟著失效
+    return key
+
+def _canonical_req(req: "HistoryReq") -> "HistoryReq":
+    # refresh 只重做翻譯：pivot 版本是最貴的那一份，照舊沿用
+    return req.model_copy(update={"language": HISTORY_PIVOT_LANGUAGE, "refresh": False})
+
+def _derived_served(src: Dict[str, Any], tr: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        **src,
+        "derived_from": HISTORY_PIVOT_LANGUAGE,
+        "translator": tr.get("provider"),
+        "fallback": bool(src.get("fallback") or tr.get("fallback")),
+        "translate_ms": tr.get("ms"),
+    }
+
+async def cache_lookup(key: str) -> Optional[Dict[str, Any]]:
+    hit = _cache.get(key)
+    if hit:
+        return hit
+    disk = _disk_tier()
+    if disk is None:
+        return None
+    try:
+        val, remaining = await disk.aget(key)
+    except sqlite3.Error as e:
+        print("[history] disk cache get:", e)
+        return None
+    if val is MISS or not isinstance(val, dict) or not val.get("text"):
+        return None
+    _cache.set(key, val, ttl=remaining)
+    return val
+
+async def cache_store(key: str, text: str, served: Dict[str, Any]) -> None:
+    if not text:   # 空字串/錯誤不快取
+        return
+    ttl = HISTORY_CACHE_FALLBACK_TTL if served.get("fallback") else HISTORY_CACHE_TTL
+    val = {"text": text, "served": served}
+    _cache.set(key, val, ttl=ttl)
+    disk = _disk_tier()
+    if disk is not None:
+        try:
+            await disk.aset(key, val, ttl)
+        except sqlite3.Error as e:
+            print("[history] disk cache set:", e)
+
+async def cached_history(kind: str, req: "HistoryReq") -> Tuple[str, Dict[str, Any], bool]:
+    """
+    (text, served, cached). Concurrent misses for the same key share one
+    routed generation; QueueFull when every provider's queue is full.
+    Languages other than HISTORY_PIVOT_LANGUAGE are translated from the
+    (cached) pivot version instead of being researched again. `req.qid`
+    is trusted as is: pass client requests through verify_subject first.
+    """
+    profile, build = PROFILES[kind]
+    key = _profile_key(kind, req)
+    if not req.refresh:
+        hit = await cache_lookup(key)
+        if hit:
+            return hit["text"], hit.get("served") or {}, True
+
+    async def run() -> Tuple[str, Dict[str, Any]]:
+        if _derived(req.language):
+            src, src_served, _ = await cached_history(kind, _canonical_req(req))
+            try:
+                text, tr = await _translator.complete(_translate_request(src, req.language))
+                served = _derived_served(src_served, tr)
+            except LLMError as e:
+                # 翻譯模型全掛：退回直接用目標語言生成
+                print(f"[history] translate to {req.language} failed, generating directly: {e}")
+                text, served = await profile.complete(build(req.place, req.language))
+        else:
+            text, served = await profile.complete(build(req.place, req.language))
+        await cache_store(key, text, served)
+        return text, served
+
+    text, served = await _flight.do(key, run)
+    return text, served, False
 
 # ================
 # FastAPI routes
@@ -177,43 +382,197 @@ def make_history_info2(
 class HistoryReq(BaseModel):
     place: str
     language: str = "中文"
+    qid: Optional[str] = None     # 前端從 /placeinfo 拿到的 Wikidata QID（驗證過才當快取 key）
+    refresh: bool = False         # 略過快取重新生成
 
 
-@router.post("/history/overview", response_class=JSONResponse)
-def api_history_overview(req: HistoryReq):
-    """
-    Gemini (no web). Returns {ok, text}
-    """
+async def _history(kind: str, req: HistoryReq) -> JSONResponse:
     try:
-        text = make_history_info1(req.place, language=req.language)
-        return JSONResponse({"ok": True, "text": text})
+        text, served, cached = await cached_history(kind, await verify_subject(req))
+        return JSONResponse({"ok": True, "text": text, "cached": cached, "served": served})
+    except QueueFull as e:
+        return _busy(e)
     except Exception as e:
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
 
+@router.post("/history/overview", response_class=JSONResponse)
+async def api_history_overview(req: HistoryReq):
+    """
+    "overview" profile (no web). Returns {ok, text, cached, served}
+    """
+    return await _history("overview", req)
+
+
 @router.post("/history/advanced", response_class=JSONResponse)
-def api_history_advanced(req: HistoryReq):
+async def api_history_advanced(req: HistoryReq):
     """
-    OpenAI (web search). Returns {ok, text}
+    "advanced" profile (web search). Returns {ok, text, cached, served}
     """
+    return await _history("advanced", req)
+
+
+# ---------- streaming variants (SSE / NDJSON) ----------
+async def _stream_history(kind: str, req: HistoryReq, fmt: str):
+    """
+    Events: served {provider, ...}, delta {text} …, then done {cached} or
+    error {error}. A cache hit is sent as a single delta. A miss admits its
+    first provider before the response starts (429 when every queue is
+    full); hedging/failover happen until the first token, the full text is
+    cached only when the stream completes. Concurrent misses for the same
+    key share one generation: a later request replays the parts sent so
+    far and then follows the live stream. The upstream calls are cancelled
+    once every client of the stream has disconnected. A derived language
+    streams the translation of the pivot text; if that is not cached yet,
+    a status {stage: "canonical"} event is sent while it is generated.
+    """
+    encode, media_type = STREAM_FORMATS[fmt]
+    req = await verify_subject(req)
+    key = _profile_key(kind, req)
+
+    hit = None if req.refresh else await cache_lookup(key)
+    if hit:
+        async def cached():
+            yield encode("served", hit.get("served") or {})
+            yield encode("delta", {"text": hit["text"]})
+            yield encode("done", {"cached": True})
+        return StreamingResponse(cached(), media_type=media_type, headers=STREAM_HEADERS)
+
+    sub = _stream_flight.join(key, lambda emit, ready: _produce_history(kind, req, key, emit, ready))
     try:
-        text = make_history_info2(req.place, language=req.language)
-        return JSONResponse({"ok": True, "text": text})
-    except Exception as e:
-        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
+        await sub.ready()
+    except QueueFull as e:
+        sub.leave()
+        return _busy(e)
+    except BaseException:
+        sub.leave()
+        raise
+
+    async def events():
+        try:
+            async for event, data in sub:
+                yield encode(event, data)
+        finally:
+            sub.leave()
+
+    # 串流結束、出錯或斷線後都會跑 leave（BackgroundTask）；重複呼叫無妨
+    return StreamingResponse(events(), media_type=media_type, headers=STREAM_HEADERS,
+                             background=BackgroundTask(sub.leave))
+
+
+async def _produce_history(kind: str, req: HistoryReq, key: str,
+                           emit: Callable[[Tuple[str, Dict[str, Any]]], None], ready: Callable[[], None]) -> None:
+    # 一個 key 只跑一次：所有串流請求都訂閱這裡 emit 的事件
+    profile, build = PROFILES[kind]
+    hit = None if req.refresh else await cache_lookup(key)
+    if hit:
+        # 剛查完快取、還沒加入之前，上一個生成正好寫進去了
+        ready()
+        emit(("served", hit.get("served") or {}))
+        emit(("delta", {"text": hit["text"]}))
+        emit(("done", {"cached": True}))
+        return
+
+    translate = _derived(req.language)
+    src = await cache_lookup(_profile_key(kind, _canonical_req(req))) if translate else None
+    streams: List[LLMStream] = []
+    try:
+        if not translate or src:
+            # QueueFull 在 ready 之前丟出：每個訂閱者都回 429
+            streams.append(await (_translator.open_stream(_translate_request(src["text"], req.language)) if src
+                                  else profile.open_stream(build(req.place, req.language))))
+        ready()
+        parts, served = [], {}
+        try:
+            if not streams:
+                # pivot 版本還沒有：先生成（和其他請求共用 single-flight），再串流翻譯
+                emit(("status", {"stage": "canonical", "language": HISTORY_PIVOT_LANGUAGE}))
+                text, src_served, _ = await cached_history(kind, _canonical_req(req))
+                src = {"text": text, "served": src_served}
+                streams.append(await _translator.open_stream(_translate_request(text, req.language)))
+            while True:
+                stream = streams[-1]
+                try:
+                    async for piece in stream:
+                        if not parts:
+                            served = _derived_served(src.get("served") or {}, stream.served) if translate else stream.served
+                            emit(("served", served))
+                        parts.append(piece)
+                        emit(("delta", {"text": piece}))
+                    break
+                except LLMError as e:
+                    if parts or not translate:
+                        raise
+                    # 翻譯模型全掛：退回直接用目標語言生成
+                    print(f"[history] translate to {req.language} failed, generating directly: {e}")
+                    translate = False
+                    streams.append(await profile.open_stream(build(req.place, req.language)))
+        except QueueFull as e:
+            emit(("error", {"error": str(e), "retry_after": e.retry_after}))
+            return
+        except Exception as e:
+            emit(("error", {"error": str(e)}))
+            return
+        await cache_store(key, "".join(parts).strip(), served)
+        emit(("done", {"cached": False, "served": served}))
+    finally:
+        for st in streams:
+            await st.aclose()
+
+
+@router.post("/history/overview/stream")
+async def api_history_overview_stream(req: HistoryReq, format: str = Query("sse", pattern="^(sse|ndjson)$")):
+    """
+    "overview" profile (no web), streamed token by token.
+    """
+    return await _stream_history("overview", req, format)
+
+
+@router.post("/history/advanced/stream")
+async def api_history_advanced_stream(req: HistoryReq, format: str = Query("sse", pattern="^(sse|ndjson)$")):
+    """
+    "advanced" profile (web search), streamed token by token.
+    """
+    return await _stream_history("advanced", req, format)
+
+
+@router.get("/history/queue/stats", response_class=JSONResponse)
+def api_history_queue_stats():
+    """Concurrency, queue depth and wait times per LLM vendor."""
+    return {name: g.stats() for name, g in _gates.items()}
+
+
+@router.get("/history/providers", response_class=JSONResponse)
+def api_history_providers():
+    """Per profile: route, hedge thresholds, hedge/failover counts and per-model health."""
+    out = {name: profile.stats() for name, (profile, _) in PROFILES.items()}
+    out["translate"] = {**_translator.stats(), "pivot": HISTORY_PIVOT_LANGUAGE, "enabled": HISTORY_DERIVE}
+    return out
+
+
+@router.get("/history/cache/stats", response_class=JSONResponse)
+def api_history_cache_stats():
+    disk = _disk_tier()
+    return {
+        "cache": _cache.stats(),
+        "singleflight": _flight.stats(),
+        "stream_flight": _stream_flight.stats(),
+        "disk": {"path": str(disk.path), "rows": disk.count()} if disk else None,
+        "prompt_versions": PROMPT_VERSIONS,
+    }
 
 
 # ---------------- Minimal local examples ----------------
 if __name__ == "__main__":
     # Example 1: Gemini (no web)
     try:
-        print(make_history_info1("京都", language="繁體中文", temperature=0.25), "\n")
+        print(asyncio.run(make_history_info1("京都", language="繁體中文", temperature=0.25)), "\n")
     except Exception as e:
         print("[Gemini] error:", e)
 
     # Example 2: OpenAI (with web search)
     try:
         print("===== OpenAI (web search) — Taipei =====")
-        print(make_history_info2("京都", language="繁體中文"), "\n")
+        print(asyncio.run(make_history_info2("京都", language="繁體中文")), "\n")
     except Exception as e:
         print("[OpenAI] error:", e)
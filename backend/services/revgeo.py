@@ -1,10 +1,80 @@
-# backend/services/revgeo.py — reverse geocoding with fallbacks
-from fastapi import APIRouter, Query
+# backend/services/revgeo.py — reverse geocoding with hedged provider racing
+from __future__ import annotations
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import JSONResponse
-import requests
+import os, json, math, time, asyncio
+
+import httpx
+import numpy as np
+
+from ..utils.breaker import ProviderRegistry
+from ..utils.cache import TTLCache
+from ..utils.countries import COAST_MARGIN_DEG, get_country_index
+from ..utils.http import get_client
 
 router = APIRouter()
 
+# ===================== Config =====================
+REVGEO_DEADLINE = float(os.getenv("REVGEO_DEADLINE", "4.0"))        # 整體截止（秒）
+REVGEO_HEDGE_DELAY = float(os.getenv("REVGEO_HEDGE_DELAY", "0.35"))  # 前一家多久沒回就加開下一家
+REVGEO_BREAKER_FAILURES = int(os.getenv("REVGEO_BREAKER_FAILURES", "3"))      # 連續失敗幾次就斷路
+REVGEO_BREAKER_COOLDOWN = float(os.getenv("REVGEO_BREAKER_COOLDOWN", "30"))   # 斷路多久後放一個探測請求
+NOMINATIM_UA = "time-globe/0.1 (contact: dev@time-globe.local)"
+
+# 座標量化快取：有城市的結果用細格，只有國家的結果用粗格
+REVGEO_CACHE_CITY_DEG = float(os.getenv("REVGEO_CACHE_CITY_DEG", "0.05"))        # ~5 km
+REVGEO_CACHE_COUNTRY_DEG = float(os.getenv("REVGEO_CACHE_COUNTRY_DEG", "0.5"))   # ~50 km
+REVGEO_CACHE_MAX = int(os.getenv("REVGEO_CACHE_MAX", "20000"))
+REVGEO_CACHE_TTL = float(os.getenv("REVGEO_CACHE_TTL", str(7 * 24 * 3600)))
+REVGEO_CACHE_COUNTRY_TTL = float(os.getenv("REVGEO_CACHE_COUNTRY_TTL", str(6 * 3600)))
+
+# 批次端點
+REVGEO_BATCH_MAX_POINTS = int(os.getenv("REVGEO_BATCH_MAX_POINTS", "1000000"))
+REVGEO_BATCH_MAX_UPSTREAM = int(os.getenv("REVGEO_BATCH_MAX_UPSTREAM", "200"))   # 每批最多幾個城市格打上游
+REVGEO_BATCH_CONCURRENCY = int(os.getenv("REVGEO_BATCH_CONCURRENCY", "4"))
+REVGEO_BATCH_DEADLINE = float(os.getenv("REVGEO_BATCH_DEADLINE", "20"))         # detail=city 整批打上游的截止（秒）
+
+# ===================== Quantized cache =====================
+_cache = TTLCache(REVGEO_CACHE_MAX, REVGEO_CACHE_TTL)
+_lookups = {"hits": 0, "misses": 0}   # 以「一次點擊」計，不是每個格子的探測
+
+def _cell(lat: float, lon: float, deg: float) -> Tuple[float, int, int]:
+    return (deg, math.floor(lat / deg), math.floor(lon / deg))
+
+def cache_lookup(lat: float, lon: float) -> Optional[dict]:
+    for deg in (REVGEO_CACHE_CITY_DEG, REVGEO_CACHE_COUNTRY_DEG):
+        hit = _cache.get(_cell(lat, lon, deg))
+        if hit is not None:
+            _lookups["hits"] += 1
+            return dict(hit)
+    _lookups["misses"] += 1
+    return None
+
+def cache_store(lat: float, lon: float, data: dict) -> None:
+    if _good(data):
+        _cache.set(_cell(lat, lon, REVGEO_CACHE_CITY_DEG), dict(data))
+    else:
+        # 只有國家層級：可能是超時拿到的半成品，TTL 短一點
+        _cache.set(_cell(lat, lon, REVGEO_CACHE_COUNTRY_DEG), dict(data), ttl=REVGEO_CACHE_COUNTRY_TTL)
+
+def _empty(src=None):
+    return {"source": src, "country": None, "country_code": None, "country_iso3": None,
+            "admin1": None, "admin2": None, "city": None}
+
+def _same_country(a, b) -> bool:
+    a, b = (a or "").strip().lower(), (b or "").strip().lower()
+    return bool(a and b) and (a in b or b in a)
+
+def _with_offline(data: dict, offline):
+    # 離線索引補上 ISO3；上游沒給國名時也一併補（海岸邊界粗糙，國名不符就不採用）
+    data["country_iso3"] = None
+    if offline and not data.get("country"):
+        data["country"] = offline.get("country")
+    if offline and _same_country(data.get("country"), offline.get("country")):
+        data["country_iso3"] = offline.get("country_iso3")
+    return data
+
 def _normalize(resp: dict, src: str):
     if src == "bigdatacloud":
         return {
@@ -42,39 +112,273 @@ def _normalize(resp: dict, src: str):
         }
     return {}
 
-@router.get("/revgeo", response_class=JSONResponse)
-def reverse_geocode(lat: float = Query(...), lon: float = Query(...)):
-    # 1) BigDataCloud
+# ===================== Providers =====================
+async def _fetch_bigdatacloud(cli: httpx.AsyncClient, lat: float, lon: float) -> Optional[dict]:
+    u = "https://api.bigdatacloud.net/data/reverse-geocode-client"
+    params = {"latitude": lat, "longitude": lon, "localityLanguage": "en"}
+    r = await cli.get(u, params=params, timeout=6)
+    return _normalize(r.json(), "bigdatacloud") if r.is_success else None
+
+async def _fetch_nominatim(cli: httpx.AsyncClient, lat: float, lon: float) -> Optional[dict]:
+    # zoom 拉高，需帶 UA
+    u = "https://nominatim.openstreetmap.org/reverse"
+    params = {"lat": lat, "lon": lon, "format": "jsonv2", "addressdetails": 1, "zoom": 14}
+    r = await cli.get(u, params=params, headers={"User-Agent": NOMINATIM_UA}, timeout=8)
+    return _normalize(r.json(), "nominatim") if r.is_success else None
+
+async def _fetch_openmeteo(cli: httpx.AsyncClient, lat: float, lon: float) -> Optional[dict]:
+    u = "https://geocoding-api.open-meteo.com/v1/reverse"
+    params = {"latitude": lat, "longitude": lon, "language": "en"}
+    r = await cli.get(u, params=params, timeout=6)
+    return _normalize(r.json(), "openmeteo") if r.is_success else None
+
+Fetcher = Callable[[httpx.AsyncClient, float, float], Awaitable[Optional[dict]]]
+
+# 依優先序；後面的只有在前面慢或失敗時才會被啟動
+PROVIDERS: List[Tuple[str, Fetcher]] = [
+    ("bigdatacloud", _fetch_bigdatacloud),
+    ("nominatim", _fetch_nominatim),
+    ("openmeteo", _fetch_openmeteo),
+]
+
+def _good(data: Optional[dict]) -> bool:
+    return bool(data) and any([data.get("admin1"), data.get("city")])
+
+_registry = ProviderRegistry(
+    [name for name, _ in PROVIDERS],
+    base_cost=1.0,
+    failure_threshold=REVGEO_BREAKER_FAILURES,
+    cooldown=REVGEO_BREAKER_COOLDOWN,
+)
+
+async def _call(name: str, fetch: Fetcher, lat: float, lon: float) -> Optional[dict]:
+    health = _registry[name]
+    t0 = time.perf_counter()
     try:
-        u = f"https://api.bigdatacloud.net/data/reverse-geocode-client?latitude={lat}&longitude={lon}&localityLanguage=en"
-        r = requests.get(u, timeout=6)
-        if r.ok:
-            data = _normalize(r.json(), "bigdatacloud")
-            if any([data.get("admin1"), data.get("city")]):
-                return data
+        data = await fetch(await get_client(), lat, lon)
+    except asyncio.CancelledError:
+        health.release(time.perf_counter() - t0)
+        raise
     except Exception as e:
-        print("[revgeo] bigdatacloud:", e)
+        print(f"[revgeo] {name}:", e)
+        health.record(False, time.perf_counter() - t0, error=f"{type(e).__name__}: {e}")
+        return None
+    if data is None:
+        health.record(False, time.perf_counter() - t0, error="upstream HTTP error")
+    else:
+        health.record(True, time.perf_counter() - t0, quality=_good(data))
+    return data
 
-    # 2) Nominatim（zoom 拉高，需帶 UA）
+async def race_providers(lat: float, lon: float, deadline: float = REVGEO_DEADLINE) -> Optional[dict]:
+    """
+    Hedged racing: start the first provider, add the next one every
+    REVGEO_HEDGE_DELAY seconds (or immediately once everything running has
+    failed), return the first result passing the admin1/city check and cancel
+    the rest. Without a good result by `deadline`, the first usable partial
+    result (e.g. country only) is returned, else None.
+    Launch order follows the registry's observed health; providers with an
+    open circuit are skipped.
+    """
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+    fetchers = dict(PROVIDERS)
+    queue = [n for n in _registry.ordered() if n in fetchers]
+    running: Set[asyncio.Task] = set()
+    fallback: Optional[dict] = None
+    next_launch = loop.time()
     try:
-        u = "https://nominatim.openstreetmap.org/reverse"
-        params = {"lat": lat, "lon": lon, "format": "jsonv2", "addressdetails": 1, "zoom": 14}
-        headers = {"User-Agent": "time-globe/0.1 (contact: dev@time-globe.local)"}
-        r = requests.get(u, params=params, headers=headers, timeout=8)
-        if r.ok:
-            data = _normalize(r.json(), "nominatim")
-            if any([data.get("admin1"), data.get("city")]):
-                return data
-    except Exception as e:
-        print("[revgeo] nominatim:", e)
+        while True:
+            now = loop.time()
+            if now >= end:
+                break
+            if queue and (not running or now >= next_launch):
+                name = queue.pop(0)
+                if not _registry[name].allow():
+                    continue
+                running.add(asyncio.create_task(_call(name, fetchers[name], lat, lon)))
+                next_launch = now + REVGEO_HEDGE_DELAY
+                continue
+            if not running:
+                break
+            wake = min(end, next_launch) if queue else end
+            done, running = await asyncio.wait(running, timeout=max(0.0, wake - now),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                data = t.result()
+                if _good(data):
+                    return data
+                if fallback is None and data and data.get("country"):
+                    fallback = data
+    finally:
+        for t in running:
+            t.cancel()
+    if running or queue:
+        print(f"[revgeo] deadline {deadline}s hit at ({lat}, {lon})")
+    return fallback
+
+@router.get("/revgeo", response_class=JSONResponse)
+async def reverse_geocode(lat: float = Query(...), lon: float = Query(...)):
+    # 0) 離線國家索引：海上直接回傳，不打外部 API
+    idx = get_country_index()
+    offline = idx.lookup(lat, lon) if idx else None
+    if idx is not None and offline is None:
+        return _empty("offline")
+
+    # 1) 量化座標快取
+    data = cache_lookup(lat, lon)
+    if data:
+        return _with_offline(data, offline)
+
+    # 2) 上游併發競速（BigDataCloud → Nominatim → Open-Meteo）
+    data = await race_providers(lat, lon)
+    if data:
+        cache_store(lat, lon, data)
+        return _with_offline(data, offline)
+
+    # 上游全掛或超時：至少回傳離線國家
+    if offline:
+        return {**_empty("offline"), **offline}
+    return _empty()
+
+@router.get("/revgeo/stats", response_class=JSONResponse)
+def revgeo_stats():
+    total = _lookups["hits"] + _lookups["misses"]
+    return {
+        "hits": _lookups["hits"],
+        "misses": _lookups["misses"],
+        "hit_rate": round(_lookups["hits"] / total, 4) if total else None,
+        "cache": _cache.stats(),
+        "cell_deg": {"city": REVGEO_CACHE_CITY_DEG, "country": REVGEO_CACHE_COUNTRY_DEG},
+    }
+
+@router.get("/revgeo/providers", response_class=JSONResponse)
+def revgeo_providers():
+    """Circuit state, success rate and latency percentiles per upstream."""
+    return _registry.snapshot()
+
+# ===================== Batch =====================
+def _point_row(r) -> Tuple[float, float]:
+    if isinstance(r, dict):
+        return float(r["lat"]), float(r["lon"])
+    if len(r) != 2:
+        raise ValueError(f"expected [lat, lon], got {len(r)} values")
+    return float(r[0]), float(r[1])
+
+def _pairs(arr: np.ndarray) -> np.ndarray:
+    # 不 reshape：[[lat, lon, t], ...] 或扁平 list 重新配對會悄悄變成錯的座標
+    if arr.size == 0:
+        return arr.reshape(0, 2)
+    if arr.ndim != 2 or arr.shape[1] != 2:
+        raise ValueError(f"expected (lat, lon) pairs, got shape {arr.shape}")
+    return arr
+
+def _parse_points(body: bytes, content_type: str) -> np.ndarray:
+    """
+    Accepts
+      - application/octet-stream: little-endian float64 pairs (lat, lon)
+      - application/x-ndjson: one [lat, lon] or {"lat", "lon"} per line
+      - JSON: {"points": [[lat, lon], ...]}, {"lats": [...], "lons": [...]} or a bare list
+    Returns an (n, 2) float64 array; anything that is not (lat, lon) pairs
+    raises ValueError.
+    """
+    if "octet-stream" in content_type:
+        arr = np.frombuffer(body, dtype="<f8")
+        if arr.size % 2:
+            raise ValueError("binary body must hold (lat, lon) float64 pairs")
+        return arr.reshape(-1, 2)
+    if "ndjson" in content_type:
+        rows = [json.loads(line) for line in body.splitlines() if line.strip()]
+    else:
+        js = json.loads(body or b"[]")
+        if isinstance(js, dict) and "lats" in js:
+            lats, lons = np.asarray(js["lats"], dtype=np.float64), np.asarray(js["lons"], dtype=np.float64)
+            if lats.ndim != 1 or lats.shape != lons.shape:
+                raise ValueError("lats and lons must be flat lists of equal length")
+            return np.column_stack([lats, lons])
+        rows = js.get("points") or [] if isinstance(js, dict) else js
+    try:
+        arr = np.asarray(rows, dtype=np.float64)
+    except (TypeError, ValueError):
+        arr = np.asarray([_point_row(r) for r in rows], dtype=np.float64)
+    return _pairs(arr)
+
+async def _resolve_city_cells(lat: np.ndarray, lon: np.ndarray, ids: np.ndarray, countries: List[Dict[str, Any]]):
+    """
+    City detail for land points, deduplicated by REVGEO_CACHE_CITY_DEG cell:
+    one cache lookup / upstream race per occupied cell. Cells beyond
+    REVGEO_BATCH_MAX_UPSTREAM races or REVGEO_BATCH_DEADLINE are skipped.
+    """
+    places: List[Optional[dict]] = [None] * len(ids)
+    land = np.flatnonzero(ids >= 0)
+    stats = {"cells": 0, "cached": 0, "fetched": 0, "skipped": 0}
+    if land.size == 0:
+        return places, stats
+    deg = REVGEO_CACHE_CITY_DEG
+    q = np.column_stack([np.floor(lat[land] / deg), np.floor(lon[land] / deg)])
+    _, first, inverse = np.unique(q, axis=0, return_index=True, return_inverse=True)
+    stats["cells"] = len(first)
+
+    sem = asyncio.Semaphore(max(1, REVGEO_BATCH_CONCURRENCY))
+    budget = [REVGEO_BATCH_MAX_UPSTREAM]
+    loop = asyncio.get_running_loop()
+    end = loop.time() + REVGEO_BATCH_DEADLINE
+
+    async def one(i: int) -> Optional[dict]:
+        la, lo = float(lat[i]), float(lon[i])
+        data = cache_lookup(la, lo)
+        if data:
+            stats["cached"] += 1
+        else:
+            async with sem:
+                left = end - loop.time()
+                if budget[0] <= 0 or left <= 0:
+                    stats["skipped"] += 1
+                    return None
+                budget[0] -= 1
+                data = await race_providers(la, lo, deadline=min(REVGEO_DEADLINE, left))
+            stats["fetched"] += 1
+            if data:
+                cache_store(la, lo, data)
+        return _with_offline(data, countries[ids[i]]) if data else None
+
+    cell_places = await asyncio.gather(*[one(int(land[j])) for j in first])
+    for k, i in enumerate(land):
+        places[i] = cell_places[inverse.ravel()[k]]
+    return places, stats
 
-    # 3) Open-Meteo Geocoding
+@router.post("/revgeo/batch", response_class=JSONResponse)
+async def reverse_geocode_batch(
+    request: Request,
+    detail: str = Query("country", pattern="^(country|city)$"),
+    margin: Optional[float] = Query(None, ge=0, le=2, description="Coastal tolerance in degrees"),
+):
+    """
+    Batch reverse geocoding. Country resolution is fully offline (vectorized
+    point-in-polygon); detail=city additionally consults upstream providers
+    once per occupied city cell. `margin` defaults to 0 (exact polygons, the
+    fast path) for detail=country and to COAST_MARGIN_DEG for detail=city.
+    Returns {count, countries, country_id[, places, upstream]}; country_id
+    indexes into countries, -1 = ocean.
+    """
+    idx = get_country_index()
+    if idx is None:
+        raise HTTPException(status_code=503, detail="country index not loaded")
     try:
-        u = f"https://geocoding-api.open-meteo.com/v1/reverse?latitude={lat}&longitude={lon}&language=en"
-        r = requests.get(u, timeout=6)
-        if r.ok:
-            return _normalize(r.json(), "openmeteo")
+        pts = _parse_points(await request.body(), request.headers.get("content-type", ""))
     except Exception as e:
-        print("[revgeo] openmeteo:", e)
+        raise HTTPException(status_code=400, detail=f"bad points: {e}")
+    if len(pts) > REVGEO_BATCH_MAX_POINTS:
+        raise HTTPException(status_code=413, detail=f"max {REVGEO_BATCH_MAX_POINTS} points per batch")
 
-    return {"source": None, "country": None, "country_code": None, "admin1": None, "admin2": None, "city": None}
+    lat, lon = pts[:, 0], pts[:, 1]
+    if margin is None:
+        margin = COAST_MARGIN_DEG if detail == "city" else 0.0
+    ids = idx.locate_many(lat, lon, margin=margin)
+    out: Dict[str, Any] = {
+        "count": int(len(ids)),
+        "countries": idx.countries,
+        "country_id": ids.tolist(),
+    }
+    if detail == "city":
+        out["places"], out["upstream"] = await _resolve_city_cells(lat, lon, ids, idx.countries)
+    return out
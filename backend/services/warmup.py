@@ -0,0 +1,235 @@
+# backend/services/warmup.py — prefetch popular places into the revgeo / wiki / events caches
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+import os, csv, json, time, asyncio, argparse
+
+import httpx
+
+from ..utils.http import aclose_clients
+from ..utils.ratelimit import RateLimiter
+
+router = APIRouter()
+
+# ===================== Config =====================
+# 啟動時自動暖快取：指定 gazetteer 檔（空字串 = 不跑）
+WARMUP_FILE = os.getenv("WARMUP_FILE", "")
+WARMUP_TOP = int(os.getenv("WARMUP_TOP", "200"))              # 只取前 N 筆（檔案依熱門度排序）
+WARMUP_LANGS = [l.strip() for l in os.getenv("WARMUP_LANGS", "zh,en").split(",") if l.strip()]
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "4"))  # 同時處理幾個地點
+WARMUP_DELAY = float(os.getenv("WARMUP_DELAY", "5"))          # 啟動後等幾秒再開始
+# 各上游的禮貌速率（每秒幾個請求）；Nominatim 政策是 1 req/s
+WARMUP_RATES = {
+    "revgeo": float(os.getenv("WARMUP_RATE_REVGEO", "1")),
+    "wiki":   float(os.getenv("WARMUP_RATE_WIKI", "5")),
+    "events": float(os.getenv("WARMUP_RATE_EVENTS", "0.5")),
+}
+PROGRESS_EVERY = 25
+
+# ===================== Gazetteer =====================
+def _num(v: Any) -> Optional[float]:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+def load_gazetteer(path: Path, top: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Places to warm, most popular first. JSON (list of objects) or CSV/TSV
+    with a header row; columns: name, lat, lon and optionally country,
+    admin1, city. Rows without coordinates are skipped.
+    """
+    path = Path(path)
+    text = path.read_text(encoding="utf-8")
+    if path.suffix == ".json":
+        rows = json.loads(text)
+    else:
+        head = text.split("\n", 1)[0]
+        rows = list(csv.DictReader(text.splitlines(), delimiter="\t" if "\t" in head else ","))
+    places = []
+    for r in rows:
+        lat, lon = _num(r.get("lat")), _num(r.get("lon"))
+        if lat is None or lon is None:
+            continue
+        places.append({
+            "name": (r.get("name") or "").strip() or None,
+            "lat": lat, "lon": lon,
+            "country": (r.get("country") or "").strip() or None,
+            "admin1": (r.get("admin1") or "").strip() or None,
+            "city": (r.get("city") or "").strip() or None,
+        })
+        if top and len(places) >= top:
+            break
+    return places
+
+# ===================== Targets =====================
+class InProcess:
+    """Calls the service functions directly, filling this process's caches."""
+
+    async def revgeo(self, lat: float, lon: float) -> Dict[str, Any]:
+        from .revgeo import reverse_geocode
+        return await reverse_geocode(lat=lat, lon=lon)
+
+    async def placeinfo(self, name: str, lang: str, ctx: Dict[str, Any]) -> Dict[str, Any]:
+        from .wiki_place import get_place_basic
+        return await get_place_basic(name, lang, country=ctx.get("country"), lat=ctx["lat"], lon=ctx["lon"])
+
+    async def events(self, place: str) -> Dict[str, Any]:
+        from .history_events import search_history_events
+        return await search_history_events(place)
+
+class Remote:
+    """Hits a running server's public API, so its in-memory caches get warm."""
+
+    def __init__(self, base_url: str):
+        self.base = base_url.rstrip("/")
+        self.cli = httpx.AsyncClient(timeout=httpx.Timeout(30.0))
+
+    async def _json(self, r: httpx.Response) -> Dict[str, Any]:
+        r.raise_for_status()
+        return r.json()
+
+    async def revgeo(self, lat: float, lon: float) -> Dict[str, Any]:
+        return await self._json(await self.cli.get(f"{self.base}/api/revgeo",
+                                                   params={"lat": f"{lat:.6f}", "lon": f"{lon:.6f}"}))
+
+    async def placeinfo(self, name: str, lang: str, ctx: Dict[str, Any]) -> Dict[str, Any]:
+        params = {"name": name, "lang": lang, "lat": ctx["lat"], "lon": ctx["lon"]}
+        if ctx.get("country"):
+            params["country"] = ctx["country"]
+        return await self._json(await self.cli.get(f"{self.base}/api/placeinfo", params=params))
+
+    async def events(self, place: str) -> Dict[str, Any]:
+        return await self._json(await self.cli.post(f"{self.base}/api/history/events",
+                                                    json={"place": place, "only_textual": True}))
+
+    async def aclose(self) -> None:
+        await self.cli.aclose()
+
+# ===================== Runner =====================
+_status: Dict[str, Any] = {"state": "idle"}
+_task: Optional[asyncio.Task] = None
+
+def _new_status(total: int) -> Dict[str, Any]:
+    return {
+        "state": "running",
+        "total": total,
+        "done": 0,
+        "started_at": time.time(),
+        "elapsed_s": 0.0,
+        "services": {s: {"ok": 0, "failed": 0, "throttled_s": 0.0} for s in WARMUP_RATES},
+        "last_error": None,
+    }
+
+async def _step(status, limiters, service: str, coro) -> Optional[Dict[str, Any]]:
+    await limiters[service].acquire()
+    try:
+        res = await coro
+    except Exception as e:
+        status["services"][service]["failed"] += 1
+        status["last_error"] = f"{service}: {e}"
+        return None
+    status["services"][service]["ok" if res and res.get("ok", True) else "failed"] += 1
+    return res
+
+async def _warm_place(p: Dict[str, Any], target, langs: List[str], status, limiters) -> None:
+    # 和前端點擊同一條路：revgeo → (placeinfo × 語言, events) 並行
+    rg = await _step(status, limiters, "revgeo", target.revgeo(p["lat"], p["lon"])) or {}
+    country = p["country"] or rg.get("country")
+    city = p["city"] or rg.get("city")
+    name = city or p["name"] or country
+    if not name:
+        return
+    ctx = {"lat": p["lat"], "lon": p["lon"], "country": country}
+    jobs = [_step(status, limiters, "wiki", target.placeinfo(name, lg, ctx)) for lg in langs]
+    jobs.append(_step(status, limiters, "events", target.events(city or name)))
+    await asyncio.gather(*jobs)
+
+async def run_warmup(places: List[Dict[str, Any]], target=None, *,
+                     langs: Optional[List[str]] = None,
+                     concurrency: int = WARMUP_CONCURRENCY) -> Dict[str, Any]:
+    global _status
+    target = target or InProcess()
+    langs = langs or WARMUP_LANGS
+    limiters = {s: RateLimiter(r) for s, r in WARMUP_RATES.items()}
+    status = _status = _new_status(len(places))
+    queue: asyncio.Queue = asyncio.Queue()
+    for p in places:
+        queue.put_nowait(p)
+
+    async def worker():
+        while True:
+            try:
+                p = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await _warm_place(p, target, langs, status, limiters)
+            status["done"] += 1
+            status["elapsed_s"] = round(time.time() - status["started_at"], 1)
+            if status["done"] % PROGRESS_EVERY == 0 or status["done"] == status["total"]:
+                s = status["services"]
+                print(f"[warmup] {status['done']}/{status['total']} in {status['elapsed_s']}s — "
+                      + ", ".join(f"{k} {v['ok']} ok/{v['failed']} failed" for k, v in s.items()))
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(max(1, concurrency))])
+        status["state"] = "done"
+    except asyncio.CancelledError:
+        status["state"] = "cancelled"
+        raise
+    finally:
+        for s, lim in limiters.items():
+            status["services"][s]["throttled_s"] = round(lim.waited, 1)
+        status["elapsed_s"] = round(time.time() - status["started_at"], 1)
+    return status
+
+def start_warmup() -> Optional[asyncio.Task]:
+    """Startup hook: warm the caches in the background when WARMUP_FILE is set."""
+    global _task
+    if not WARMUP_FILE or _task is not None:
+        return _task
+    try:
+        places = load_gazetteer(Path(WARMUP_FILE), WARMUP_TOP)
+    except (OSError, ValueError) as e:
+        print(f"[warmup] WARN: cannot read {WARMUP_FILE}: {e}")
+        return None
+
+    async def _go():
+        await asyncio.sleep(WARMUP_DELAY)
+        print(f"[warmup] Warming {len(places)} places ({', '.join(WARMUP_LANGS)})")
+        await run_warmup(places)
+
+    _task = asyncio.get_running_loop().create_task(_go())
+    return _task
+
+@router.get("/warmup/status", response_class=JSONResponse)
+def warmup_status():
+    return _status
+
+# ---------- CLI ----------
+# python -m backend.services.warmup places.csv --top 500 --server http://127.0.0.1:8000
+# 不加 --server 時在本行程內跑：只有 wiki 的 SQLite 層會留給之後啟動的 server
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Prefetch popular places into the backend caches")
+    ap.add_argument("gazetteer", type=Path)
+    ap.add_argument("--top", type=int, default=WARMUP_TOP)
+    ap.add_argument("--server", default=None, help="base URL of a running server to warm")
+    ap.add_argument("--langs", default=",".join(WARMUP_LANGS))
+    ap.add_argument("--concurrency", type=int, default=WARMUP_CONCURRENCY)
+    args = ap.parse_args()
+
+    async def _main():
+        places = load_gazetteer(args.gazetteer, args.top)
+        target = Remote(args.server) if args.server else InProcess()
+        try:
+            st = await run_warmup(places, target, langs=[l for l in args.langs.split(",") if l],
+                                  concurrency=args.concurrency)
+        finally:
+            if isinstance(target, Remote):
+                await target.aclose()
+            await aclose_clients()
+        print(json.dumps(st, ensure_ascii=False, indent=2))
+
+    asyncio.run(_main())
@@ -4,9 +4,15 @@ from typing import Optional, Dict, Any, List, Tuple
 from fastapi import APIRouter, Query
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
-import os, urllib.parse, math, time, asyncio
+from pathlib import Path
+import os, urllib.parse, math, asyncio, sqlite3
 
-import httpx  # ← 並發 HTTP
+from ..utils.cache import MISS, TTLCache, is_negative
+from ..utils.disk_cache import DiskCache, open_disk_cache
+from ..utils.http import get_client
+from ..utils.placeclass import BANNED, PLACE_MASK, PlaceClassIndex
+from ..utils.geoindex import GeoArticleIndex, open_geo_index
+from ..utils.singleflight import SingleFlight
 
 load_dotenv()
 router = APIRouter()
@@ -17,48 +23,116 @@ HTTP_TIMEOUT = 6.0             # 單請求超時（秒）
 SEARCH_LIMIT = 6               # 每個 query 拿回的標題數
 CANDIDATE_MAX = 8              # 總候選上限（合併去重後）
 WIKIDATA_REFINE_TOPK = 2       # 初步打分後，只對前 K 名查 Wikidata
+WIKI_DEADLINE = float(os.getenv("WIKI_DEADLINE", "3.5"))   # 每個請求的總延遲預算（秒）
+WIKI_GRACE = 0.25              # 預算用完後，純快取步驟仍給的寬限（秒）
 CACHE_TTL = 24 * 3600          # 24h
+CACHE_NEGATIVE_TTL = 30 * 60   # 空結果/失敗只留 30 分鐘
+CACHE_MAX_ENTRIES = int(os.getenv("WIKI_CACHE_MAX_ENTRIES", "20000"))
+CACHE_MAX_BYTES = int(os.getenv("WIKI_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))   # 約 64 MB
+CACHE_SWEEP_INTERVAL = 300     # 背景清過期項目的間隔（秒）
+# 第二層：同節點所有 worker 共用、重啟不丟的 SQLite 快取（設成空字串即停用）
+CACHE_DB = os.getenv("WIKI_CACHE_DB", str(Path(__file__).resolve().parents[2] / ".cache" / "wiki_place.sqlite3"))
+CACHE_DB_MAX_ROWS = int(os.getenv("WIKI_CACHE_DB_MAX_ROWS", "500000"))
+# 離線 Wikidata 類別索引（python -m backend.utils.placeclass 建置）；不存在時退回內建根類別 + 線上 P31
+PLACE_INDEX_PATH = os.getenv("WIKI_PLACE_INDEX", str(Path(__file__).resolve().parents[2] / ".cache" / "placeclass.bin"))
+# 座標優先：地理標記條目清單（lang/title/lat/lon/qid/weight，TSV 或 npz）；不存在時只走文字搜尋
+GEO_INDEX_PATH = os.getenv("WIKI_GEO_INDEX", str(Path(__file__).resolve().parents[2] / ".cache" / "geoarticles.npz"))
+GEO_NEAR_K = 8                 # 每次點擊取回的最近條目數
+GEO_MAX_KM = float(os.getenv("WIKI_GEO_MAX_KM", "30"))   # 超過這個距離就不算「點到它」
+
+# ===================== HTTP =====================
+HTTP_HEADERS = {"User-Agent": APP_UA}
 
-# ===================== HTTP Client =====================
-def _proxies() -> Optional[Dict[str, str]]:
-    pu = os.getenv("PROXY_URL")
-    if pu:
-        return {"http://": pu, "https://": pu}
-    hp, sp = os.getenv("HTTP_PROXY"), os.getenv("HTTPS_PROXY")
-    if hp or sp:
-        return {"http://": hp or sp, "https://": sp or hp}
-    return None
+async def _get(url: str, params: Optional[Dict[str, Any]] = None):
+    # 共用連線池（utils/http）；Wikimedia 要求可辨識的 UA
+    cli = await get_client()
+    return await cli.get(url, params=params, headers=HTTP_HEADERS, timeout=HTTP_TIMEOUT)
 
-HTTP_HEADERS = {"User-Agent": APP_UA}
-_client: httpx.AsyncClient | None = None
-
-async def get_client() -> httpx.AsyncClient:
-    global _client
-    if _client is None:
-        _client = httpx.AsyncClient(
-            headers=HTTP_HEADERS,
-            proxy=_proxies(),
-            timeout=httpx.Timeout(HTTP_TIMEOUT),
-        )
-    return _client
+# ===================== Two-tier Cache (memory LRU → SQLite) =====================
+# key 形如 "search|zh|..."，第一段即 namespace（search/summary/pageprops/wdP31/wdNames）
+_cache = TTLCache(CACHE_MAX_ENTRIES, CACHE_TTL, max_bytes=CACHE_MAX_BYTES, negative_ttl=CACHE_NEGATIVE_TTL)
+_disk: DiskCache | None = None
+_disk_opened = False
 
-# ===================== Simple TTL Cache =====================
-_cache: Dict[str, Tuple[float, Any]] = {}
+def _disk_tier() -> DiskCache | None:
+    global _disk, _disk_opened
+    if not _disk_opened:
+        _disk_opened = True
+        _disk = open_disk_cache(CACHE_DB, max_rows=CACHE_DB_MAX_ROWS)
+    return _disk
 
 def _ck(*parts: Any) -> str:
     return "|".join(map(str, parts))
 
-def cache_get(key: str):
-    item = _cache.get(key)
-    if not item: return None
-    ts, val = item
-    if time.time() - ts > CACHE_TTL:
-        _cache.pop(key, None)
-        return None
+async def cache_get(key: str, default: Any = None):
+    hit = _cache.get(key, MISS)
+    if hit is not MISS:
+        return hit
+    disk = _disk_tier()
+    if disk is None:
+        return default
+    try:
+        val, remaining = await disk.aget(key)
+    except sqlite3.Error as e:
+        print("[wiki] disk cache get:", e)
+        return default
+    if val is MISS:
+        return default
+    _cache.set(key, val, ttl=remaining)   # 回填 L1，沿用剩餘 TTL
     return val
 
-def cache_set(key: str, val: Any):
-    _cache[key] = (time.time(), val)
+async def cache_get_many(keys: List[str]) -> Dict[str, Any]:
+    """{key: value} for every cached key (missing keys are simply absent)."""
+    out: Dict[str, Any] = {}
+    rest = []
+    for k in keys:
+        hit = _cache.get(k, MISS)
+        if hit is MISS:
+            rest.append(k)
+        else:
+            out[k] = hit
+    disk = _disk_tier()
+    if rest and disk is not None:
+        try:
+            found = await disk.aget_many(rest)
+        except sqlite3.Error as e:
+            print("[wiki] disk cache get_many:", e)
+            found = {}
+        for k, (val, remaining) in found.items():
+            _cache.set(k, val, ttl=remaining)
+            out[k] = val
+    return out
+
+async def cache_set_many(items: List[Tuple[str, Any]]):
+    rows = []
+    for key, val in items:
+        ttl = CACHE_NEGATIVE_TTL if is_negative(val) else CACHE_TTL
+        _cache.set(key, val, ttl=ttl)
+        rows.append((key, val, ttl))
+    disk = _disk_tier()
+    if not rows or disk is None:
+        return
+    try:
+        await disk.aset_many(rows)
+    except sqlite3.Error as e:
+        print("[wiki] disk cache set_many:", e)
+
+async def cache_set(key: str, val: Any):
+    ttl = CACHE_NEGATIVE_TTL if is_negative(val) else CACHE_TTL
+    _cache.set(key, val, ttl=ttl)
+    disk = _disk_tier()
+    if disk is None:
+        return
+    try:
+        await disk.aset(key, val, ttl)
+    except sqlite3.Error as e:
+        print("[wiki] disk cache set:", e)
+
+def start_cache_sweeper():
+    _cache.start_sweeper(CACHE_SWEEP_INTERVAL)
+    disk = _disk_tier()
+    if disk is not None:
+        disk.start_sweeper(CACHE_SWEEP_INTERVAL)
 
 # ===================== Utils =====================
 def _norm(s: Optional[str]) -> str:
@@ -84,129 +158,310 @@ def haversine_km(lat1, lon1, lat2, lon2) -> float:
 # ===================== Wikipedia / Wikidata endpoints =====================
 WIKI_ACTION   = "https://{lang}.wikipedia.org/w/api.php"
 WIKI_SUMMARY  = "https://{lang}.wikipedia.org/api/rest_v1/page/summary/{title}"
-WIKIDATA_ENTITY = "https://www.wikidata.org/wiki/Special:EntityData/{qid}.json"
+WIKIDATA_API  = "https://www.wikidata.org/w/api.php"
+
+# 一次 prop= 查詢就拿齊 summary 卡片 + QID 需要的欄位（取代逐篇 REST summary / pageprops）
+PAGE_PROPS = {
+    "prop": "extracts|description|coordinates|pageimages|pageprops|info",
+    "exintro": 1, "explaintext": 1, "exlimit": "max",
+    "piprop": "thumbnail|original", "pithumbsize": 320, "pilimit": "max",
+    "ppprop": "wikibase_item|disambiguation",
+    "coprimary": "primary", "colimit": "max",
+    "inprop": "url",
+    "redirects": 1,
+    "formatversion": 2,
+}
+PAGES_BATCH = 20        # exintro 時 extracts 每次最多 20 篇
+WIKIDATA_BATCH = 50     # wbgetentities 每次最多 50 個 id
+
+def _page_data(pg: Dict[str, Any]) -> Dict[str, Any]:
+    # 與 REST page/summary 相同形狀：extract 取導言第一段
+    intro = _norm(pg.get("extract"))
+    first = next((p for p in intro.split("\n") if p.strip()), "")
+    coords = (pg.get("coordinates") or [{}])[0]
+    props = pg.get("pageprops") or {}
+    return {
+        "title": pg.get("title"),
+        "description": pg.get("description"),
+        "summary": _norm(first),
+        "thumbnail": _clean_url((pg.get("thumbnail") or {}).get("source")),
+        "original_image": _clean_url((pg.get("original") or {}).get("source")),
+        "url": _clean_url(pg.get("fullurl")),
+        "lat": coords.get("lat"),
+        "lon": coords.get("lon"),
+        "type": "disambiguation" if "disambiguation" in props else "standard",
+    }
+
+def _page_cache_items(lang: str, key_title: str, pg: Optional[Dict[str, Any]]) -> List[Tuple[str, Any]]:
+    if not pg or pg.get("missing") or pg.get("invalid"):
+        return [(_ck("summary", lang, key_title), {}), (_ck("pageprops", lang, key_title), None)]
+    data = _page_data(pg)
+    qid = (pg.get("pageprops") or {}).get("wikibase_item")
+    return [(_ck("summary", lang, key_title), data), (_ck("pageprops", lang, key_title), qid)]
+
+# ---------- primitives (async, cache → single-flight → upstream) ----------
+# 快取沒中時，同一個 key 的並發請求只打一次上游，其餘等同一個 future
+_flight = SingleFlight()
 
-# ---------- primitives (async, with cache) ----------
 async def wiki_search_titles(query: str, lang: str, limit: int = SEARCH_LIMIT) -> List[str]:
     key = _ck("search", lang, query, limit)
-    hit = cache_get(key)
+    hit = await cache_get(key)
     if hit is not None:
         return hit
-    url = WIKI_ACTION.format(lang=lang)
-    params = {
-        "action": "query", "format": "json",
-        "list": "search",
-        "srsearch": query,
-        "srlimit": max(1, min(int(limit), 20)),
-        "srnamespace": 0,
-        "srinfo": "suggestion",
-        "srprop": ""
-    }
-    cli = await get_client()
-    try:
-        r = await cli.get(url, params=params)
-        if r.is_success:
-            items = (r.json().get("query", {}).get("search") or [])
-            titles = [it.get("title") for it in items if it.get("title")]
-        else:
+
+    async def fetch() -> List[str]:
+        # generator=search：同一個請求順便帶回每個結果的 summary/QID，寫進各自的快取
+        url = WIKI_ACTION.format(lang=lang)
+        params = {
+            "action": "query", "format": "json",
+            "generator": "search",
+            "gsrsearch": query,
+            "gsrlimit": max(1, min(int(limit), 20)),
+            "gsrnamespace": 0,
+            **PAGE_PROPS,
+        }
+        items: List[Tuple[str, Any]] = []
+        try:
+            r = await _get(url, params=params)
+            if r.is_success:
+                pages = r.json().get("query", {}).get("pages") or []
+                pages.sort(key=lambda pg: pg.get("index", 0))
+                titles = [pg["title"] for pg in pages if pg.get("title")]
+                for pg in pages:
+                    if pg.get("title"):
+                        items += _page_cache_items(lang, pg["title"], pg)
+            else:
+                titles = []
+        except Exception:
             titles = []
+        await cache_set_many(items + [(key, titles)])
+        return titles
+
+    return await _flight.do(key, fetch)
+
+async def _fetch_pages_chunk(lang: str, chunk: List[str]) -> Dict[str, Dict[str, Any]]:
+    params = {"action": "query", "format": "json", "titles": "|".join(chunk), **PAGE_PROPS}
+    try:
+        r = await _get(WIKI_ACTION.format(lang=lang), params=params)
+        q = r.json().get("query", {}) if r.is_success else {}
     except Exception:
-        titles = []
-    cache_set(key, titles)
-    return titles
+        q = {}
+    # 輸入標題 → 正規化 → 重新導向 → 實際頁面
+    alias = {a["from"]: a["to"] for a in (q.get("normalized") or []) + (q.get("redirects") or [])}
+    by_title = {pg.get("title"): pg for pg in (q.get("pages") or [])}
+    out: Dict[str, Dict[str, Any]] = {}
+    items: List[Tuple[str, Any]] = []
+    for t in chunk:
+        final = t
+        for _ in range(3):
+            if final not in alias:
+                break
+            final = alias[final]
+        page_items = _page_cache_items(lang, t, by_title.get(final))
+        out[t] = page_items[0][1]
+        items += page_items
+    await cache_set_many(items)
+    return out
+
+async def wiki_pages_batch(lang: str, titles: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Summary-card data for many titles: cached ones are free, the rest come
+    from one prop= query per PAGES_BATCH titles (redirects followed).
+    """
+    titles = [t for t in dict.fromkeys(titles) if t]
+    cached = await cache_get_many([_ck("summary", lang, t) for t in titles])
+    out = {t: cached[_ck("summary", lang, t)] for t in titles if _ck("summary", lang, t) in cached}
+    missing = [t for t in titles if t not in out]
+    chunks = [missing[i:i + PAGES_BATCH] for i in range(0, len(missing), PAGES_BATCH)]
+    for got in await asyncio.gather(*[
+        _flight.do(_ck("pages", lang, *c), lambda c=c: _fetch_pages_chunk(lang, c)) for c in chunks
+    ]):
+        out.update(got)
+    return out
 
 async def wiki_summary(lang: str, title: str) -> Dict[str, Any]:
     key = _ck("summary", lang, title)
-    hit = cache_get(key)
+    hit = await cache_get(key)
     if hit is not None:
         return hit
-    path = urllib.parse.quote((_norm(title)).replace(" ", "_"))
-    url  = WIKI_SUMMARY.format(lang=lang, title=path)
-    cli = await get_client()
-    try:
-        r = await cli.get(url)
-        if not r.is_success:
-            cache_set(key, {})
-            return {}
-        js = r.json()
-        data = {
-            "title": js.get("title") or title,
-            "description": js.get("description"),
-            "summary": _norm(js.get("extract")),
-            "thumbnail": _clean_url((js.get("thumbnail") or {}).get("url")),
-            "original_image": _clean_url((js.get("originalimage") or {}).get("source")),
-            "url": _clean_url(((js.get("content_urls", {}) or {}).get("desktop", {}) or {}).get("page")),
-            "lat": (js.get("coordinates") or {}).get("lat"),
-            "lon": (js.get("coordinates") or {}).get("lon"),
-            "type": js.get("type"),  # 'standard' | 'disambiguation' | ...
-        }
-    except Exception:
-        data = {}
-    cache_set(key, data)
-    return data
+
+    async def fetch() -> Dict[str, Any]:
+        path = urllib.parse.quote((_norm(title)).replace(" ", "_"))
+        url  = WIKI_SUMMARY.format(lang=lang, title=path)
+        try:
+            r = await _get(url)
+            if not r.is_success:
+                await cache_set(key, {})
+                return {}
+            js = r.json()
+            data = {
+                "title": js.get("title") or title,
+                "description": js.get("description"),
+                "summary": _norm(js.get("extract")),
+                "thumbnail": _clean_url((js.get("thumbnail") or {}).get("url")),
+                "original_image": _clean_url((js.get("originalimage") or {}).get("source")),
+                "url": _clean_url(((js.get("content_urls", {}) or {}).get("desktop", {}) or {}).get("page")),
+                "lat": (js.get("coordinates") or {}).get("lat"),
+                "lon": (js.get("coordinates") or {}).get("lon"),
+                "type": js.get("type"),  # 'standard' | 'disambiguation' | ...
+            }
+        except Exception:
+            data = {}
+        await cache_set(key, data)
+        return data
+
+    return await _flight.do(key, fetch)
 
 async def wiki_pageprops_wikidata(lang: str, title: str) -> Optional[str]:
     key = _ck("pageprops", lang, title)
-    hit = cache_get(key)
-    if hit is not None:
+    hit = await cache_get(key, MISS)   # None 也是有效的（負向）快取
+    if hit is not MISS:
         return hit
-    url = WIKI_ACTION.format(lang=lang)
-    params = {
-        "action": "query", "format": "json",
-        "prop": "pageprops",
-        "titles": title,
-        "ppprop": "wikibase_item"
-    }
-    cli = await get_client()
+
+    async def fetch() -> Optional[str]:
+        url = WIKI_ACTION.format(lang=lang)
+        params = {
+            "action": "query", "format": "json",
+            "prop": "pageprops",
+            "titles": title,
+            "ppprop": "wikibase_item"
+        }
+        try:
+            r = await _get(url, params=params)
+            if not r.is_success:
+                await cache_set(key, None)
+                return None
+            pages = (r.json().get("query", {}).get("pages") or {})
+            qid = None
+            for _, pg in pages.items():
+                qid = (pg.get("pageprops") or {}).get("wikibase_item")
+                if qid: break
+        except Exception:
+            qid = None
+        await cache_set(key, qid)
+        return qid
+
+    return await _flight.do(key, fetch)
+
+async def _fetch_p31_chunk(chunk: List[str]) -> Dict[str, List[str]]:
+    params = {"action": "wbgetentities", "format": "json", "ids": "|".join(chunk), "props": "claims"}
     try:
-        r = await cli.get(url, params=params)
-        if not r.is_success:
-            cache_set(key, None)
-            return None
-        pages = (r.json().get("query", {}).get("pages") or {})
-        qid = None
-        for _, pg in pages.items():
-            qid = (pg.get("pageprops") or {}).get("wikibase_item")
-            if qid: break
+        r = await _get(WIKIDATA_API, params=params)
+        ents = (r.json().get("entities") or {}) if r.is_success else {}
     except Exception:
-        qid = None
-    cache_set(key, qid)
-    return qid
+        ents = {}
+    out: Dict[str, List[str]] = {}
+    for q in chunk:
+        inst = ((ents.get(q) or {}).get("claims") or {}).get("P31") or []
+        vals = []
+        for c in inst:
+            v = (((c.get("mainsnak") or {}).get("datavalue") or {}).get("value") or {})
+            if v.get("id"):
+                vals.append(v["id"])
+        out[q] = vals
+    await cache_set_many([(_ck("wdP31", q), out[q]) for q in chunk])
+    return out
+
+async def wikidata_instanceof_batch(qids: List[str]) -> Dict[str, List[str]]:
+    """P31 (instance of) for many QIDs via wbgetentities, WIKIDATA_BATCH ids per request."""
+    qids = [q for q in dict.fromkeys(qids) if q]
+    cached = await cache_get_many([_ck("wdP31", q) for q in qids])
+    out = {q: cached[_ck("wdP31", q)] for q in qids if _ck("wdP31", q) in cached}
+    missing = [q for q in qids if q not in out]
+    chunks = [missing[i:i + WIKIDATA_BATCH] for i in range(0, len(missing), WIKIDATA_BATCH)]
+    for got in await asyncio.gather(*[
+        _flight.do(_ck("wdP31batch", *c), lambda c=c: _fetch_p31_chunk(c)) for c in chunks
+    ]):
+        out.update(got)
+    return out
 
 async def wikidata_instanceof(qid: str) -> List[str]:
     if not qid:
         return []
-    key = _ck("wdP31", qid)
-    hit = cache_get(key)
+    return (await wikidata_instanceof_batch([qid])).get(qid, [])
+
+async def wikidata_names(qid: str) -> Dict[str, Any]:
+    """
+    {label, description, names} for one entity: English label/description
+    plus every label and alias in any language (for checking that a QID
+    really names a given place string).
+    """
+    key = _ck("wdNames", qid)
+    hit = await cache_get(key)
     if hit is not None:
         return hit
-    url = WIKIDATA_ENTITY.format(qid=qid)
-    cli = await get_client()
-    try:
-        r = await cli.get(url)
-        if not r.is_success:
-            cache_set(key, [])
-            return []
-        js = r.json()
-        ent = (js.get("entities") or {}).get(qid) or {}
-        claims = ent.get("claims") or {}
-        inst = claims.get("P31") or []
-        out = []
-        for c in inst:
-            v = (((c.get("mainsnak") or {}).get("datavalue") or {}).get("value") or {})
-            q = v.get("id")
-            if q:
-                out.append(q)
-    except Exception:
-        out = []
-    cache_set(key, out)
-    return out
+
+    async def fetch() -> Dict[str, Any]:
+        params = {"action": "wbgetentities", "format": "json", "ids": qid,
+                  "props": "labels|aliases|descriptions"}
+        try:
+            r = await _get(WIKIDATA_API, params=params)
+            ent = ((r.json().get("entities") or {}).get(qid) or {}) if r.is_success else {}
+        except Exception:
+            ent = {}
+        if not ent or "missing" in ent:
+            data = {}
+        else:
+            labels = ent.get("labels") or {}
+            names = [v.get("value") for v in labels.values()]
+            names += [a.get("value") for al in (ent.get("aliases") or {}).values() for a in al]
+            data = {
+                "label": (labels.get("en") or {}).get("value"),
+                "description": ((ent.get("descriptions") or {}).get("en") or {}).get("value"),
+                "names": [n for n in dict.fromkeys(names) if n],
+            }
+        await cache_set(key, data)
+        return data
+
+    return await _flight.do(key, fetch)
+
+# ---------- place classes ----------
+_place_index: PlaceClassIndex | None = None
+
+def place_index() -> PlaceClassIndex:
+    global _place_index
+    if _place_index is None:
+        try:
+            _place_index = PlaceClassIndex.open(Path(PLACE_INDEX_PATH))
+            print(f"[wiki] Place-class index: {len(_place_index)} entries from {PLACE_INDEX_PATH}")
+        except (OSError, ValueError) as e:
+            if PLACE_INDEX_PATH and not isinstance(e, FileNotFoundError):
+                print(f"[wiki] WARN: place-class index unusable ({PLACE_INDEX_PATH}): {e}")
+            _place_index = PlaceClassIndex.builtin()
+    return _place_index
+
+async def wikidata_place_flags(qids: List[str]) -> Dict[str, int]:
+    """
+    Place-class flags per QID. Entities in the local index need no network;
+    the rest fall back to a batched P31 fetch classified through the
+    index's subclass closure.
+    """
+    idx = place_index()
+    flags = {q: idx.lookup(q) for q in dict.fromkeys(qids) if q}
+    unknown = [q for q, f in flags.items() if f is None]
+    if unknown:
+        p31 = await wikidata_instanceof_batch(unknown)
+        for q in unknown:
+            flags[q] = idx.classify(p31.get(q, []))
+    return flags
+
+# ---------- geotagged articles ----------
+_geo_index: GeoArticleIndex | None = None
+_geo_opened = False
+
+def geo_index() -> GeoArticleIndex | None:
+    global _geo_index, _geo_opened
+    if not _geo_opened:
+        _geo_opened = True
+        _geo_index = open_geo_index(GEO_INDEX_PATH)
+    return _geo_index
+
+def load_local_indexes() -> None:
+    # 啟動時就載入，避免第一個請求在事件迴圈上解析大檔
+    place_index()
+    geo_index()
 
 # ---------- scoring ----------
-_ALLOWED_PLACE_QIDS = {
-    "Q486972","Q515","Q6256","Q82794","Q56061","Q133442","Q15642541","Q70208","Q1907114","Q1799794","Q5107",
-}
-_BANNED_QIDS = {"Q5","Q11424","Q482994","Q5398426","Q571","Q13442814","Q202444","Q101352"}
 
 def _text_contains(hay: str, needle: Optional[str]) -> bool:
     h = _lc(hay); n = _lc(needle)
@@ -232,79 +487,163 @@ def coarse_score(idx: int, data: Dict[str, Any], ctx: Dict[str, Any]) -> float:
     if (data.get("type") or "").lower() == "disambiguation":
         score -= 60
 
-    km = haversine_km(ctx.get("lat"), ctx.get("lon"), data.get("lat"), data.get("lon"))
-    if km < 10:   score += 30
-    elif km < 40: score += 18
-    elif km < 150:score += 9
-    elif km < 500:score += 3
-    elif km > 2000: score -= 4
+    score += distance_score(haversine_km(ctx.get("lat"), ctx.get("lon"), data.get("lat"), data.get("lon")))
 
     if data.get("lat") is not None and data.get("lon") is not None:
         score += 4
 
     return score
 
-def refine_score(base: float, qids: List[str]) -> float:
+def distance_score(km: float) -> float:
+    if km < 10:   return 30
+    if km < 40:   return 18
+    if km < 150:  return 9
+    if km < 500:  return 3
+    if km > 2000: return -4
+    return 0
+
+def geo_prescore(cand: Dict[str, Any], ctx: Dict[str, Any], flags: int) -> float:
+    # 座標優先模式的本機預排序：距離分級 + 名稱吻合 + 類別 + 熱門度（全部不需網路）
+    score = distance_score(cand["km"]) + max(0.0, 10 - cand["km"])
+    title = _norm(cand.get("title"))
+    if _text_contains(title, ctx.get("query_name")): score += 12
+    if _text_contains(title, ctx.get("city")):       score += 20
+    if _text_contains(title, ctx.get("admin1")):     score += 6
+    score += 3 * math.log1p(max(0.0, cand.get("weight") or 0.0))
+    return refine_score(score, flags)
+
+def refine_score(base: float, flags: int) -> float:
     sc = base
-    if any(q in _BANNED_QIDS for q in qids): sc -= 100
-    if any(q in _ALLOWED_PLACE_QIDS for q in qids): sc += 28
+    if flags & BANNED: sc -= 100
+    if flags & PLACE_MASK: sc += 28
     return sc
 
-# ---------- core resolver (async) ----------
-async def resolve_best_wiki(place: str, lang_pref: str, ctx: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], str]:
-    async def candidates_for(lang: str) -> List[str]:
-        queries = [place]
-        if ctx.get("admin1"):  queries.append(f"{place} {ctx['admin1']}")
-        if ctx.get("country"): queries.append(f"{place} {ctx['country']}")
-        # 去重後合併
-        results = []
-        seen = set()
-        for q in queries:
-            for t in await wiki_search_titles(q, lang=lang, limit=SEARCH_LIMIT):
-                if t not in seen:
-                    seen.add(t); results.append(t)
-                if len(results) >= CANDIDATE_MAX:
-                    break
+# ---------- latency budget ----------
+class _Budget:
+    """Per-request deadline; anything cut short by it marks the answer partial."""
+
+    def __init__(self, seconds: float):
+        self._loop = asyncio.get_running_loop()
+        self.end = self._loop.time() + max(0.0, seconds)
+        self.partial = False
+
+    def left(self) -> float:
+        return max(0.0, self.end - self._loop.time())
+
+    async def run(self, aw, default, *, grace: float = 0.0):
+        timeout = max(self.left(), grace)
+        if timeout <= 0:
+            if asyncio.iscoroutine(aw):
+                aw.close()
+            else:
+                asyncio.ensure_future(aw).cancel()
+            self.partial = True
+            return default
+        try:
+            return await asyncio.wait_for(aw, timeout)
+        except asyncio.TimeoutError:
+            self.partial = True
+            return default
+
+def _merge_titles(tasks: List[asyncio.Task]) -> List[str]:
+    # 依查詢順序合併已完成的結果，去重並截斷
+    results, seen = [], set()
+    for t in tasks:
+        if not t.done() or t.cancelled() or t.exception() is not None:
+            continue
+        for title in t.result():
+            if title not in seen:
+                seen.add(title); results.append(title)
             if len(results) >= CANDIDATE_MAX:
-                break
-        return results
+                return results
+    return results
+
+# ---------- coordinate-first resolver (async) ----------
+async def resolve_nearest_wiki(lang_pref: str, ctx: Dict[str, Any],
+                               budget: Optional[_Budget] = None) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    Nearest geotagged articles to the click from the local KD-tree, ranked
+    locally; only the winner's summary is fetched (plus one runner-up if
+    the winner has no extract).
+    """
+    gi = geo_index()
+    lat, lon = ctx.get("lat"), ctx.get("lon")
+    if gi is None or lat is None or lon is None:
+        return None, lang_pref
+    budget = budget or _Budget(WIKI_DEADLINE)
+    pidx = place_index()
+    for lg in [lang_pref] + (["en"] if lang_pref != "en" else []):
+        near = gi.nearest(lat, lon, lang=lg, k=GEO_NEAR_K, max_km=GEO_MAX_KM)
+        if not near:
+            continue
+        flags = [(pidx.lookup(c["qid"]) or 0) if c["qid"] else 0 for c in near]
+        ranked = sorted(range(len(near)), key=lambda i: geo_prescore(near[i], ctx, flags[i]), reverse=True)
+        for i in ranked[:2]:
+            if flags[i] & BANNED:
+                continue
+            title = near[i]["title"]
+            pages = await budget.run(wiki_pages_batch(lg, [title]), {}, grace=WIKI_GRACE)
+            data = pages.get(title)
+            if data and data.get("summary"):
+                return data, lg
+    return None, lang_pref
 
-    titles = await candidates_for(lang_pref)
-    used_lang = lang_pref
-    if not titles and lang_pref != "en":
-        titles = await candidates_for("en")
-        used_lang = "en"
+# ---------- core resolver (async) ----------
+async def resolve_best_wiki(place: str, lang_pref: str, ctx: Dict[str, Any],
+                            budget: Optional[_Budget] = None) -> Tuple[Optional[Dict[str, Any]], str]:
+    budget = budget or _Budget(WIKI_DEADLINE)
+    queries = [place]
+    if ctx.get("admin1"):  queries.append(f"{place} {ctx['admin1']}")
+    if ctx.get("country"): queries.append(f"{place} {ctx['country']}")
+
+    # 所有查詢變體 + 推測性的 en 一起發出；偏好語言有結果就丟掉 en
+    langs = [lang_pref] + (["en"] if lang_pref != "en" else [])
+    tasks = {lg: [asyncio.ensure_future(wiki_search_titles(q, lang=lg, limit=SEARCH_LIMIT)) for q in queries]
+             for lg in langs}
+    titles, used_lang = [], lang_pref
+    try:
+        for lg in langs:
+            await asyncio.wait(tasks[lg], timeout=budget.left())
+            if not all(t.done() for t in tasks[lg]):
+                budget.partial = True   # 預算到了：用目前為止的最佳結果
+            titles = _merge_titles(tasks[lg])
+            if titles:
+                used_lang = lg
+                break
+    finally:
+        for ts in tasks.values():
+            for t in ts:
+                t.cancel()
     if not titles:
         return None, used_lang
 
-    # 批量抓 summary（used_lang），空摘要才補抓 en
-    summaries = await asyncio.gather(*[wiki_summary(used_lang, t) for t in titles])
+    # 批量抓 summary（used_lang；搜尋時已寫進快取），空摘要才補抓 en
+    pages = await budget.run(wiki_pages_batch(used_lang, titles), {}, grace=WIKI_GRACE)
+    summaries = [pages.get(t) or {} for t in titles]
     need_en = [i for i, d in enumerate(summaries) if not d.get("summary") and used_lang != "en"]
     if need_en:
-        en_sums = await asyncio.gather(*[wiki_summary("en", titles[i]) for i in need_en])
-        for j, i in enumerate(need_en):
-            if en_sums[j].get("summary"):
-                summaries[i] = en_sums[j]
+        en_pages = await budget.run(wiki_pages_batch("en", [titles[i] for i in need_en]), {})
+        for i in need_en:
+            if (en_pages.get(titles[i]) or {}).get("summary"):
+                summaries[i] = en_pages[titles[i]]
 
     # 初步打分（不查 wikidata）
     bases = [coarse_score(i, summaries[i], {**ctx, "query_name": place}) for i in range(len(titles))]
     order = sorted(range(len(titles)), key=lambda i: bases[i], reverse=True)
 
-    # 只對前 K 名補 Wikidata 類型，做細修分
+    # 只對前 K 名補 Wikidata 類型，做細修分（預算不夠就用初步分數）
     K = min(WIKIDATA_REFINE_TOPK, len(order))
     refined_scores = bases[:]
     if K > 0:
         top_idx = order[:K]
-        # 先抓 pageprops(QID)
-        qids = await asyncio.gather(*[
-            wiki_pageprops_wikidata(used_lang, summaries[i].get("title") or titles[i]) for i in top_idx
-        ])
-        # 再抓 P31
-        p31s = await asyncio.gather(*[
-            wikidata_instanceof(q or "") for q in qids
-        ])
+        # QID 已隨 prop= 查詢進快取；類別先查本機索引，查不到才批次抓 P31
+        qids = await budget.run(
+            asyncio.gather(*[wiki_pageprops_wikidata(used_lang, titles[i]) for i in top_idx]),
+            [None] * K, grace=WIKI_GRACE,
+        )
+        flags = await budget.run(wikidata_place_flags([q for q in qids if q]), {})
         for j, i in enumerate(top_idx):
-            refined_scores[i] = refine_score(bases[i], p31s[j])
+            refined_scores[i] = refine_score(bases[i], flags.get(qids[j] or "", 0))
 
     # 選最高分
     best_i = max(range(len(titles)), key=lambda i: refined_scores[i])
@@ -320,25 +659,41 @@ async def get_place_basic(place: str,
                           admin1: Optional[str] = None,
                           city: Optional[str] = None,
                           lat: Optional[float] = None,
-                          lon: Optional[float] = None) -> Dict[str, Any]:
-    ctx = {"country": country, "admin1": admin1, "city": city, "lat": lat, "lon": lon}
-    data, used_lang = await resolve_best_wiki(place, lang, ctx)
-
-    if not data:
-        # 最終退路：單一標題 + 單次 summary
-        titles = await wiki_search_titles(place, lang or "zh", limit=1)
-        if not titles and lang != "en":
-            titles = await wiki_search_titles(place, "en", limit=1)
-            used_lang = "en"
-        if titles:
-            data = await wiki_summary(used_lang, titles[0])
+                          lon: Optional[float] = None,
+                          deadline: Optional[float] = None,
+                          mode: str = "auto") -> Dict[str, Any]:
+    """mode: "geo" = nearest geotagged article only, "text" = search only, "auto" = geo then text."""
+    budget = _Budget(WIKI_DEADLINE if deadline is None else deadline)
+    ctx = {"country": country, "admin1": admin1, "city": city, "lat": lat, "lon": lon, "query_name": place}
+    data, used_lang, resolver = None, lang, "text"
+    if mode in ("auto", "geo"):
+        data, used_lang = await resolve_nearest_wiki(lang, ctx, budget)
+        resolver = "geo"
+    if not data and mode != "geo":
+        data, used_lang = await resolve_best_wiki(place, lang, ctx, budget)
+        resolver = "text"
+
+    if not data and mode != "geo" and budget.left() > 0:
+        # 最終退路：單一標題 + 單次 summary（偏好語言與 en 同時查）
+        langs = [lang or "zh"] + (["en"] if lang != "en" else [])
+        found = await budget.run(
+            asyncio.gather(*[wiki_search_titles(place, lg, limit=1) for lg in langs]),
+            [[] for _ in langs],
+        )
+        for lg, titles in zip(langs, found):
+            if titles:
+                used_lang = lg
+                data = await budget.run(wiki_summary(lg, titles[0]), {}, grace=WIKI_GRACE)
+                break
 
     if not data:
-        return {"ok": False, "query": place, "lang": used_lang, "error": "no_result"}
+        return {"ok": False, "query": place, "lang": used_lang, "error": "no_result", "partial": budget.partial}
 
     # 最後補一次 QID（有 cache，幾乎零成本）
-    qid = await wiki_pageprops_wikidata(used_lang, data.get("title") or place) or \
-          await wiki_pageprops_wikidata("en",     data.get("title") or place)
+    async def final_qid() -> Optional[str]:
+        return await wiki_pageprops_wikidata(used_lang, data.get("title") or place) or \
+               await wiki_pageprops_wikidata("en",     data.get("title") or place)
+    qid = await budget.run(final_qid(), None, grace=WIKI_GRACE)
 
     return {
         "ok": True,
@@ -354,9 +709,11 @@ async def get_place_basic(place: str,
         "lat": data.get("lat"),
         "lon": data.get("lon"),
         "wikidata_qid": qid,
+        "resolver": resolver,
+        "partial": budget.partial,
     }
 
-# ---------- FastAPI route (async) ----------
+# ---------- FastAPI routes (async) ----------
 @router.get("/placeinfo", response_class=JSONResponse)
 async def placeinfo_api(
     name: str = Query(..., description="Place name (locality/district/city)"),
@@ -366,10 +723,24 @@ async def placeinfo_api(
     city:    Optional[str] = Query(None, description="City/Town/Village"),
     lat:     Optional[float] = Query(None),
     lon:     Optional[float] = Query(None),
+    deadline: Optional[float] = Query(None, gt=0, le=30, description="Latency budget in seconds"),
+    mode:    str = Query("auto", pattern="^(auto|geo|text)$", description="geo = nearest geotagged article"),
 ):
-    data = await get_place_basic(name, lang, country=country, admin1=admin1, city=city, lat=lat, lon=lon)
+    data = await get_place_basic(name, lang, country=country, admin1=admin1, city=city, lat=lat, lon=lon,
+                                 deadline=deadline, mode=mode)
     return JSONResponse(data)
 
+@router.get("/placeinfo/stats", response_class=JSONResponse)
+def placeinfo_stats():
+    disk = _disk_tier()
+    return {
+        "cache": _cache.stats(),
+        "singleflight": _flight.stats(),
+        "disk": {"path": str(disk.path), "rows": disk.count()} if disk else None,
+        "place_index": place_index().stats(),
+        "geo_index": geo_index().stats() if geo_index() else None,
+    }
+
 # ---------- Local smoke test ----------
 if __name__ == "__main__":
     import asyncio
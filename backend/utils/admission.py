@@ -0,0 +1,122 @@
+# backend/utils/admission.py — bounded concurrency + bounded wait queue for slow upstreams
+from __future__ import annotations
+from collections import deque
+from typing import Any, Dict, Optional
+import asyncio, math, time
+
+from .breaker import _percentile
+
+class QueueFull(Exception):
+    """Raised instead of queueing; `retry_after` is a hint in whole seconds."""
+
+    def __init__(self, gate: str, retry_after: int, reason: str = "queue full"):
+        super().__init__(f"{gate}: {reason}")
+        self.gate = gate
+        self.retry_after = retry_after
+
+class AdmissionGate:
+    """
+    At most `concurrency` calls run at once; up to `max_queue` more wait,
+    each for at most `max_wait` seconds. Anything beyond that is rejected
+    right away with QueueFull, so a slow upstream sheds load instead of
+    piling up requests.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.max_wait = float(max_wait)
+        self._sem = asyncio.Semaphore(self.concurrency)
+        self.inflight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waits: deque = deque(maxlen=200)      # 排隊秒數
+        self._service: deque = deque(maxlen=200)    # 佔用秒數
+
+    def retry_after(self) -> int:
+        # 粗估：佇列前面的人 × 平均服務時間 ÷ 並行數
+        svc = sum(self._service) / len(self._service) if self._service else 5.0
+        return max(1, min(120, math.ceil(svc * (self.waiting + 1) / self.concurrency)))
+
+    def has_slot(self) -> bool:
+        """A call admitted right now would start without queueing."""
+        return not self._sem.locked()
+
+    async def acquire(self) -> float:
+        """Wait for a slot; returns the acquire time for release()."""
+        t0 = time.monotonic()
+        if self.has_slot():
+            await self._sem.acquire()   # 有空位：立即取得，不會讓出事件迴圈
+        else:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(self.name, self.retry_after())
+            self.waiting += 1
+            try:
+                async with asyncio.timeout(self.max_wait):
+                    await self._sem.acquire()
+            except TimeoutError:
+                self.timed_out += 1
+                raise QueueFull(self.name, self.retry_after(), "queue wait timed out") from None
+            finally:
+                self.waiting -= 1
+        now = time.monotonic()
+        self._waits.append(now - t0)
+        self.inflight += 1
+        self.admitted += 1
+        return now
+
+    async def try_acquire(self) -> Optional[float]:
+        """Slot only if one is free right now (never queues); None otherwise."""
+        if not self.has_slot():
+            return None
+        await self._sem.acquire()   # 有空位：立即取得
+        now = time.monotonic()
+        self._waits.append(0.0)
+        self.inflight += 1
+        self.admitted += 1
+        return now
+
+    def release(self, started: float) -> None:
+        self.inflight -= 1
+        self._service.append(time.monotonic() - started)
+        self._sem.release()
+
+    def slot(self) -> "_Slot":
+        """`async with gate.slot():` — acquire/release around one call."""
+        return _Slot(self)
+
+    def stats(self) -> Dict[str, Any]:
+        ms = lambda v: round(v * 1000, 1) if v is not None else None
+        waits, svc = sorted(self._waits), sorted(self._service)
+        return {
+            "concurrency": self.concurrency,
+            "inflight": self.inflight,
+            "queue_depth": self.waiting,
+            "max_queue": self.max_queue,
+            "max_wait_s": self.max_wait,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_ms": {"p50": ms(_percentile(waits, 0.5)), "p90": ms(_percentile(waits, 0.9))},
+            "service_ms": {"p50": ms(_percentile(svc, 0.5)), "p90": ms(_percentile(svc, 0.9))},
+            "retry_after_s": self.retry_after(),
+        }
+
+class _Slot:
+    # 每次呼叫一個 context：同一個 gate 可被多個 task 同時使用
+    __slots__ = ("gate", "started")
+
+    def __init__(self, gate: AdmissionGate):
+        self.gate = gate
+        self.started: Optional[float] = None
+
+    async def __aenter__(self) -> "_Slot":
+        self.started = await self.gate.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.gate.release(self.started)
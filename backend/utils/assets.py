@@ -1,5 +1,6 @@
 from pathlib import Path
-import requests
+
+from .http import get_sync_client
 
 PINNED_THREE_VER = "0.160.0"
 
@@ -30,7 +31,7 @@ def _download_first(urls, path: Path, name: str):
     for url in urls:
         try:
             print(f"[assets] Fetch {name} from {url}")
-            r = requests.get(url, timeout=30)
+            r = get_sync_client().get(url, timeout=30)
             r.raise_for_status()
             path.write_bytes(r.content)
             print(f"[assets] Wrote {path} ({len(r.content)} bytes)")
@@ -0,0 +1,171 @@
+# backend/utils/breaker.py — per-upstream health tracking and circuit breakers
+from __future__ import annotations
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+import threading, time
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+def _percentile(sorted_vals: List[float], q: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    k = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[k]
+
+class ProviderHealth:
+    """
+    Rolling window of call outcomes for one upstream plus a circuit breaker:
+    `failure_threshold` consecutive failures open the circuit; after
+    `cooldown` seconds a single half-open probe decides whether it closes.
+    """
+
+    def __init__(self, name: str, *, priority: int = 0, window: int = 100,
+                 failure_threshold: int = 3, cooldown: float = 30.0,
+                 min_samples: int = 5, prior_cost: float = 1.0):
+        self.name = name
+        self.priority = priority
+        self.min_samples = int(min_samples)
+        self.prior_cost = float(prior_cost)
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = float(cooldown)
+        self._ok: deque = deque(maxlen=window)        # bool per finished call
+        self._quality: deque = deque(maxlen=window)   # bool per successful call
+        self._lat: deque = deque(maxlen=window)       # seconds per finished or cancelled call
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_inflight = False
+        self.calls = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.last_error: Optional[str] = None
+        self.last_latency: Optional[float] = None
+
+    # ---------- breaker ----------
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probe_inflight:
+                self.probe_inflight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool, latency: float, *, quality: Optional[bool] = None,
+               error: Optional[str] = None) -> None:
+        with self._lock:
+            self.calls += 1
+            self._ok.append(bool(ok))
+            self._lat.append(float(latency))
+            self.last_latency = float(latency)
+            self.probe_inflight = False
+            if ok:
+                if quality is not None:
+                    self._quality.append(bool(quality))
+                self.consecutive_failures = 0
+                self.state = CLOSED
+                return
+            self.last_error = error
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def skip(self) -> None:
+        """
+        allow() said yes but the call never started (e.g. no admission
+        slot): frees the half-open probe without counting anything.
+        """
+        with self._lock:
+            self.probe_inflight = False
+
+    def release(self, elapsed: Optional[float] = None) -> None:
+        """
+        Call was cancelled (e.g. lost a hedged race): no success/failure
+        verdict, but the elapsed time is kept as a latency lower bound so a
+        provider that always loses still reads as slow.
+        """
+        with self._lock:
+            self.cancelled += 1
+            self.probe_inflight = False
+            if elapsed is not None:
+                self._lat.append(float(elapsed))
+
+    # ---------- stats ----------
+    def success_rate(self) -> Optional[float]:
+        return sum(self._ok) / len(self._ok) if self._ok else None
+
+    def quality_rate(self) -> Optional[float]:
+        return sum(self._quality) / len(self._quality) if self._quality else None
+
+    def percentile(self, q: float) -> Optional[float]:
+        return _percentile(sorted(self._lat), q)
+
+    def samples(self) -> int:
+        return len(self._lat)
+
+    def cost(self) -> float:
+        """
+        Expected seconds per useful answer; lower is better. Until
+        `min_samples` observations exist the static `prior_cost` is used.
+        """
+        if self.samples() < self.min_samples:
+            return self.prior_cost
+        p50 = self.percentile(0.5) or 0.0
+        sr, qr = self.success_rate(), self.quality_rate()
+        useful = (1.0 if sr is None else sr) * (1.0 if qr is None else qr)
+        return p50 / max(useful, 0.05)
+
+    def snapshot(self) -> Dict[str, Any]:
+        ms = lambda v: round(v * 1000, 1) if v is not None else None
+        sr, qr = self.success_rate(), self.quality_rate()
+        retry_in = None
+        if self.state == OPEN:
+            retry_in = round(max(0.0, self.cooldown - (time.monotonic() - self.opened_at)), 1)
+        return {
+            "name": self.name,
+            "priority": self.priority,
+            "state": self.state,
+            "retry_in_s": retry_in,
+            "consecutive_failures": self.consecutive_failures,
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "cost_s": round(self.cost(), 3),
+            "success_rate": round(sr, 3) if sr is not None else None,
+            "quality_rate": round(qr, 3) if qr is not None else None,
+            "latency_ms": {"p50": ms(self.percentile(0.5)), "p90": ms(self.percentile(0.9)),
+                           "p99": ms(self.percentile(0.99)), "last": ms(self.last_latency)},
+            "last_error": self.last_error,
+        }
+
+class ProviderRegistry:
+    """
+    Health for a group of interchangeable upstreams. ordered() sorts by
+    observed cost; a provider without enough samples yet is ranked by a prior
+    of `base_cost * (priority + 1)`, so the static order holds until real
+    numbers say otherwise. Open circuits sink to the end.
+    """
+
+    def __init__(self, names: Iterable[str], *, base_cost: float = 1.0, **health_kw):
+        self.providers: Dict[str, ProviderHealth] = {
+            n: ProviderHealth(n, priority=i, prior_cost=base_cost * (i + 1), **health_kw)
+            for i, n in enumerate(names)
+        }
+
+    def __getitem__(self, name: str) -> ProviderHealth:
+        return self.providers[name]
+
+    def ordered(self) -> List[str]:
+        hs = sorted(self.providers.values(), key=lambda h: (h.state == OPEN, h.cost(), h.priority))
+        return [h.name for h in hs]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "order": self.ordered(),
+            "providers": [h.snapshot() for h in self.providers.values()],
+        }
@@ -0,0 +1,170 @@
+# backend/utils/cache.py — in-process LRU cache with TTL, byte budget and per-namespace metrics
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import threading, time
+
+MISS = object()   # sentinel：區分「沒快取」與「快取了 None」
+
+def approx_size(obj: Any) -> int:
+    """Rough resident size of JSON-like values (bytes); cheap, not exact."""
+    if obj is None or isinstance(obj, bool):
+        return 16
+    if isinstance(obj, (int, float)):
+        return 28
+    if isinstance(obj, str):
+        return 49 + len(obj)
+    if isinstance(obj, bytes):
+        return 33 + len(obj)
+    if isinstance(obj, dict):
+        return 64 + sum(approx_size(k) + approx_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return 56 + sum(8 + approx_size(v) for v in obj)
+    return 64
+
+def _namespace(key: Hashable) -> str:
+    # "search|zh|..." → "search"；tuple key → 第一個元素
+    if isinstance(key, str) and "|" in key:
+        return key.split("|", 1)[0]
+    if isinstance(key, tuple) and key:
+        return str(key[0])
+    return "default"
+
+def is_negative(val: Any) -> bool:
+    return val is None or (isinstance(val, (str, list, dict, tuple)) and len(val) == 0)
+
+class TTLCache:
+    """
+    LRU cache capped by entry count and (optionally) an approximate byte
+    budget; every entry carries its own expiry. Empty results ("negative"
+    entries) can get a shorter TTL. Counters are kept per namespace.
+    Thread-safe so sync routes (threadpool) and async routes can share it.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, *,
+                 max_bytes: Optional[int] = None,
+                 negative_ttl: Optional[float] = None,
+                 namespace: Callable[[Hashable], str] = _namespace,
+                 sizeof: Callable[[Any], int] = approx_size):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.negative_ttl = float(negative_ttl) if negative_ttl is not None else None
+        self._namespace = namespace
+        self._sizeof = sizeof
+        # key -> (expires_at, value, size, namespace)
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, int, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ns: Dict[str, Dict[str, int]] = {}
+        self.bytes = 0
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ---------- counters ----------
+    def _c(self, ns: str) -> Dict[str, int]:
+        c = self._ns.get(ns)
+        if c is None:
+            c = self._ns[ns] = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0,
+                                "entries": 0, "bytes": 0}
+        return c
+
+    def _drop(self, key: Hashable, reason: Optional[str]) -> None:
+        _, _, size, ns = self._data.pop(key)
+        c = self._c(ns)
+        if reason:
+            c[reason] += 1
+        c["entries"] -= 1
+        c["bytes"] -= size
+        self.bytes -= size
+
+    # ---------- API ----------
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._c(self._namespace(key))["misses"] += 1
+                return default
+            exp, val, _, ns = item
+            if now >= exp:
+                self._drop(key, "expirations")
+                self._c(ns)["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self._c(ns)["hits"] += 1
+            return val
+
+    def set(self, key: Hashable, val: Any, ttl: Optional[float] = None) -> None:
+        if ttl is None:
+            ttl = self.negative_ttl if (self.negative_ttl is not None and is_negative(val)) else self.ttl
+        exp = time.time() + float(ttl)
+        size = self._sizeof(key) + self._sizeof(val)
+        ns = self._namespace(key)
+        with self._lock:
+            if key in self._data:
+                self._drop(key, None)   # 覆寫：不算過期也不算淘汰
+            self._data[key] = (exp, val, size, ns)
+            c = self._c(ns)
+            c["entries"] += 1
+            c["bytes"] += size
+            self.bytes += size
+            while self._data and (len(self._data) > self.max_entries or
+                                  (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                self._drop(next(iter(self._data)), "evictions")
+
+    def sweep(self) -> int:
+        """Drop every expired entry; returns how many were removed."""
+        now = time.time()
+        with self._lock:
+            dead = [k for k, (exp, _, _, _) in self._data.items() if now >= exp]
+            for k in dead:
+                self._drop(k, "expirations")
+        return len(dead)
+
+    def start_sweeper(self, interval: float) -> None:
+        """Background daemon thread calling sweep() every `interval` seconds."""
+        if self._sweeper is not None:
+            return
+        self._stop.clear()
+        def loop():
+            while not self._stop.wait(interval):
+                self.sweep()
+        self._sweeper = threading.Thread(target=loop, name="cache-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self) -> None:
+        self._stop.set()
+        self._sweeper = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+            for c in self._ns.values():
+                c["entries"] = c["bytes"] = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ns = {k: dict(v) for k, v in self._ns.items()}
+        tot = lambda f: sum(v[f] for v in ns.values())
+        hits, misses = tot("hits"), tot("misses")
+        for v in ns.values():
+            n = v["hits"] + v["misses"]
+            v["hit_rate"] = round(v["hits"] / n, 4) if n else None
+        return {
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "negative_ttl": self.negative_ttl,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+            "evictions": tot("evictions"),
+            "expirations": tot("expirations"),
+            "namespaces": ns,
+        }
@@ -0,0 +1,266 @@
+# backend/utils/countries.py — offline country lookup over countries.geojson
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import json, math, re
+
+import numpy as np
+
+GRID_DEG = 5.0    # 粗網格：每格只記 bbox 相交的多邊形
+BAND_DEG = 1.0    # 多邊形的邊依緯度分帶，射線法只掃同一帶的邊
+COAST_MARGIN_DEG = 0.5  # 低解析度海岸線的容忍距離（約 50 km）
+PIP_CHUNK = 1 << 21     # 向量化射線法：每批 (點數 × 邊數) 上限，控制暫存記憶體
+
+_ISO3_RE = re.compile(r"^[A-Z]{3}$")
+
+Edge = Tuple[float, float, float, float]
+
+def _country_name(props: Dict[str, Any]) -> Optional[str]:
+    # 與 frontend/main.js::countryName 相同的欄位優先序
+    for k in ("ADMIN", "NAME_LONG", "NAME", "name", "SOVEREIGNT", "COUNTRY"):
+        if props.get(k):
+            return props[k]
+    return None
+
+def _country_iso3(feature: Dict[str, Any]) -> Optional[str]:
+    props = feature.get("properties") or {}
+    for v in (props.get("ISO_A3"), props.get("iso_a3"), props.get("ADM0_A3"), props.get("WB_A3"), feature.get("id")):
+        if isinstance(v, str) and _ISO3_RE.match(v):
+            return v
+    return None
+
+def _close_polar(ring: List[List[float]]) -> List[Tuple[float, float]]:
+    """
+    Rings that jump across the antimeridian (Antarctica) are closed through the
+    pole so they stay simple polygons in lon/lat space.
+    """
+    out: List[Tuple[float, float]] = []
+    for pt in ring:
+        x, y = float(pt[0]), float(pt[1])
+        if out and abs(x - out[-1][0]) > 180:
+            px, py = out[-1]
+            side = 180.0 if px > 0 else -180.0
+            pole = -90.0 if py < 0 else 90.0
+            out += [(side, py), (side, pole), (-side, pole), (-side, y)]
+        out.append((x, y))
+    if out and out[0] != out[-1]:
+        out.append(out[0])
+    return out
+
+class _Polygon:
+    __slots__ = ("fid", "bbox", "bands", "edges")
+
+    def __init__(self, fid: int, rings: List[List[Tuple[float, float]]]):
+        self.fid = fid
+        xs = [x for r in rings for x, _ in r]
+        ys = [y for r in rings for _, y in r]
+        self.bbox = (min(xs), min(ys), max(xs), max(ys))
+        self.bands: Dict[int, List[Edge]] = {}
+        edges: List[Edge] = []
+        # 外環與內環（洞）一起放：even-odd 規則自然處理洞
+        for ring in rings:
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+                if y1 == y2:
+                    continue
+                edges.append((x1, y1, x2, y2))
+                lo, hi = min(y1, y2), max(y1, y2)
+                for b in range(math.floor(lo / BAND_DEG), math.floor(hi / BAND_DEG) + 1):
+                    self.bands.setdefault(b, []).append((x1, y1, x2, y2))
+        self.edges = np.asarray(edges, dtype=np.float64).reshape(-1, 4)
+
+    def contains(self, lon: float, lat: float) -> bool:
+        minx, miny, maxx, maxy = self.bbox
+        if not (minx <= lon <= maxx and miny <= lat <= maxy):
+            return False
+        inside = False
+        for x1, y1, x2, y2 in self.bands.get(math.floor(lat / BAND_DEG), ()):
+            if (y1 > lat) != (y2 > lat) and lon < (x2 - x1) * (lat - y1) / (y2 - y1) + x1:
+                inside = not inside
+        return inside
+
+    def contains_many(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        """Vectorized ray test for points already inside the bbox."""
+        x1, y1, x2, y2 = self.edges.T
+        slope = (x2 - x1) / (y2 - y1)
+        inside = np.zeros(lon.shape[0], dtype=bool)
+        step = max(1, PIP_CHUNK // max(1, len(x1)))
+        for i in range(0, lon.shape[0], step):
+            px = lon[i:i + step, None]
+            py = lat[i:i + step, None]
+            cross = ((y1 > py) != (y2 > py)) & (px < slope * (py - y1) + x1)
+            inside[i:i + step] = np.count_nonzero(cross, axis=1) & 1
+        return inside
+
+class CountryIndex:
+    """
+    Point-in-polygon index over a countries FeatureCollection.
+    A coarse grid narrows each query to a few polygons; the ray test inside a
+    polygon only visits edges in the query's latitude band.
+    """
+
+    def __init__(self, features: List[Dict[str, Any]]):
+        self.countries: List[Dict[str, Any]] = []
+        self.polygons: List[_Polygon] = []
+        self._grid: Dict[Tuple[int, int], List[_Polygon]] = {}
+
+        for f in features:
+            g = f.get("geometry") or {}
+            if g.get("type") == "Polygon":
+                polys = [g.get("coordinates") or []]
+            elif g.get("type") == "MultiPolygon":
+                polys = g.get("coordinates") or []
+            else:
+                continue
+            fid = len(self.countries)
+            self.countries.append({
+                "country": _country_name(f.get("properties") or {}),
+                "country_iso3": _country_iso3(f),
+            })
+            for poly in polys:
+                rings = [_close_polar(r) for r in poly if len(r) >= 3]
+                if rings:
+                    self.polygons.append(_Polygon(fid, rings))
+
+        for p in self.polygons:
+            minx, miny, maxx, maxy = p.bbox
+            for gx in range(math.floor(minx / GRID_DEG), math.floor(maxx / GRID_DEG) + 1):
+                for gy in range(math.floor(miny / GRID_DEG), math.floor(maxy / GRID_DEG) + 1):
+                    self._grid.setdefault((gx, gy), []).append(p)
+
+    @classmethod
+    def from_geojson(cls, path: Path) -> "CountryIndex":
+        geo = json.loads(Path(path).read_text(encoding="utf-8"))
+        return cls(geo.get("features") or [])
+
+    def locate(self, lat: float, lon: float) -> int:
+        """Feature index containing (lat, lon), or -1 for ocean."""
+        lon = (lon + 180.0) % 360.0 - 180.0
+        lat = max(-90.0, min(90.0, lat))
+        cell = (math.floor(lon / GRID_DEG), math.floor(lat / GRID_DEG))
+        for p in self._grid.get(cell, ()):
+            if p.contains(lon, lat):
+                return p.fid
+        return -1
+
+    def locate_near(self, lat: float, lon: float, margin: float = COAST_MARGIN_DEG) -> int:
+        """
+        Like locate(), but a miss probes a small ring of offsets so clicks on a
+        coastline the low-res polygons cut off still resolve to land.
+        """
+        fid = self.locate(lat, lon)
+        if fid >= 0 or margin <= 0:
+            return fid
+        kx = 1.0 / max(math.cos(math.radians(lat)), 0.1)
+        for r in (margin / 2, margin):
+            for k in range(8):
+                a = k * math.pi / 4
+                fid = self.locate(lat + r * math.sin(a), lon + r * kx * math.cos(a))
+                if fid >= 0:
+                    return fid
+        return -1
+
+    def locate_many(self, lats, lons, margin: float = 0.0) -> np.ndarray:
+        """
+        Vectorized locate() for arrays of points; returns an int32 array of
+        feature indices (-1 = ocean). Points are sorted by latitude once so each
+        polygon's bbox prefilter is a searchsorted slice plus a longitude mask.
+        With `margin` > 0, misses get the same coastal probing as locate_near().
+        """
+        lat = np.clip(np.asarray(lats, dtype=np.float64).ravel(), -90.0, 90.0)
+        lon = (np.asarray(lons, dtype=np.float64).ravel() + 180.0) % 360.0 - 180.0
+        out = self._locate_sorted(lat, lon)
+        if margin > 0:
+            kx = 1.0 / np.maximum(np.cos(np.radians(lat)), 0.1)
+            for r in (margin / 2, margin):
+                for k in range(8):
+                    miss = np.flatnonzero(out < 0)
+                    if miss.size == 0:
+                        return out
+                    a = k * math.pi / 4
+                    plat = np.clip(lat[miss] + r * math.sin(a), -90.0, 90.0)
+                    plon = (lon[miss] + r * kx[miss] * math.cos(a) + 180.0) % 360.0 - 180.0
+                    out[miss] = self._locate_sorted(plat, plon)
+        return out
+
+    def _locate_sorted(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        order = np.argsort(lat, kind="stable")
+        slat, slon = lat[order], lon[order]
+        res = np.full(lat.shape[0], -1, dtype=np.int32)
+        for p in self.polygons:
+            minx, miny, maxx, maxy = p.bbox
+            i0 = int(np.searchsorted(slat, miny, side="left"))
+            i1 = int(np.searchsorted(slat, maxy, side="right"))
+            if i0 >= i1:
+                continue
+            sub = slon[i0:i1]
+            cand = np.flatnonzero((sub >= minx) & (sub <= maxx) & (res[i0:i1] < 0))
+            if cand.size == 0:
+                continue
+            cand += i0
+            hit = p.contains_many(slon[cand], slat[cand])
+            res[cand[hit]] = p.fid
+        out = np.empty_like(res)
+        out[order] = res
+        return out
+
+    def rasterize(self, width: int, height: int) -> np.ndarray:
+        """
+        Equirectangular (width × height) int32 raster of feature indices
+        (-1 = ocean), row 0 = 90°N, sampled at pixel centers — the same
+        answer locate() gives there, but by scanline: each polygon's edge
+        crossings per row are paired into spans (even-odd), so cost grows
+        with edges × rows instead of pixels × edges.
+        """
+        out = np.full((height, width), -1, dtype=np.int32)
+        for p in self.polygons:
+            x1, y1, x2, y2 = p.edges.T
+            # 每條邊跨過哪些列（列中心緯度 lat_r = 90 - (r + .5) * 180 / H）
+            ylo, yhi = np.minimum(y1, y2), np.maximum(y1, y2)
+            # 先取寬一點的列範圍，下面再用和 contains() 相同的條件精確過濾
+            r0 = np.floor((90.0 - yhi) * height / 180.0 - 0.5).astype(np.int64)
+            r1 = np.floor((90.0 - ylo) * height / 180.0 - 0.5).astype(np.int64) + 1
+            r0 = np.clip(r0, 0, height)
+            r1 = np.clip(r1, 0, height)
+            n = np.maximum(r1 - r0, 0)
+            if not n.any():
+                continue
+            e = np.repeat(np.arange(len(x1)), n)
+            rows = np.repeat(r0, n) + (np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n))
+            lat = 90.0 - (rows + 0.5) * 180.0 / height
+            ok = (y1[e] > lat) != (y2[e] > lat)
+            e, rows, lat = e[ok], rows[ok], lat[ok]
+            xc = x1[e] + (lat - y1[e]) * (x2[e] - x1[e]) / (y2[e] - y1[e])
+            col = np.clip(np.ceil((xc + 180.0) * width / 360.0 - 0.5), 0, width).astype(np.int64)
+            order = np.lexsort((col, rows))
+            rows, col = rows[order], col[order]
+            if rows.size == 0 or rows.size % 2:
+                continue   # 比一列還窄，或破損的環（交點數必為偶數）
+            start, end, rr = col[0::2], col[1::2], rows[0::2]
+            base = int(rr.min())
+            span = np.zeros((int(rr.max()) - base + 1, width + 1), dtype=np.int32)
+            np.add.at(span, (rr - base, start), 1)
+            np.add.at(span, (rr - base, end), -1)
+            mask = np.cumsum(span[:, :width], axis=1) > 0
+            view = out[base:base + mask.shape[0]]
+            view[mask & (view < 0)] = p.fid
+        return out
+
+    def lookup(self, lat: float, lon: float, margin: float = COAST_MARGIN_DEG) -> Optional[Dict[str, Any]]:
+        fid = self.locate_near(lat, lon, margin)
+        return dict(self.countries[fid]) if fid >= 0 else None
+
+# ===================== Process-wide index =====================
+_index: Optional[CountryIndex] = None
+
+def load_country_index(path: Path) -> Optional[CountryIndex]:
+    global _index
+    try:
+        _index = CountryIndex.from_geojson(path)
+        print(f"[countries] Indexed {len(_index.countries)} countries / {len(_index.polygons)} polygons from {path}")
+    except Exception as e:
+        print(f"[countries] WARN: offline index unavailable ({path}): {e}")
+        _index = None
+    return _index
+
+def get_country_index() -> Optional[CountryIndex]:
+    return _index
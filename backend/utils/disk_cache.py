@@ -0,0 +1,138 @@
+# backend/utils/disk_cache.py — SQLite (WAL) cache tier shared by every worker on a node
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import asyncio, json, sqlite3, threading, time
+
+from .cache import MISS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key     TEXT PRIMARY KEY,
+    expires REAL NOT NULL,
+    value   TEXT NOT NULL
+)
+"""
+
+class DiskCache:
+    """
+    JSON values in a single SQLite file. WAL mode lets several uvicorn
+    workers read concurrently while one writes; entries keep an absolute
+    expiry so TTLs survive restarts. The sync methods block, so async
+    callers should use aget/aset (run in a worker thread).
+    """
+
+    def __init__(self, path: Path, *, max_rows: Optional[int] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_rows = int(max_rows) if max_rows else None
+        self._local = threading.local()
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._conn().execute(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 連線不可跨執行緒共用：每個執行緒一條
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---------- sync ----------
+    def get(self, key: str) -> Tuple[Any, float]:
+        """(value, remaining_ttl) or (MISS, 0)."""
+        row = self._conn().execute("SELECT expires, value FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return MISS, 0.0
+        remaining = row[0] - time.time()
+        if remaining <= 0:
+            return MISS, 0.0
+        return json.loads(row[1]), remaining
+
+    def set(self, key: str, val: Any, ttl: float) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (key, expires, value) VALUES (?, ?, ?)",
+            (key, time.time() + float(ttl), json.dumps(val, ensure_ascii=False)),
+        )
+
+    def get_many(self, keys: List[str]) -> Dict[str, Tuple[Any, float]]:
+        """{key: (value, remaining_ttl)} for the live keys among `keys`."""
+        out: Dict[str, Tuple[Any, float]] = {}
+        now = time.time()
+        conn = self._conn()
+        for i in range(0, len(keys), 500):   # SQLite 參數數量上限
+            chunk = keys[i:i + 500]
+            q = f"SELECT key, expires, value FROM kv WHERE key IN ({','.join('?' * len(chunk))})"
+            for key, expires, value in conn.execute(q, chunk):
+                if expires > now:
+                    out[key] = (json.loads(value), expires - now)
+        return out
+
+    def set_many(self, items: Iterable[Tuple[str, Any, float]]) -> None:
+        now = time.time()
+        rows = [(k, now + float(ttl), json.dumps(v, ensure_ascii=False)) for k, v, ttl in items]
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT OR REPLACE INTO kv (key, expires, value) VALUES (?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def sweep(self) -> int:
+        """Delete expired rows (and the soonest-expiring ones beyond max_rows)."""
+        conn = self._conn()
+        n = conn.execute("DELETE FROM kv WHERE expires <= ?", (time.time(),)).rowcount
+        if self.max_rows:
+            n += conn.execute(
+                "DELETE FROM kv WHERE key IN (SELECT key FROM kv ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,),
+            ).rowcount
+        return n
+
+    def start_sweeper(self, interval: float) -> None:
+        if self._sweeper is not None:
+            return
+        self._stop.clear()
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.sweep()
+                except sqlite3.Error as e:
+                    print("[disk-cache] sweep:", e)
+        self._sweeper = threading.Thread(target=loop, name="disk-cache-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self) -> None:
+        self._stop.set()
+        self._sweeper = None
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+
+    # ---------- async (off the event loop) ----------
+    async def aget(self, key: str) -> Tuple[Any, float]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, val: Any, ttl: float) -> None:
+        await asyncio.to_thread(self.set, key, val, ttl)
+
+    async def aget_many(self, keys: List[str]) -> Dict[str, Tuple[Any, float]]:
+        return await asyncio.to_thread(self.get_many, keys)
+
+    async def aset_many(self, items: List[Tuple[str, Any, float]]) -> None:
+        await asyncio.to_thread(self.set_many, items)
+
+def open_disk_cache(path: Optional[str], **kw) -> Optional[DiskCache]:
+    """DiskCache at `path`, or None when disabled (empty path) or unusable."""
+    if not path:
+        return None
+    try:
+        return DiskCache(Path(path), **kw)
+    except (OSError, sqlite3.Error) as e:
+        print(f"[disk-cache] WARN: disabled ({path}): {e}")
+        return None
@@ -0,0 +1,208 @@
+# backend/utils/events_index.py — local SQLite FTS5 index of harvested WorldHistory search results
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+import re, sys, json, time, asyncio, sqlite3, threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id         INTEGER PRIMARY KEY,
+    url        TEXT NOT NULL UNIQUE,
+    title      TEXT NOT NULL,
+    summary    TEXT,
+    image      TEXT,
+    author     TEXT,
+    type       TEXT,
+    ci_type_id INTEGER,
+    queries    TEXT NOT NULL DEFAULT '',   -- 曾經搜到這篇的查詢（tab 分隔）
+    updated    REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS queries (
+    query      TEXT PRIMARY KEY,           -- 正規化後的查詢字串
+    fetched_at REAL NOT NULL,
+    count      INTEGER NOT NULL,
+    textual    INTEGER NOT NULL            -- 1 = 只收了文字類（only_textual）結果
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    title, summary, author, type, queries,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+# bm25 欄位權重（順序同 items_fts）：標題最重要，其次是「哪個查詢搜到它」
+BM25_WEIGHTS = (10.0, 2.0, 1.0, 0.5, 4.0)
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def norm_query(q: str) -> str:
+    return " ".join(_TOKEN_RE.findall((q or "").casefold()))
+
+def match_expr(q: str) -> Optional[str]:
+    """FTS5 MATCH expression: every token of `q` as a quoted term (AND)."""
+    toks = _TOKEN_RE.findall((q or "").casefold())
+    return " ".join('"' + t.replace('"', '""') + '"' for t in toks) or None
+
+class EventsIndex:
+    """
+    Items parsed from WorldHistory search pages, keyed by URL, with an
+    FTS5 table (rowid = items.id) for BM25 search and a record of when
+    each query was last harvested. WAL mode; one connection per thread.
+    The sync methods block, so async callers should use the a* variants.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 連線不可跨執行緒共用：每個執行緒一條
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---------- ingest ----------
+    def ingest(self, query: str, items: Iterable[Dict[str, Any]]) -> int:
+        """
+        Upsert `items` as results of `query`; returns how many were written.
+        Called per page: it does not mark `query` as harvested, see
+        record_harvest().
+        """
+        q = norm_query(query)
+        now = time.time()
+        conn = self._conn()
+        n = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for it in items:
+                url, title = it.get("url"), it.get("title")
+                if not url or not title:
+                    continue
+                row = conn.execute("SELECT id, queries FROM items WHERE url = ?", (url,)).fetchone()
+                qs = row[1].split("\t") if row and row[1] else []
+                if q and q not in qs:
+                    qs.append(q)
+                fields = (title, it.get("summary"), it.get("image"), it.get("author"), it.get("type"),
+                          it.get("ci_type_id"), "\t".join(qs), now)
+                if row is None:
+                    rid = conn.execute(
+                        "INSERT INTO items (title, summary, image, author, type, ci_type_id, queries, updated, url) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", fields + (url,)).lastrowid
+                else:
+                    rid = row[0]
+                    conn.execute(
+                        "UPDATE items SET title = ?, summary = ?, image = ?, author = ?, type = ?, ci_type_id = ?, "
+                        "queries = ?, updated = ? WHERE id = ?", fields + (rid,))
+                    conn.execute("DELETE FROM items_fts WHERE rowid = ?", (rid,))
+                conn.execute(
+                    "INSERT INTO items_fts (rowid, title, summary, author, type, queries) VALUES (?, ?, ?, ?, ?, ?)",
+                    (rid, title, it.get("summary") or "", it.get("author") or "", it.get("type") or "",
+                     " ".join(qs)))
+                n += 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return n
+
+    def record_harvest(self, query: str, count: int, *, textual: bool = False) -> None:
+        """
+        Mark `query` as fully harvested now, with `count` items over all its
+        pages. `textual` marks a harvest that kept only textual items, which
+        can't answer an all-types search later.
+        """
+        q = norm_query(query)
+        if not q:
+            return
+        # 收過完整結果就不退回「只有文字類」
+        self._conn().execute(
+            "INSERT INTO queries (query, fetched_at, count, textual) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (query) DO UPDATE SET fetched_at = excluded.fetched_at, "
+            "count = excluded.count, textual = MIN(textual, excluded.textual)",
+            (q, time.time(), int(count), int(textual)))
+
+    # ---------- query ----------
+    def harvested_at(self, query: str, *, all_types: bool = False) -> Optional[float]:
+        """When `query` was last harvested (None if never, or only textually when `all_types`)."""
+        row = self._conn().execute("SELECT fetched_at, textual FROM queries WHERE query = ?",
+                                   (norm_query(query),)).fetchone()
+        if row is None or (all_types and row[1]):
+            return None
+        return row[0]
+
+    def search(self, query: str, *, only_textual: bool = True, limit: int = 50) -> List[Dict[str, Any]]:
+        """Items matching every token of `query`, best BM25 score first."""
+        expr = match_expr(query)
+        if not expr:
+            return []
+        weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+        sql = (
+            f"SELECT i.title, i.summary, i.url, i.image, i.author, i.type, i.ci_type_id, "
+            f"bm25(items_fts, {weights}) AS score "
+            f"FROM items_fts JOIN items i ON i.id = items_fts.rowid "
+            f"WHERE items_fts MATCH ? {'AND i.ci_type_id IN (1, 2) ' if only_textual else ''}"
+            f"ORDER BY score, i.id LIMIT ?"   # 同分時維持收錄順序（≈ 網站原排序）
+        )
+        cols = ("title", "summary", "url", "image", "author", "type", "ci_type_id")
+        out = []
+        for row in self._conn().execute(sql, (expr, int(limit))):
+            item = dict(zip(cols, row[:7]))
+            item["score"] = round(-row[7], 6)   # bm25() 越小越相關；翻成越大越好
+            out.append(item)
+        return out
+
+    def lookup(self, query: str, *, only_textual: bool = True, limit: int = 50):
+        """(harvested_at, items) in one call — one hop to the worker thread."""
+        return (self.harvested_at(query, all_types=not only_textual),
+                self.search(query, only_textual=only_textual, limit=limit))
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._conn()
+        return {
+            "path": str(self.path),
+            "items": conn.execute("SELECT COUNT(*) FROM items").fetchone()[0],
+            "queries": conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0],
+            "oldest_query_age_s": (lambda r: round(time.time() - r, 1) if r else None)(
+                conn.execute("SELECT MIN(fetched_at) FROM queries").fetchone()[0]),
+        }
+
+    # ---------- async (off the event loop) ----------
+    async def aingest(self, query: str, items: List[Dict[str, Any]]) -> int:
+        return await asyncio.to_thread(self.ingest, query, items)
+
+    async def arecord_harvest(self, query: str, count: int, **kw) -> None:
+        await asyncio.to_thread(self.record_harvest, query, count, **kw)
+
+    async def alookup(self, query: str, **kw):
+        return await asyncio.to_thread(self.lookup, query, **kw)
+
+def open_events_index(path: Optional[str]) -> Optional[EventsIndex]:
+    """EventsIndex at `path`, or None when disabled (empty path) or FTS5 is unavailable."""
+    if not path:
+        return None
+    try:
+        return EventsIndex(Path(path))
+    except (OSError, sqlite3.Error) as e:
+        print(f"[events-index] WARN: disabled ({path}): {e}")
+        return None
+
+# ---------- CLI ----------
+# python -m backend.utils.events_index .cache/events_fts.sqlite3 "silk road"
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python -m backend.utils.events_index <db> [query] [--all-types]")
+        sys.exit(2)
+    idx = EventsIndex(Path(sys.argv[1]))
+    args = [a for a in sys.argv[2:] if not a.startswith("--")]
+    if not args:
+        print(json.dumps(idx.stats(), indent=2))
+    else:
+        t0 = time.perf_counter()
+        rows = idx.search(" ".join(args), only_textual="--all-types" not in sys.argv, limit=20)
+        for r in rows:
+            print(f"{r['score']:>8}  {r['title']}  <{r['url']}>")
+        print(f"[events-index] {len(rows)} results in {(time.perf_counter() - t0) * 1000:.1f} ms")
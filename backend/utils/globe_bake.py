@@ -0,0 +1,209 @@
+# backend/utils/globe_bake.py — bake the political base texture + RGB country-ID raster from countries.geojson
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import os, json, time, zlib, struct, hashlib, colorsys
+
+import numpy as np
+
+from .countries import CountryIndex
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+GLOBE_TEX_W = int(os.getenv("GLOBE_TEX_W", "2048"))      # 高 = 寬 / 2（等距圓柱）
+GLOBE_BAKE_DIR = Path(os.getenv("GLOBE_BAKE_DIR", str(PROJECT_ROOT / ".cache" / "globe")))
+SUPERSAMPLE = 2          # 底圖以 2× 解析度畫再縮小 = 反鋸齒；ID 圖不做（每個像素只能有一個國家）
+BAKE_VERSION = 1         # 畫法一改就 +1，舊檔自然失效
+
+# 樣式與 frontend/main.js::buildPoliticalBaseAndPicker 相同
+OCEAN_STOPS = [(0.0, "#0a2236"), (0.5, "#0f2f4a"), (1.0, "#133a58")]
+GRATICULE_DEG, GRATICULE_ALPHA = 15, 0.06
+BORDER, BORDER_ALPHA = "#dbe7f3", 0.9
+CONT_COLORS = {
+    "africa": "#7fb069",
+    "europe": "#f7b267",
+    "asia": "#f4845f",
+    "north america": "#6db1ff",
+    "south america": "#b089f7",
+    "oceania": "#4fd1c5",
+    "australia": "#4fd1c5",
+    "antarctica": "#b9c2d0",
+    "latin america and the caribbean": "#b089f7",
+    "asia-pacific": "#f4845f",
+}
+
+# ===================== Colours (JS 同款) =====================
+def _rgb(hex_color: str) -> Tuple[int, int, int]:
+    h = hex_color.lstrip("#")
+    return int(h[0:2], 16), int(h[2:4], 16), int(h[4:6], 16)
+
+def _js_name(p: Dict[str, Any]) -> str:
+    for k in ("ADMIN", "NAME_LONG", "NAME", "name", "SOVEREIGNT", "COUNTRY"):
+        if p.get(k):
+            return str(p[k])
+    return "Unknown"
+
+def _js_iso3(p: Dict[str, Any]) -> Optional[str]:
+    for k in ("ISO_A3", "iso_a3", "ADM0_A3", "WB_A3"):
+        if p.get(k):
+            return str(p[k])
+    return None
+
+def _hash_color(s: str, sat: float = 0.65, light: float = 0.55) -> Tuple[int, int, int]:
+    # main.js::hashColor：(h * 31 + charCode) | 0，逐個 UTF-16 code unit
+    h = 0
+    units = s.encode("utf-16-le")
+    for i in range(0, len(units), 2):
+        h = (h * 31 + int.from_bytes(units[i:i + 2], "little")) & 0xFFFFFFFF
+    hue = (h % 360) / 360.0
+    r, g, b = colorsys.hls_to_rgb(hue, light, sat)
+    return round(r * 255), round(g * 255), round(b * 255)
+
+def _land_color(props: Dict[str, Any]) -> Tuple[int, int, int]:
+    cont = str(props.get("CONTINENT") or props.get("continent") or props.get("region_un")
+               or props.get("REGION_UN") or "").lower().strip()
+    if cont in CONT_COLORS:
+        return _rgb(CONT_COLORS[cont])
+    return _hash_color(_js_iso3(props) or _js_name(props))
+
+# ===================== PNG =====================
+def encode_png(rgb: np.ndarray) -> bytes:
+    """Lossless 8-bit RGB PNG; tries filters None/Sub/Up on the whole image and keeps the smallest."""
+    h, w, _ = rgb.shape
+    raw = np.ascontiguousarray(rgb, dtype=np.uint8).reshape(h, w * 3)
+    sub = raw.copy()
+    sub[:, 3:] -= raw[:, :-3]
+    up = raw.copy()
+    up[1:] -= raw[:-1]
+    best = None
+    for ftype, rows in ((0, raw), (1, sub), (2, up)):
+        data = np.hstack([np.full((h, 1), ftype, dtype=np.uint8), rows]).tobytes()
+        z = zlib.compress(data, 9)
+        if best is None or len(z) < len(best):
+            best = z
+
+    def chunk(tag: bytes, body: bytes) -> bytes:
+        return struct.pack(">I", len(body)) + tag + body + struct.pack(">I", zlib.crc32(tag + body))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", best)
+            + chunk(b"IEND", b""))
+
+# ===================== Bake =====================
+def _features(geo: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # 與 CountryIndex 相同的篩選 → 第 i 個就是 fid = i
+    return [f for f in geo.get("features") or []
+            if (f.get("geometry") or {}).get("type") in ("Polygon", "MultiPolygon")]
+
+def _edges(ids: np.ndarray) -> np.ndarray:
+    # 與左右/上下鄰居不同國（至少一邊是陸地）的像素 = 國界/海岸線；經度方向環繞
+    diff = np.zeros(ids.shape, dtype=bool)
+    for other in (np.roll(ids, 1, axis=1), np.roll(ids, -1, axis=1)):
+        diff |= (ids != other) & ((ids >= 0) | (other >= 0))
+    vert = (ids[1:] != ids[:-1]) & ((ids[1:] >= 0) | (ids[:-1] >= 0))
+    diff[1:] |= vert
+    diff[:-1] |= vert
+    return diff
+
+def render_base(index: CountryIndex, features: List[Dict[str, Any]], width: int, height: int) -> np.ndarray:
+    """Ocean gradient + graticule + land fill + borders, drawn at SUPERSAMPLE× and box-filtered down."""
+    W, H = width * SUPERSAMPLE, height * SUPERSAMPLE
+    t = (np.arange(H) + 0.5) / H
+    stops = np.array([s for s, _ in OCEAN_STOPS])
+    cols = np.array([_rgb(c) for _, c in OCEAN_STOPS], dtype=np.float64)
+    ocean = np.stack([np.interp(t, stops, cols[:, k]) for k in range(3)], axis=1)
+    img = np.broadcast_to(ocean[:, None, :], (H, W, 3)).copy()
+
+    for lon in range(-180, 181, GRATICULE_DEG):
+        x = min(W - 1, round((lon + 180) / 360 * W))
+        img[:, x] += (255 - img[:, x]) * GRATICULE_ALPHA
+    for lat in range(-90 + GRATICULE_DEG, 90, GRATICULE_DEG):
+        y = min(H - 1, round((90 - lat) / 180 * H))
+        img[y] += (255 - img[y]) * GRATICULE_ALPHA
+
+    ids = index.rasterize(W, H)
+    palette = np.array([_land_color(f.get("properties") or {}) for f in features] or [(0, 0, 0)], dtype=np.float64)
+    land = ids >= 0
+    img[land] = palette[ids[land]]
+    edge = _edges(ids)
+    img[edge] += (np.array(_rgb(BORDER), dtype=np.float64) - img[edge]) * BORDER_ALPHA
+
+    img = img.reshape(height, SUPERSAMPLE, width, SUPERSAMPLE, 3).mean(axis=(1, 3))
+    return np.clip(np.rint(img), 0, 255).astype(np.uint8)
+
+def render_ids(fids: np.ndarray) -> np.ndarray:
+    """RGB-encoded id = fid + 1 (R = low byte), 0 = ocean, from CountryIndex.rasterize()."""
+    ids = (fids.astype(np.int64) + 1).astype(np.uint32)
+    return np.stack([ids & 255, (ids >> 8) & 255, (ids >> 16) & 255], axis=-1).astype(np.uint8)
+
+def _bboxes(fids: np.ndarray, n: int) -> List[Optional[List[int]]]:
+    # 每國在 ID 圖上的像素範圍 [x0, y0, x1, y1]（含），前端高亮只掃這塊
+    out: List[Optional[List[int]]] = [None] * n
+    ys, xs = np.nonzero(fids >= 0)
+    f = fids[ys, xs]
+    if f.size == 0:
+        return out
+    x0 = np.full(n, np.iinfo(np.int64).max)
+    y0 = x0.copy()
+    x1 = np.full(n, -1)
+    y1 = x1.copy()
+    np.minimum.at(x0, f, xs)
+    np.minimum.at(y0, f, ys)
+    np.maximum.at(x1, f, xs)
+    np.maximum.at(y1, f, ys)
+    for i in range(n):
+        if x1[i] >= 0:
+            out[i] = [int(x0[i]), int(y0[i]), int(x1[i]), int(y1[i])]
+    return out
+
+def bake_globe(geojson: Path, out_dir: Path = GLOBE_BAKE_DIR, *, width: int = GLOBE_TEX_W,
+               force: bool = False) -> Dict[str, Any]:
+    """
+    Bake (or reuse) base.<key>.png, ids.<key>.png and globe.<key>.json in
+    `out_dir`, where key hashes the GeoJSON bytes, size and BAKE_VERSION.
+    The JSON manifest holds width/height, the file names and the id table:
+    countries[id - 1] = [name, iso3, bbox].
+    """
+    data = Path(geojson).read_bytes()
+    height = width // 2
+    key = hashlib.sha1(data + f"|{width}x{height}|v{BAKE_VERSION}".encode()).hexdigest()[:12]
+    out_dir = Path(out_dir)
+    mf_path = out_dir / f"globe.{key}.json"
+    if not force and mf_path.exists():
+        try:
+            mf = json.loads(mf_path.read_text(encoding="utf-8"))
+            if all((out_dir / mf[k]).exists() for k in ("base", "ids")):
+                return mf
+        except (OSError, ValueError, KeyError):
+            pass
+
+    t0 = time.perf_counter()
+    geo = json.loads(data)
+    features = _features(geo)
+    index = CountryIndex(features)
+    fids = index.rasterize(width, height)
+    ids_png = encode_png(render_ids(fids))
+    base_png = encode_png(render_base(index, features, width, height))
+    countries = [[c["country"] or "Unknown", c["country_iso3"], bb]
+                 for c, bb in zip(index.countries, _bboxes(fids, len(features)))]
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    mf = {"key": key, "width": width, "height": height, "base": f"base.{key}.png", "ids": f"ids.{key}.png",
+          "encoding": "rgb24-le", "countries": countries}
+    (out_dir / mf["ids"]).write_bytes(ids_png)
+    (out_dir / mf["base"]).write_bytes(base_png)
+    tmp = mf_path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(mf, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    tmp.replace(mf_path)   # manifest 最後寫：看得到它就代表兩張圖都好了
+    for old in out_dir.iterdir():
+        if old.name.split(".")[0] in ("base", "ids", "globe") and key not in old.name:
+            old.unlink(missing_ok=True)
+    print(f"[globe] Baked {width}×{height} base ({len(base_png) / 1e3:.0f} KB) + ids ({len(ids_png) / 1e3:.0f} KB) "
+          f"for {len(countries)} countries in {time.perf_counter() - t0:.1f}s")
+    return mf
+
+# ---------- CLI ----------
+# python -m backend.utils.globe_bake [--force]
+if __name__ == "__main__":
+    import sys
+    bake_globe(PROJECT_ROOT / "frontend" / "assets" / "countries.geojson", force="--force" in sys.argv)
@@ -0,0 +1,295 @@
+# backend/utils/http.py — one shared HTTP connection pool for every upstream call
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+import os, socket, time, asyncio, importlib.util
+
+import httpx
+import httpcore
+
+# ===================== Config =====================
+APP_UA = "time-globe/0.7"
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "8"))                   # 預設單請求超時（秒）
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))    # 未列在下面的主機共用
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_DNS_TTL = float(os.getenv("HTTP_DNS_TTL", "300"))                 # 0 = 不快取 DNS
+HTTP_HTTP2 = os.getenv("HTTP_HTTP2", "1") != "0"
+# 每個上游主機自己的連線上限（host pattern=max），也是對上游的禮貌上限
+HTTP_HOST_LIMITS = os.getenv(
+    "HTTP_HOST_LIMITS",
+    "*.wikipedia.org=16,www.wikidata.org=8,api.bigdatacloud.net=8,"
+    "nominatim.openstreetmap.org=2,geocoding-api.open-meteo.com=4,www.worldhistory.org=4",
+)
+
+_HAS_H2 = importlib.util.find_spec("h2") is not None   # httpx 的 HTTP/2 需要 h2
+
+def _proxy() -> Optional[str]:
+    return os.getenv("PROXY_URL") or os.getenv("HTTPS_PROXY") or os.getenv("HTTP_PROXY") or None
+
+def _host_limits() -> List[Tuple[str, int]]:
+    out = []
+    for part in HTTP_HOST_LIMITS.split(","):
+        host, _, n = part.strip().partition("=")
+        if host and n.strip().isdigit():
+            out.append((host.strip(), int(n)))
+    return out
+
+# ===================== DNS cache =====================
+class _DNSCache:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._data: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        self.hits = self.misses = 0
+
+    def get(self, host: str, port: int) -> Optional[List[str]]:
+        item = self._data.get((host, port))
+        if item and item[0] > time.monotonic():
+            self.hits += 1
+            return item[1]
+        self.misses += 1
+        return None
+
+    def put(self, host: str, port: int, infos) -> List[str]:
+        addrs = list(dict.fromkeys(info[4][0] for info in infos))
+        self._data[(host, port)] = (time.monotonic() + self.ttl, addrs)
+        return addrs
+
+    def drop(self, host: str, port: int) -> None:
+        self._data.pop((host, port), None)
+
+_dns = _DNSCache(HTTP_DNS_TTL)
+
+def _is_ip(host: str) -> bool:
+    try:
+        socket.inet_pton(socket.AF_INET6 if ":" in host else socket.AF_INET, host)
+        return True
+    except OSError:
+        return False
+
+class _CachedDNSBackend(httpcore.AsyncNetworkBackend):
+    """
+    Resolves through _dns, then connects to the IP. TLS still uses the
+    original hostname (httpcore passes it to start_tls separately).
+    `timeout` caps resolve + every address tried, not each attempt.
+    """
+
+    def __init__(self, inner: httpcore.AsyncNetworkBackend):
+        self.inner = inner
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        if HTTP_DNS_TTL <= 0 or _is_ip(host):
+            return await self.inner.connect_tcp(host, port, timeout, local_address, socket_options)
+        try:
+            async with asyncio.timeout(timeout):   # 好幾個位址都卡住時，總共也只等 timeout
+                return await self._connect(host, port, timeout, local_address, socket_options)
+        except TimeoutError:
+            _dns.drop(host, port)
+            raise httpcore.ConnectTimeout(f"connect to {host}:{port} timed out") from None
+
+    async def _connect(self, host, port, timeout, local_address, socket_options):
+        addrs = _dns.get(host, port)
+        if addrs is None:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            addrs = _dns.put(host, port, infos)
+        err: Optional[Exception] = None
+        for ip in addrs:
+            try:
+                return await self.inner.connect_tcp(ip, port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                err = e
+        _dns.drop(host, port)   # 全部連不上：下次重新解析
+        raise err or httpcore.ConnectError(f"no address for {host}")
+
+    async def connect_unix_socket(self, *a, **kw):
+        return await self.inner.connect_unix_socket(*a, **kw)
+
+    async def sleep(self, seconds: float) -> None:
+        await self.inner.sleep(seconds)
+
+class _CachedDNSSyncBackend(httpcore.NetworkBackend):
+    def __init__(self, inner: httpcore.NetworkBackend):
+        self.inner = inner
+
+    def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        if HTTP_DNS_TTL <= 0 or _is_ip(host):
+            return self.inner.connect_tcp(host, port, timeout, local_address, socket_options)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        addrs = _dns.get(host, port)
+        if addrs is None:
+            addrs = _dns.put(host, port, socket.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+        err: Optional[Exception] = None
+        for ip in addrs:
+            # 同 async 版：每個位址只拿剩下的時間
+            left = None if deadline is None else deadline - time.monotonic()
+            if left is not None and left <= 0:
+                err = httpcore.ConnectTimeout(f"connect to {host}:{port} timed out")
+                break
+            try:
+                return self.inner.connect_tcp(ip, port, left, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                err = e
+        _dns.drop(host, port)
+        raise err or httpcore.ConnectError(f"no address for {host}")
+
+    def connect_unix_socket(self, *a, **kw):
+        return self.inner.connect_unix_socket(*a, **kw)
+
+    def sleep(self, seconds: float) -> None:
+        self.inner.sleep(seconds)
+
+# ===================== Transports =====================
+# httpx 沒有公開 network_backend 參數：自己用 httpcore 連線池（公開 API）接上 DNS 快取，
+# 這裡只做 httpx.Request/Response 與例外的轉換。這段照著 httpx 0.27 的 HTTPTransport 寫，
+# 而且 create_ssl_context(http2=...) 在 0.28 拿掉了，所以 requirements.txt 鎖在 httpx<0.28；
+# 升級時要一起改這裡
+_HTTPCORE_ERRORS = [   # 子類別在前
+    (httpcore.ConnectTimeout, httpx.ConnectTimeout), (httpcore.ReadTimeout, httpx.ReadTimeout),
+    (httpcore.WriteTimeout, httpx.WriteTimeout), (httpcore.PoolTimeout, httpx.PoolTimeout),
+    (httpcore.TimeoutException, httpx.TimeoutException),
+    (httpcore.ConnectError, httpx.ConnectError), (httpcore.ReadError, httpx.ReadError),
+    (httpcore.WriteError, httpx.WriteError), (httpcore.NetworkError, httpx.NetworkError),
+    (httpcore.ProxyError, httpx.ProxyError), (httpcore.UnsupportedProtocol, httpx.UnsupportedProtocol),
+    (httpcore.RemoteProtocolError, httpx.RemoteProtocolError),
+    (httpcore.LocalProtocolError, httpx.LocalProtocolError), (httpcore.ProtocolError, httpx.ProtocolError),
+]
+
+@contextmanager
+def _mapped_errors():
+    try:
+        yield
+    except Exception as e:
+        for src, dst in _HTTPCORE_ERRORS:
+            if isinstance(e, src):
+                raise dst(str(e)) from e
+        raise
+
+def _core_request(request: httpx.Request) -> httpcore.Request:
+    return httpcore.Request(
+        method=request.method,
+        url=httpcore.URL(scheme=request.url.raw_scheme, host=request.url.raw_host,
+                         port=request.url.port, target=request.url.raw_path),
+        headers=request.headers.raw,
+        content=request.stream,
+        extensions=request.extensions,
+    )
+
+class _AsyncResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def __aiter__(self):
+        with _mapped_errors():
+            async for part in self._stream:
+                yield part
+
+    async def aclose(self) -> None:
+        if hasattr(self._stream, "aclose"):
+            await self._stream.aclose()
+
+class _ResponseStream(httpx.SyncByteStream):
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __iter__(self):
+        with _mapped_errors():
+            for part in self._stream:
+                yield part
+
+    def close(self) -> None:
+        if hasattr(self._stream, "close"):
+            self._stream.close()
+
+class _AsyncPoolTransport(httpx.AsyncBaseTransport):
+    """httpx transport over an httpcore.AsyncConnectionPool we build ourselves."""
+
+    def __init__(self, pool: httpcore.AsyncConnectionPool):
+        self.pool = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        with _mapped_errors():
+            resp = await self.pool.handle_async_request(_core_request(request))
+        return httpx.Response(status_code=resp.status, headers=resp.headers,
+                              stream=_AsyncResponseStream(resp.stream), extensions=resp.extensions)
+
+    async def aclose(self) -> None:
+        await self.pool.aclose()
+
+class _PoolTransport(httpx.BaseTransport):
+    def __init__(self, pool: httpcore.ConnectionPool):
+        self.pool = pool
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        with _mapped_errors():
+            resp = self.pool.handle_request(_core_request(request))
+        return httpx.Response(status_code=resp.status, headers=resp.headers,
+                              stream=_ResponseStream(resp.stream), extensions=resp.extensions)
+
+    def close(self) -> None:
+        self.pool.close()
+
+# ===================== Clients =====================
+def _transport(sync: bool, max_conn: int):
+    http2 = HTTP_HTTP2 and _HAS_H2
+    if _proxy():
+        # 走 proxy 時 DNS 由 proxy 解析，直接用 httpx 內建的 transport
+        cls = httpx.HTTPTransport if sync else httpx.AsyncHTTPTransport
+        return cls(http2=http2, proxy=_proxy(), retries=1,
+                   limits=httpx.Limits(max_connections=max_conn, max_keepalive_connections=max_conn,
+                                       keepalive_expiry=HTTP_KEEPALIVE_EXPIRY))
+    kw = dict(
+        ssl_context=httpx.create_ssl_context(http2=http2),
+        max_connections=max_conn, max_keepalive_connections=max_conn,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        http1=True, http2=http2,
+        retries=1,   # 只重試「連不上」，不重送請求
+    )
+    if sync:
+        return _PoolTransport(httpcore.ConnectionPool(
+            network_backend=_CachedDNSSyncBackend(httpcore.SyncBackend()), **kw))
+    return _AsyncPoolTransport(httpcore.AsyncConnectionPool(
+        network_backend=_CachedDNSBackend(httpcore.AnyIOBackend()), **kw))
+
+def _client_kw(sync: bool) -> Dict[str, Any]:
+    return {
+        "headers": {"User-Agent": APP_UA},
+        "timeout": httpx.Timeout(HTTP_TIMEOUT),
+        "follow_redirects": True,
+        "transport": _transport(sync, HTTP_MAX_CONNECTIONS),
+        "mounts": {f"all://{host}": _transport(sync, n) for host, n in _host_limits()},
+    }
+
+_client: httpx.AsyncClient | None = None
+_sync_client: httpx.Client | None = None
+
+async def get_client() -> httpx.AsyncClient:
+    """Process-wide AsyncClient; pass per-service headers/timeouts per request."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(**_client_kw(sync=False))
+    return _client
+
+def get_sync_client() -> httpx.Client:
+    """Blocking twin for code that runs outside the event loop (startup asset download)."""
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = httpx.Client(**_client_kw(sync=True))
+    return _sync_client
+
+async def aclose_clients() -> None:
+    """Shutdown hook: close pooled connections cleanly."""
+    global _client, _sync_client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
+
+def http_stats() -> Dict[str, Any]:
+    return {
+        "http2": HTTP_HTTP2 and _HAS_H2,
+        "proxy": bool(_proxy()),
+        "host_limits": dict(_host_limits()),
+        "dns_cache": {"ttl": HTTP_DNS_TTL, "entries": len(_dns._data), "hits": _dns.hits, "misses": _dns.misses},
+        "clients": {"async": _client is not None, "sync": _sync_client is not None},
+    }
@@ -0,0 +1,550 @@
+# backend/utils/llm.py — LLM providers behind one router: warm clients, hedging and failover
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import suppress
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import os, time, asyncio
+
+from openai import AsyncOpenAI
+import google.generativeai as genai
+
+from .admission import AdmissionGate, QueueFull
+from .breaker import ProviderRegistry, _percentile
+
+# ===================== Config =====================
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.9"))   # 主要模型慢過自己的 p90 就加開備援
+LLM_HEDGE_MIN = float(os.getenv("LLM_HEDGE_MIN", "2"))               # hedge 門檻上下限（秒）
+LLM_HEDGE_MAX = float(os.getenv("LLM_HEDGE_MAX", "60"))
+LLM_MAX_PARALLEL = int(os.getenv("LLM_MAX_PARALLEL", "2"))           # 同一請求最多同時跑幾家
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "60"))
+LLM_MIN_SAMPLES = 5   # 樣本不足時用 profile 給的預設門檻
+
+class LLMRequest:
+    """Vendor-neutral prompt; each provider maps it onto its own API."""
+    __slots__ = ("instructions", "prompt", "web", "temperature", "verbosity")
+
+    def __init__(self, prompt: str, *, instructions: str = "", web: bool = False,
+                 temperature: Optional[float] = None, verbosity: Optional[str] = None):
+        self.prompt = prompt
+        self.instructions = instructions
+        self.web = web                    # 需要上網搜尋（只有支援的 provider 會真的搜）
+        self.temperature = temperature
+        self.verbosity = verbosity
+
+class LLMError(RuntimeError):
+    """Every provider of a profile failed; the message lists each error."""
+
+# ===================== Providers =====================
+class LLMProvider(ABC):
+    """
+    One model on one vendor. Clients are built once and reused, so calls
+    ride on already-open connections. `gate` is the vendor's AdmissionGate.
+    Subclasses must implement complete() and stream().
+    """
+    vendor = ""
+    web = False   # 能不能自己上網搜尋
+
+    def __init__(self, model: str, gate: AdmissionGate):
+        self.model = model
+        self.gate = gate
+        self.name = f"{self.vendor}:{model}"
+
+    @abstractmethod
+    async def complete(self, req: LLMRequest) -> str:
+        """Whole answer as one string."""
+
+    @abstractmethod
+    def stream(self, req: LLMRequest) -> AsyncIterator[str]:
+        """Answer text piece by piece; closing the iterator drops the upstream call."""
+
+    async def warm(self) -> None:
+        """Open the connection ahead of the first real call (cheap metadata request)."""
+
+def gemini_text(resp) -> str:
+    """
+    Safely extract plain text from a Gemini response, even if Parts are present.
+    """
+    # 1) Aggregated .text from SDK
+    try:
+        t = getattr(resp, "text", None)
+        if t:
+            return t
+    except Exception:
+        pass
+    # 2) Fallback: manually join candidates' parts
+    try:
+        texts = []
+        for cand in getattr(resp, "candidates", []) or []:
+            content = getattr(cand, "content", None)
+            parts = getattr(content, "parts", None) if content else None
+            if parts:
+                for p in parts:
+                    pt = getattr(p, "text", None)
+                    if pt:
+                        texts.append(pt)
+        return "\n".join(texts).strip()
+    except Exception:
+        return ""
+
+class GeminiProvider(LLMProvider):
+    vendor = "gemini"
+
+    def __init__(self, model: str, gate: AdmissionGate, api_key: Optional[str]):
+        super().__init__(model, gate)
+        self.api_key = api_key
+        if api_key:
+            genai.configure(api_key=api_key)   # 全域設定：只在建立時做一次
+        self._model = genai.GenerativeModel(model_name=model)
+
+    def _check(self) -> None:
+        if not self.api_key:
+            raise RuntimeError(
+                "Missing GEMINI_TOKEN in environment. "
+                "Create one in Google AI Studio and set it in your .env."
+            )
+
+    @staticmethod
+    def _contents(req: LLMRequest) -> str:
+        # GenerativeModel 的 system_instruction 綁在物件上；為了共用同一個物件，直接接在 prompt 前面
+        return f"{req.instructions}\n\n{req.prompt}" if req.instructions else req.prompt
+
+    @staticmethod
+    def _config(req: LLMRequest) -> Dict[str, Any]:
+        return {"temperature": float(req.temperature)} if req.temperature is not None else {}
+
+    async def complete(self, req: LLMRequest) -> str:
+        self._check()
+        try:
+            resp = await self._model.generate_content_async(self._contents(req), generation_config=self._config(req))
+        except Exception as e:
+            # Some SDK versions are incompatible with generation_config; retry without it.
+            if "GenerationConfig" in str(e) or "generation_config" in str(e):
+                resp = await self._model.generate_content_async(self._contents(req))
+            else:
+                raise
+        return gemini_text(resp) or ""
+
+    async def stream(self, req: LLMRequest) -> AsyncIterator[str]:
+        # closing the generator cancels the underlying streaming call
+        self._check()
+        resp = await self._model.generate_content_async(
+            self._contents(req), generation_config=self._config(req), stream=True)
+        try:
+            async for chunk in resp:
+                t = gemini_text(chunk)
+                if t:
+                    yield t
+        finally:
+            await self._close_stream(resp)
+
+    @staticmethod
+    async def _close_stream(resp) -> None:
+        # SDK 沒有公開的 close：取消底層的串流呼叫（gRPC call 有 cancel()；REST 的是 async generator）
+        it = getattr(resp, "_iterator", None)
+        if hasattr(it, "cancel"):
+            it.cancel()
+        elif hasattr(it, "aclose"):
+            with suppress(Exception):
+                await it.aclose()
+
+    async def warm(self) -> None:
+        if self.api_key:
+            await self._model.count_tokens_async("ping")
+
+class OpenAIProvider(LLMProvider):
+    """Responses API; `web` requests get the web_search_preview tool."""
+    vendor = "openai"
+    web = True
+    WEB_TOOLS = [{"type": "web_search_preview"}]
+
+    def __init__(self, model: str, gate: AdmissionGate, client: AsyncOpenAI):
+        super().__init__(model, gate)
+        self.client = client
+
+    def request(self, req: LLMRequest) -> dict:
+        messages = []
+        if req.instructions:
+            messages.append({"role": "developer", "content": [{"type": "input_text", "text": req.instructions}]})
+        messages.append({"role": "user", "content": [{"type": "input_text", "text": req.prompt}]})
+        text: Dict[str, Any] = {"format": {"type": "text"}}
+        if req.verbosity:
+            text["verbosity"] = req.verbosity
+        out = dict(model=self.model, input=messages, text=text, store=True)
+        # reasoning removed for speed；gpt-5 不接受 temperature，這裡不送
+        if req.web:
+            out["tools"] = self.WEB_TOOLS
+            out["include"] = ["web_search_call.action.sources"]  # keep citations metadata on the server
+        return out
+
+    async def complete(self, req: LLMRequest) -> str:
+        resp = await self.client.responses.create(**self.request(req))
+        # Extract assistant text from Responses API output
+        output_texts = []
+        for item in resp.output:
+            if getattr(item, "type", None) == "message":
+                for c in getattr(item, "content", []) or []:
+                    if getattr(c, "type", None) == "output_text":
+                        output_texts.append(getattr(c, "text", "") or "")
+        return "\n".join(t for t in output_texts if t).strip()
+
+    async def stream(self, req: LLMRequest) -> AsyncIterator[str]:
+        # closing the generator drops the HTTP stream
+        stream = await self.client.responses.create(**self.request(req), stream=True)
+        try:
+            async for event in stream:
+                t = getattr(event, "type", None)
+                if t == "response.output_text.delta" and event.delta:
+                    yield event.delta
+                elif t in ("response.failed", "error"):
+                    err = getattr(event, "message", None) or getattr(getattr(event, "response", None), "error", None)
+                    raise RuntimeError(str(err or "stream failed"))
+        finally:
+            await stream.close()
+
+    async def warm(self) -> None:
+        await self.client.models.retrieve(self.model)
+
+# ===================== Routing =====================
+class _Attempt:
+    # 一家 provider 在一個請求裡的一次嘗試
+    __slots__ = ("p", "started", "t0", "it", "first", "done")
+
+    def __init__(self, p: LLMProvider, started: float):
+        self.p = p
+        self.started = started
+        self.t0 = time.perf_counter()
+        self.it: Optional[AsyncIterator[str]] = None
+        self.first: Optional[asyncio.Task] = None
+        self.done = False
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+class RoutingProfile:
+    """
+    One kind of request (e.g. "overview") served by an ordered list of
+    providers. The first provider whose circuit is closed is the primary.
+    If it has not answered after its own p90 latency (time to first token
+    when streaming), one more provider is started as a hedge; the first good
+    answer wins and the rest are cancelled. A provider that errors, returns
+    nothing or whose queue is full is replaced by the next one (failover).
+    Health is tracked per profile because the same model is much slower
+    with web search than without.
+    """
+
+    def __init__(self, name: str, providers: List[LLMProvider], *,
+                 hedge_after: float, hedge_ttft: float, max_parallel: int = LLM_MAX_PARALLEL):
+        if not providers:
+            raise ValueError(f"profile {name!r} has no providers")
+        self.name = name
+        self.providers = providers
+        self.hedge_after = float(hedge_after)   # 樣本不足時的預設門檻（整段回答）
+        self.hedge_ttft = float(hedge_ttft)     # 同上（串流的第一個 token）
+        self.max_parallel = max(1, int(max_parallel))
+        self.registry = ProviderRegistry([p.name for p in providers],
+                                         failure_threshold=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN,
+                                         min_samples=LLM_MIN_SAMPLES)
+        self._ttft: Dict[str, deque] = {p.name: deque(maxlen=100) for p in providers}
+        self.counters = {"requests": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0, "failed": 0}
+
+    @property
+    def primary(self) -> LLMProvider:
+        return self.providers[0]
+
+    def hedge_delay(self, p: LLMProvider, *, stream: bool = False) -> float:
+        if stream:
+            vals, default = sorted(self._ttft[p.name]), self.hedge_ttft
+        else:
+            vals, default = sorted(self.registry[p.name]._lat), self.hedge_after
+        q = _percentile(vals, LLM_HEDGE_QUANTILE) if len(vals) >= LLM_MIN_SAMPLES else None
+        return min(LLM_HEDGE_MAX, max(LLM_HEDGE_MIN, q if q is not None else default))
+
+    async def _admit(self, p: LLMProvider, *, wait: bool) -> Optional[_Attempt]:
+        """Breaker + admission gate; None when skipped, QueueFull when the queue is full."""
+        health = self.registry[p.name]
+        if not health.allow():
+            return None
+        try:
+            started = await p.gate.acquire() if wait else await p.gate.try_acquire()
+        except BaseException:
+            health.skip()   # 沒真的呼叫：只清掉半開探測旗標，不算一次取消
+            raise
+        if started is None:
+            health.skip()
+            return None
+        return _Attempt(p, started)
+
+    def _served(self, a: _Attempt, req: LLMRequest, launched: int, hedged: bool) -> Dict[str, Any]:
+        return {
+            "profile": self.name,
+            "provider": a.p.name,
+            "vendor": a.p.vendor,
+            "model": a.p.model,
+            "web": bool(req.web and a.p.web),
+            "fallback": a.p is not self.primary,
+            "hedged": hedged,
+            "attempts": launched,
+            "ms": round(a.elapsed() * 1000),
+        }
+
+    def _finish(self, a: _Attempt, ok: Optional[bool], error: Optional[str] = None) -> None:
+        # 每個 attempt 只結算一次：放回 gate 名額 + 記健康（ok=None 表示被取消）
+        if a.done:
+            return
+        a.done = True
+        a.p.gate.release(a.started)
+        health = self.registry[a.p.name]
+        if ok is None:
+            health.release(a.elapsed())
+        else:
+            health.record(ok, a.elapsed(), error=error)
+        if error:
+            print(f"[llm] {self.name} {a.p.name}: {error}")
+
+    # ---------- whole answer ----------
+    async def _run(self, a: _Attempt, req: LLMRequest) -> str:
+        try:
+            text = await a.p.complete(req)
+        except asyncio.CancelledError:
+            self._finish(a, None)
+            raise
+        except Exception as e:
+            self._finish(a, False, f"{type(e).__name__}: {e}")
+            raise
+        if not text.strip():
+            self._finish(a, False, "empty response")
+            raise LLMError(f"{a.p.name}: empty response")
+        self._finish(a, True)
+        return text
+
+    async def complete(self, req: LLMRequest) -> Tuple[str, Dict[str, Any]]:
+        """(text, served) where `served` names the provider that answered."""
+        self.counters["requests"] += 1
+        loop = asyncio.get_running_loop()
+        queue = list(self.providers)
+        running: Dict[asyncio.Task, _Attempt] = {}
+        errors: List[str] = []
+        busy: Optional[QueueFull] = None
+        hedge_at: Optional[float] = None
+        launched, hedged = 0, False
+        try:
+            while True:
+                can_hedge = bool(queue) and hedge_at is not None and len(running) < self.max_parallel
+                if queue and (not running or (can_hedge and loop.time() >= hedge_at)):
+                    hedge = bool(running)
+                    p = queue.pop(0)
+                    try:
+                        a = await self._admit(p, wait=not hedge)   # hedge 不排隊：沒空位就算了
+                    except QueueFull as e:
+                        busy = e
+                        continue
+                    if a is None:
+                        if hedge and not p.gate.has_slot():
+                            queue.insert(0, p)   # 只是沒空位：留給 failover
+                            hedge_at = None
+                        continue
+                    launched += 1
+                    if hedge:
+                        hedged = True
+                        self.counters["hedged"] += 1
+                    elif errors or busy:
+                        self.counters["failovers"] += 1
+                    running[asyncio.create_task(self._run(a, req))] = a
+                    hedge_at = loop.time() + self.hedge_delay(p)
+                    continue
+                if not running:
+                    break
+                can_hedge = bool(queue) and hedge_at is not None and len(running) < self.max_parallel
+                timeout = max(0.0, hedge_at - loop.time()) if can_hedge else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    a = running.pop(t)
+                    try:
+                        text = t.result()
+                    except Exception as e:
+                        errors.append(f"{a.p.name}: {e}")
+                        continue
+                    if hedged and a.p is not self.primary:
+                        self.counters["hedge_wins"] += 1
+                    return text, self._served(a, req, launched, hedged)
+        finally:
+            for t in running:
+                t.cancel()
+        self.counters["failed"] += 1
+        if errors:
+            raise LLMError("; ".join(errors))
+        if busy is not None:
+            raise busy
+        raise LLMError(f"{self.name}: no provider available (all circuits open)")
+
+    # ---------- streaming ----------
+    async def open_stream(self, req: LLMRequest) -> "LLMStream":
+        """
+        Admits the first available provider before any response is sent, so
+        a full queue still becomes a 429; the race itself runs while iterating.
+        """
+        self.counters["requests"] += 1
+        queue = list(self.providers)
+        busy: Optional[QueueFull] = None
+        while queue:
+            p = queue.pop(0)
+            try:
+                a = await self._admit(p, wait=True)
+            except QueueFull as e:
+                busy = e
+                continue
+            if a is not None:
+                if busy is not None:
+                    self.counters["failovers"] += 1
+                return LLMStream(self, req, a, queue)
+        self.counters["failed"] += 1
+        if busy is not None:
+            raise busy
+        raise LLMError(f"{self.name}: no provider available (all circuits open)")
+
+    def stats(self) -> Dict[str, Any]:
+        ms = lambda v: round(v * 1000) if v is not None else None
+        snap = self.registry.snapshot()
+        for row in snap["providers"]:
+            ttft = sorted(self._ttft[row["name"]])
+            row["ttft_ms"] = {"p50": ms(_percentile(ttft, 0.5)), "p90": ms(_percentile(ttft, 0.9))}
+        return {
+            "route": [p.name for p in self.providers],
+            "hedge_after_ms": {p.name: ms(self.hedge_delay(p)) for p in self.providers},
+            "hedge_ttft_ms": {p.name: ms(self.hedge_delay(p, stream=True)) for p in self.providers},
+            **self.counters,
+            "providers": snap["providers"],
+        }
+
+class LLMStream:
+    """
+    Text pieces from whichever provider produces a first token first.
+    `served` is set just before the first piece is yielded. aclose() is
+    idempotent and safe to call from a BackgroundTask after a disconnect.
+    """
+
+    def __init__(self, profile: RoutingProfile, req: LLMRequest, first: _Attempt, queue: List[LLMProvider]):
+        self.profile = profile
+        self.req = req
+        self.queue = queue
+        self.attempts: List[_Attempt] = []
+        self.launched = 0
+        self.hedged = False
+        self.served: Optional[Dict[str, Any]] = None
+        self._start(first)
+
+    def _start(self, a: _Attempt) -> None:
+        a.it = a.p.stream(self.req).__aiter__()
+        a.first = asyncio.ensure_future(a.it.__anext__())
+        self.attempts.append(a)
+        self.launched += 1
+
+    async def _drop(self, a: _Attempt, ok: Optional[bool], error: Optional[str] = None) -> None:
+        if a.first is not None and not a.first.done():
+            a.first.cancel()   # 取消等待第一個 token 的 task
+        if ok is None and not a.done and a in self.attempts and self.served is None:
+            self.profile._ttft[a.p.name].append(a.elapsed())   # 輸掉的：至少這麼慢
+        self.profile._finish(a, ok, error)
+        if a in self.attempts:
+            self.attempts.remove(a)
+        await self._close(a)
+
+    @staticmethod
+    async def _close(a: _Attempt) -> None:
+        # 先等第一個 token 的 task 收尾，再關 provider 的 generator（它的 finally 會關 HTTP 串流）；
+        # 贏家串流到一半斷線時也一樣，不留著等 GC
+        if a.first is not None:
+            await asyncio.wait({a.first})
+            a.first = None
+        it, a.it = a.it, None
+        if it is not None:
+            with suppress(Exception):
+                await it.aclose()
+
+    async def _next(self, *, wait: bool) -> Optional[_Attempt]:
+        while self.queue:
+            p = self.queue[0]
+            try:
+                a = await self.profile._admit(p, wait=wait)
+            except QueueFull:
+                self.queue.pop(0)
+                continue
+            if a is None and not wait and not p.gate.has_slot():
+                return None   # 只是沒空位：留給之後的 failover
+            self.queue.pop(0)
+            if a is not None:
+                return a
+        return None
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        prof, counters = self.profile, self.profile.counters
+        loop = asyncio.get_running_loop()
+        errors: List[str] = []
+        hedge_at = loop.time() + prof.hedge_delay(self.attempts[0].p, stream=True)
+        winner: Optional[_Attempt] = None
+        piece = ""
+        try:
+            while winner is None:
+                if not self.attempts:
+                    a = await self._next(wait=True)
+                    if a is None:
+                        counters["failed"] += 1
+                        raise LLMError("; ".join(errors) or f"{prof.name}: no provider available")
+                    counters["failovers"] += 1
+                    self._start(a)
+                    hedge_at = loop.time() + prof.hedge_delay(a.p, stream=True)
+                    continue
+                can_hedge = bool(self.queue) and hedge_at is not None and len(self.attempts) < prof.max_parallel
+                if can_hedge and loop.time() >= hedge_at:
+                    a = await self._next(wait=False)
+                    hedge_at = None
+                    if a is not None:
+                        self.hedged = True
+                        counters["hedged"] += 1
+                        self._start(a)
+                        hedge_at = loop.time() + prof.hedge_delay(a.p, stream=True)
+                    continue
+                pending = {a.first: a for a in self.attempts}
+                timeout = max(0.0, hedge_at - loop.time()) if can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    a = pending[t]
+                    try:
+                        piece = t.result()
+                    except StopAsyncIteration:
+                        errors.append(f"{a.p.name}: empty response")
+                        await self._drop(a, False, "empty response")
+                        continue
+                    except Exception as e:
+                        errors.append(f"{a.p.name}: {e}")
+                        await self._drop(a, False, f"{type(e).__name__}: {e}")
+                        continue
+                    winner = a
+                    break
+
+            prof._ttft[winner.p.name].append(winner.elapsed())
+            for a in list(self.attempts):
+                if a is not winner:
+                    await self._drop(a, None)
+            if self.hedged and winner.p is not prof.primary:
+                counters["hedge_wins"] += 1
+            self.served = prof._served(winner, self.req, self.launched, self.hedged)
+            yield piece
+            try:
+                async for piece in winner.it:
+                    yield piece
+            except Exception as e:
+                # 已經送出部分文字：不再換家，直接回報錯誤
+                await self._drop(winner, False, f"{type(e).__name__}: {e}")
+                raise
+            self.served["ms"] = round(winner.elapsed() * 1000)
+            await self._drop(winner, True)
+        finally:
+            for a in list(self.attempts):
+                await self._drop(a, None)
+
+    async def aclose(self) -> None:
+        for a in list(self.attempts):
+            await self._drop(a, None)
@@ -0,0 +1,195 @@
+# backend/utils/placeclass.py — offline Wikidata place-class index (QID → class flags)
+from __future__ import annotations
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import bz2, gzip, re, struct, sys
+
+import numpy as np
+
+# ---------- flags ----------
+SETTLEMENT = 1 << 0   # human settlement 及其子類（city/town/village/…）
+ADMIN      = 1 << 1   # administrative territorial entity（省/州/區/…）
+COUNTRY    = 1 << 2   # country / sovereign state
+PLACE      = 1 << 3   # 其他地理實體（島、河、山、區域…）
+BANNED     = 1 << 7   # 人物/作品/消歧義等：不是地點
+PLACE_MASK = SETTLEMENT | ADMIN | COUNTRY | PLACE
+
+# 各 flag 的根類別；建索引時沿 P279（subclass of）往下展開
+ROOTS: Dict[int, Set[str]] = {
+    SETTLEMENT: {"Q486972", "Q515", "Q5107", "Q1907114"},
+    ADMIN:      {"Q56061", "Q15642541", "Q82794"},
+    COUNTRY:    {"Q6256", "Q3624078"},
+    PLACE:      {"Q133442", "Q70208", "Q1799794", "Q618123", "Q2221906"},
+    BANNED:     {"Q5", "Q11424", "Q482994", "Q5398426", "Q571", "Q13442814",
+                 "Q202444", "Q101352", "Q4167410", "Q4167836"},
+}
+
+MAGIC = b"TGPCLS1\0"
+_HEADER = struct.Struct("<8sII")   # magic, header flags, count
+HDR_COMPLETE = 1                    # 由完整 dump 建成：查不到 = 不是地點
+
+_QID_RE = re.compile(r"^Q(\d+)$")
+
+def _qnum(qid: str) -> Optional[int]:
+    m = _QID_RE.match(qid or "")
+    return int(m.group(1)) if m else None
+
+class PlaceClassIndex:
+    """
+    Sorted uint32 QID numbers plus one flag byte each. Loaded from disk the
+    arrays are np.memmap views, so opening is O(1) and lookups are a
+    binary search. Entries cover both classes (flags include everything
+    they are a subclass of) and items (OR of their P31 classes' flags).
+    """
+
+    def __init__(self, qids: np.ndarray, flags: np.ndarray, *, complete: bool = False,
+                 path: Optional[Path] = None):
+        self.qids = qids
+        self.flags = flags
+        self.complete = complete
+        self.path = path
+
+    @classmethod
+    def builtin(cls) -> "PlaceClassIndex":
+        """Root classes only (no closure): the fallback when no index file exists."""
+        table: Dict[int, int] = defaultdict(int)
+        for flag, roots in ROOTS.items():
+            for q in roots:
+                table[_qnum(q)] |= flag
+        return cls.from_table(table)
+
+    @classmethod
+    def from_table(cls, table: Dict[int, int], *, complete: bool = False) -> "PlaceClassIndex":
+        keys = np.fromiter(sorted(table), dtype=np.uint32, count=len(table))
+        vals = np.fromiter((table[int(k)] for k in keys), dtype=np.uint8, count=len(table))
+        return cls(keys, vals, complete=complete)
+
+    @classmethod
+    def open(cls, path: Path) -> "PlaceClassIndex":
+        path = Path(path)
+        with open(path, "rb") as f:
+            magic, hdr, count = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"not a place-class index: {path}")
+        qids = np.memmap(path, dtype="<u4", mode="r", offset=_HEADER.size, shape=(count,))
+        flags = np.memmap(path, dtype=np.uint8, mode="r", offset=_HEADER.size + 4 * count, shape=(count,))
+        return cls(qids, flags, complete=bool(hdr & HDR_COMPLETE), path=path)
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, HDR_COMPLETE if self.complete else 0, len(self.qids)))
+            f.write(np.asarray(self.qids, dtype="<u4").tobytes())
+            f.write(np.asarray(self.flags, dtype=np.uint8).tobytes())
+        tmp.replace(path)
+
+    def __len__(self) -> int:
+        return len(self.qids)
+
+    def lookup(self, qid: str) -> Optional[int]:
+        """
+        Flags for `qid`. None means "unknown here" (the caller should fall
+        back to P31 + classify()); a complete index answers 0 instead.
+        """
+        n = _qnum(qid)
+        if n is not None:
+            i = int(np.searchsorted(self.qids, n))
+            if i < len(self.qids) and int(self.qids[i]) == n:
+                return int(self.flags[i])
+        return 0 if self.complete else None
+
+    def classify(self, p31: Iterable[str]) -> int:
+        """OR of the (closure) flags of an entity's P31 classes."""
+        out = 0
+        for q in p31:
+            out |= self.lookup(q) or 0
+        return out
+
+    def stats(self) -> Dict[str, object]:
+        return {"path": str(self.path) if self.path else None, "entries": len(self), "complete": self.complete}
+
+# ===================== Builder (offline, from a Wikidata dump extract) =====================
+_NT_RE = re.compile(
+    r"^<http://www\.wikidata\.org/entity/(Q\d+)>\s+"
+    r"<http://www\.wikidata\.org/prop/direct/(P31|P279)>\s+"
+    r"<http://www\.wikidata\.org/entity/(Q\d+)>"
+)
+
+def _open_text(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    if path.suffix == ".bz2":
+        return bz2.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "rt", encoding="utf-8", errors="replace")
+
+def iter_claims(path: Path, prop: str) -> Iterator[Tuple[int, int]]:
+    """
+    (subject, object) QID numbers for `prop` (P31/P279). Accepts the truthy
+    N-Triples dump (latest-truthy.nt.gz) or a pre-filtered TSV extract with
+    lines "Q1<TAB>P31<TAB>Q2".
+    """
+    with _open_text(path) as f:
+        for line in f:
+            if line.startswith("<"):
+                m = _NT_RE.match(line)
+                if not m or m.group(2) != prop:
+                    continue
+                s, o = m.group(1), m.group(3)
+            else:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) < 3 or parts[1] != prop:
+                    continue
+                s, o = parts[0], parts[2]
+            sn, on = _qnum(s), _qnum(o)
+            if sn is not None and on is not None:
+                yield sn, on
+
+def class_closure(edges: Iterable[Tuple[int, int]], roots: Dict[int, Set[str]] = ROOTS) -> Dict[int, int]:
+    """Flags for every class that is (transitively) a subclass of a root."""
+    children: Dict[int, List[int]] = defaultdict(list)
+    for sub, sup in edges:
+        children[sup].append(sub)
+    flags: Dict[int, int] = defaultdict(int)
+    for flag, qs in roots.items():
+        todo = deque(n for n in map(_qnum, qs) if n is not None)
+        seen: Set[int] = set()
+        while todo:
+            c = todo.popleft()
+            if c in seen:
+                continue
+            seen.add(c)
+            flags[c] |= flag
+            todo.extend(children.get(c, ()))
+    return flags
+
+def build_index(dump: Path, *, items: bool = True) -> PlaceClassIndex:
+    """
+    Two streaming passes over the dump: P279 edges → class closure, then
+    P31 edges → item flags. Only non-zero entries are kept, so the result
+    is a few tens of MB even for the full dump.
+    """
+    dump = Path(dump)
+    table = class_closure(iter_claims(dump, "P279"))
+    print(f"[placeclass] {len(table)} flagged classes")
+    if items:
+        classes = dict(table)
+        n = 0
+        for item, cls in iter_claims(dump, "P31"):
+            f = classes.get(cls)
+            if f:
+                table[item] = table.get(item, 0) | f
+                n += 1
+        print(f"[placeclass] {n} flagged P31 claims → {len(table)} entries")
+    return PlaceClassIndex.from_table(table, complete=items)
+
+if __name__ == "__main__":
+    # python -m backend.utils.placeclass <dump.nt.gz|extract.tsv> <out.bin> [--classes-only]
+    if len(sys.argv) < 3:
+        print("usage: python -m backend.utils.placeclass <dump> <out> [--classes-only]")
+        sys.exit(2)
+    idx = build_index(Path(sys.argv[1]), items="--classes-only" not in sys.argv[3:])
+    idx.save(Path(sys.argv[2]))
+    print(f"[placeclass] Wrote {sys.argv[2]} ({len(idx)} entries, complete={idx.complete})")
@@ -0,0 +1,42 @@
+# backend/utils/ratelimit.py — async token bucket for politeness limits on upstream APIs
+from __future__ import annotations
+import asyncio, time
+
+class RateLimiter:
+    """
+    Token bucket: `rate` tokens per second, at most `burst` saved up.
+    acquire() waits until a token is available; waiters are served in
+    arrival order because the bucket is drained under a lock.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited = 0.0   # 累計等待秒數（觀察用）
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:   # 0 = 不限速
+            return
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1.0:
+                wait = (1.0 - self._tokens) / self.rate
+                self.waited += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self._tokens -= 1.0
+
+    async def __aenter__(self) -> "RateLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        return None
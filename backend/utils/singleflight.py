@@ -0,0 +1,198 @@
+# backend/utils/singleflight.py — coalesce concurrent identical async calls
+from __future__ import annotations
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, TypeVar
+import asyncio
+
+T = TypeVar("T")
+
+def _namespace(key: Hashable) -> str:
+    if isinstance(key, str) and "|" in key:
+        return key.split("|", 1)[0]
+    if isinstance(key, tuple) and key:
+        return str(key[0])
+    return "default"
+
+class _Call:
+    __slots__ = ("task", "waiters", "abandoned")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        self.abandoned = False
+
+class SingleFlight:
+    """
+    do(key, fn): the first caller for `key` runs fn() in a task; callers that
+    arrive while it is in flight await the same task instead of starting
+    their own. A cancelled caller only detaches; the shared task is
+    cancelled once its last waiter has gone, unless `cancel_abandoned` is
+    False (expensive calls whose result is cached anyway run to completion).
+    """
+
+    def __init__(self, *, cancel_abandoned: bool = True):
+        self.cancel_abandoned = cancel_abandoned
+        self._inflight: Dict[Hashable, _Call] = {}
+        self._ns: Dict[str, Dict[str, int]] = {}
+
+    def _c(self, key: Hashable) -> Dict[str, int]:
+        ns = _namespace(key)
+        c = self._ns.get(ns)
+        if c is None:
+            c = self._ns[ns] = {"calls": 0, "coalesced": 0, "abandoned": 0}
+        return c
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._inflight.get(key) is call:
+            del self._inflight[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._inflight.get(key)
+        if call is None or call.abandoned:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._inflight[key] = call
+            call.task.add_done_callback(lambda _t, k=key, c=call: self._forget(k, c))
+            self._c(key)["calls"] += 1
+        else:
+            self._c(key)["coalesced"] += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done() and self.cancel_abandoned:
+                # 所有等待者都離開了：上游請求也不必再跑
+                call.abandoned = True
+                self._forget(key, call)
+                call.task.cancel()
+                self._c(key)["abandoned"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        ns = {k: dict(v) for k, v in self._ns.items()}
+        return {
+            "inflight": len(self._inflight),
+            "calls": sum(v["calls"] for v in ns.values()),
+            "coalesced": sum(v["coalesced"] for v in ns.values()),
+            "abandoned": sum(v["abandoned"] for v in ns.values()),
+            "namespaces": ns,
+        }
+
+class _Feed:
+    __slots__ = ("events", "ready", "finished", "subscribers", "task", "changed")
+
+    def __init__(self):
+        self.events: List[Any] = []
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.finished = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.changed = asyncio.Event()
+
+    def push(self, event: Any) -> None:
+        self.events.append(event)
+        self._wake()
+
+    def mark_ready(self) -> None:
+        if not self.ready.done():
+            self.ready.set_result(None)
+
+    def _wake(self) -> None:
+        # 換一個新的 Event 再 set 舊的：醒來的訂閱者下一輪等的是新的
+        old, self.changed = self.changed, asyncio.Event()
+        old.set()
+
+class Subscription:
+    """One caller's view of a shared stream: replay what was emitted, then tail."""
+
+    def __init__(self, flight: "StreamFlight", key: Hashable, feed: _Feed):
+        self._flight = flight
+        self._key = key
+        self._feed = feed
+        self._left = False
+
+    async def ready(self) -> None:
+        """Wait until the producer is admitted; re-raises whatever stopped it before that."""
+        await asyncio.shield(self._feed.ready)
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        feed, i = self._feed, 0
+        while True:
+            changed = feed.changed
+            if i < len(feed.events):
+                i += 1
+                yield feed.events[i - 1]
+            elif feed.finished:
+                return
+            else:
+                await changed.wait()
+
+    def leave(self) -> None:
+        """Idempotent; the last subscriber leaving an unfinished stream cancels its producer."""
+        if self._left:
+            return
+        self._left = True
+        feed = self._feed
+        feed.subscribers -= 1
+        if feed.subscribers == 0 and not feed.finished:
+            self._flight._forget(self._key, feed)
+            feed.task.cancel()
+            self._flight._c(self._key)["abandoned"] += 1
+
+class StreamFlight:
+    """
+    Streaming twin of SingleFlight. join(key, produce) runs
+    produce(emit, ready) in a task for the first caller; every caller,
+    the first included, gets a Subscription that replays the events
+    emitted so far and then tails the live ones. The producer calls
+    ready() once it is admitted upstream (errors raised before that reach
+    every subscriber's ready()), and is cancelled when its last
+    subscriber leaves before it finished.
+    """
+
+    def __init__(self):
+        self._feeds: Dict[Hashable, _Feed] = {}
+        self._ns: Dict[str, Dict[str, int]] = {}
+
+    _c = SingleFlight._c
+
+    def _forget(self, key: Hashable, feed: _Feed) -> None:
+        if self._feeds.get(key) is feed:
+            del self._feeds[key]
+
+    def join(self, key: Hashable, produce: Callable[[Callable[[Any], None], Callable[[], None]], Awaitable[None]]
+             ) -> Subscription:
+        feed = self._feeds.get(key)
+        if feed is None:
+            feed = self._feeds[key] = _Feed()
+            feed.task = asyncio.ensure_future(self._run(key, feed, produce))
+            self._c(key)["calls"] += 1
+        else:
+            self._c(key)["coalesced"] += 1
+        feed.subscribers += 1
+        return Subscription(self, key, feed)
+
+    async def _run(self, key: Hashable, feed: _Feed, produce) -> None:
+        try:
+            await produce(feed.push, feed.mark_ready)
+        except asyncio.CancelledError:
+            feed.ready.cancel()   # 已經 ready 時是 no-op
+            raise
+        except Exception as e:
+            if not feed.ready.done():
+                feed.ready.set_exception(e)   # 由 ready() 交給訂閱者
+            else:
+                print(f"[stream-flight] {key}: {type(e).__name__}: {e}")
+        finally:
+            feed.mark_ready()
+            feed.finished = True
+            self._forget(key, feed)
+            feed._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        ns = {k: dict(v) for k, v in self._ns.items()}
+        return {
+            "inflight": len(self._feeds),
+            "calls": sum(v["calls"] for v in ns.values()),
+            "coalesced": sum(v["coalesced"] for v in ns.values()),
+            "abandoned": sum(v["abandoned"] for v in ns.values()),
+            "namespaces": ns,
+        }
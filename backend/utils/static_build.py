@@ -0,0 +1,288 @@
+# backend/utils/static_build.py — content-hashed, precompressed copies of frontend/ + a StaticFiles that serves them
+from __future__ import annotations
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+import os, re, gzip, json, time, shutil, hashlib, mimetypes
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+try:
+    import brotli
+    _HAS_BROTLI = True
+except ImportError:
+    _HAS_BROTLI = False
+
+try:
+    import fcntl   # POSIX：多個 worker 同時啟動時只讓一個 build
+except ImportError:
+    fcntl = None
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+STATIC_BUILD = os.getenv("STATIC_BUILD", "1") != "0"          # 0 = 直接送 frontend/（開發時改檔免重建）
+STATIC_BUILD_DIR = Path(os.getenv("STATIC_BUILD_DIR", str(PROJECT_ROOT / ".cache" / "static")))
+STATIC_BROTLI_QUALITY = int(os.getenv("STATIC_BROTLI_QUALITY", "11"))
+STATIC_BUILD_KEEP = max(2, int(os.getenv("STATIC_BUILD_KEEP", "3")))   # 保留幾份 build：還沒重啟的 worker 仍照舊 manifest 送檔
+STATIC_PREFIX = "/static/"
+ENTRY = "index.html"                      # 入口檔：改寫引用但不加 hash，也不能 immutable
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"                   # 可以快取，但每次用 ETag 問一下
+
+# 會被改寫引用的文字檔；值得壓縮的類型
+_REWRITE_EXT = {".html", ".js", ".mjs", ".css"}
+_COMPRESS_EXT = {".html", ".js", ".mjs", ".css", ".json", ".geojson", ".svg", ".txt", ".map"}
+_MIN_COMPRESS = 1024
+_REF_RE = re.compile(r"/static/([A-Za-z0-9_./-]+)")
+
+mimetypes.add_type("application/geo+json", ".geojson")
+mimetypes.add_type("text/javascript", ".js")
+mimetypes.add_type("text/javascript", ".mjs")
+
+# ===================== Build =====================
+def _sources(src: Path) -> Dict[str, Path]:
+    # rel path (posix) → 檔案；略過隱藏檔與已壓縮副本
+    out = {}
+    for p in sorted(src.rglob("*")):
+        rel = p.relative_to(src).as_posix()
+        if p.is_file() and not any(part.startswith(".") for part in rel.split("/")) \
+                and p.suffix not in (".br", ".gz"):
+            out[rel] = p
+    return out
+
+def _fingerprint(files: Dict[str, Path]) -> str:
+    h = hashlib.sha1()
+    for rel, p in files.items():
+        st = p.stat()
+        h.update(f"{rel}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    h.update(f"brotli={_HAS_BROTLI}:{STATIC_BROTLI_QUALITY}".encode())
+    return h.hexdigest()[:16]
+
+def _hashed_name(rel: str, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    stem, dot, ext = rel.rpartition(".")
+    if not dot or "/" in ext:
+        return f"{rel}.{digest}"
+    return f"{stem}.{digest}.{ext}"
+
+def _compress(path: Path, data: bytes) -> Dict[str, int]:
+    # 只留下真的變小的版本；gzip mtime=0 讓輸出可重現
+    sizes = {}
+    variants = [("gzip", ".gz", lambda d: gzip.compress(d, 9, mtime=0))]
+    if _HAS_BROTLI:
+        variants.insert(0, ("br", ".br", lambda d: brotli.compress(d, quality=STATIC_BROTLI_QUALITY)))
+    for enc, ext, fn in variants:
+        comp = fn(data)
+        if len(comp) < len(data) * 0.9:
+            Path(str(path) + ext).write_bytes(comp)
+            sizes[enc] = len(comp)
+    return sizes
+
+def _current(mf_path: Path, fp: str) -> Optional[Dict]:
+    try:
+        mf = json.loads(mf_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if mf.get("fingerprint") != fp or not mf.get("dir"):
+        return None     # 沒有 "dir" 的是舊版平鋪的 build，重建一次
+    return mf if (mf_path.parent / mf["dir"]).is_dir() else None
+
+@contextmanager
+def _build_lock(out: Path):
+    # 鎖檔放在 out 旁邊
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out.with_name(out.name + ".lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def build_static(src: Path, out: Path = STATIC_BUILD_DIR, *, force: bool = False) -> Dict:
+    """
+    Copy `src` into out/<fingerprint>/ under content-hashed names
+    (main.js → main.<sha256[:10]>.js), rewriting "/static/..." references
+    in html/js/css so every file points at its dependencies' hashed names,
+    and write .br/.gz siblings for text assets. ENTRY keeps its name.
+    Returns the manifest {dir, files: {rel: hashed_rel}, ...}; out/manifest.json
+    points at the current build and is swapped atomically. Older builds
+    stay on disk (the last STATIC_BUILD_KEEP) for workers still serving
+    them; an unchanged tree is not rebuilt. Builds run under an exclusive
+    file lock, so workers starting together build once.
+    """
+    src, out = Path(src), Path(out)
+    files = _sources(src)
+    fp = _fingerprint(files)
+    mf_path = out / "manifest.json"
+    mf = None if force else _current(mf_path, fp)
+    if mf is not None:
+        return mf
+    with _build_lock(out):
+        # 等鎖時別的 worker 可能已經建好了
+        mf = None if force else _current(mf_path, fp)
+        return mf if mf is not None else _build(out, files, fp)
+
+def _build(out: Path, files: Dict[str, Path], fp: str) -> Dict:
+    t0 = time.perf_counter()
+    # 每份 build 一個目錄；--force 重建同一份來源時不能蓋掉正在被送的那個
+    name = fp if not (out / fp).exists() else f"{fp}-{time.time_ns():x}"
+    dst_dir, tmp = out / name, out / (name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    mapping: Dict[str, str] = {}
+    sizes: Dict[str, Dict[str, int]] = {}
+    visiting: set = set()
+
+    def emit(rel: str) -> str:
+        # 先處理被引用的檔，引用者的內容（和 hash）才會包含它們的新名字
+        if rel in mapping:
+            return mapping[rel]
+        visiting.add(rel)
+        p = files[rel]
+        data = p.read_bytes()
+        if p.suffix in _REWRITE_EXT:
+            def sub(m: re.Match) -> str:
+                ref = m.group(1)
+                if ref in files and ref != ENTRY and ref not in visiting:
+                    return STATIC_PREFIX + emit(ref)
+                return m.group(0)
+            data = _REF_RE.sub(sub, data.decode("utf-8")).encode("utf-8")
+        hashed = rel if rel == ENTRY else _hashed_name(rel, data)
+        dst = tmp / hashed
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        dst.write_bytes(data)
+        sz = {"identity": len(data)}
+        if p.suffix in _COMPRESS_EXT and len(data) >= _MIN_COMPRESS:
+            sz.update(_compress(dst, data))
+        sizes[hashed] = sz
+        visiting.discard(rel)
+        mapping[rel] = hashed
+        return hashed
+
+    for rel in files:
+        emit(rel)
+    mf = {"fingerprint": fp, "dir": name, "built_at": time.time(), "brotli": _HAS_BROTLI,
+          "files": mapping, "sizes": sizes}
+    text = json.dumps(mf, ensure_ascii=False, indent=1)
+    (tmp / "manifest.json").write_text(text, encoding="utf-8")
+    tmp.rename(dst_dir)
+    # 換指標：manifest.json 用 rename 原子替換，讀的人不會看到寫一半的檔
+    ptr = out / "manifest.json.tmp"
+    ptr.write_text(text, encoding="utf-8")
+    os.replace(ptr, out / "manifest.json")
+    _prune(out, name)
+    raw = sum(s["identity"] for s in sizes.values())
+    best = sum(min(s.values()) for s in sizes.values())
+    print(f"[static] Built {len(mapping)} files into {dst_dir} in {time.perf_counter() - t0:.1f}s "
+          f"({raw / 1e6:.2f} MB → {best / 1e6:.2f} MB{'' if _HAS_BROTLI else ', gzip only'})")
+    return mf
+
+def _prune(out: Path, current: str) -> None:
+    # 只動有自己 manifest.json 的 build 目錄；保留 current 和最新的幾份舊 build
+    builds = []
+    for d in out.iterdir():
+        try:
+            if d.is_dir() and d.name != current:
+                builds.append(((d / "manifest.json").stat().st_mtime, d))
+        except OSError:
+            continue
+    builds.sort(reverse=True)
+    for _, d in builds[STATIC_BUILD_KEEP - 1:]:
+        shutil.rmtree(d, ignore_errors=True)
+
+# ===================== Serve =====================
+def _accepts(headers: Headers) -> set:
+    out = set()
+    for part in headers.get("accept-encoding", "").split(","):
+        enc, _, params = part.strip().partition(";")
+        if enc and params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            out.add(enc.lower())
+    return out
+
+class HashedStaticFiles(StaticFiles):
+    """
+    StaticFiles over `directory` (the source tree) that prefers the build:
+    hashed names get Cache-Control immutable, everything else (old names,
+    ENTRY) must revalidate. Either way the .br/.gz sibling is sent when the
+    client accepts it, with ETag/304 from the file actually served.
+    """
+
+    def __init__(self, *, directory: Path, build_dir: Path = STATIC_BUILD_DIR, **kw):
+        super().__init__(directory=directory, **kw)
+        self.build_dir = Path(build_dir)
+        self.manifest: Dict = {}
+        self._dir = self.build_dir
+        self._hashed: set = set()
+        self._entry: Optional[str] = None
+
+    def load(self, manifest: Optional[Dict]) -> None:
+        self.manifest = manifest or {}
+        self._dir = self.build_dir / self.manifest.get("dir", "")
+        files = self.manifest.get("files") or {}
+        self._hashed = {v for k, v in files.items() if k != ENTRY}
+        self._entry = files.get(ENTRY)
+
+    def url_for(self, rel: str) -> str:
+        return STATIC_PREFIX + (self.manifest.get("files") or {}).get(rel, rel)
+
+    async def _built(self, name: str, scope: Scope, cache_control: str) -> Response:
+        req_headers = Headers(scope=scope)
+        variants = self.manifest["sizes"].get(name, {})
+        accepted = _accepts(req_headers)
+        enc = next((e for e in ("br", "gzip") if e in variants and e in accepted), None)
+        path = self._dir / (name + {"br": ".br", "gzip": ".gz"}.get(enc, ""))
+        stat = await anyio.to_thread.run_sync(os.stat, path)
+        headers = {"Cache-Control": cache_control}
+        if len(variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if enc:
+            headers["Content-Encoding"] = enc
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        response = FileResponse(path, stat_result=stat, media_type=media_type, headers=headers)
+        if self.is_not_modified(response.headers, req_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        name = path.replace(os.sep, "/")
+        if name in self._hashed:
+            if scope["method"] not in ("GET", "HEAD"):
+                raise HTTPException(status_code=405)   # 和 StaticFiles.get_response 一樣
+            return await self._built(name, scope, IMMUTABLE)
+        response = await super().get_response(path, scope)
+        response.headers.setdefault("Cache-Control", REVALIDATE)
+        return response
+
+    async def index_response(self, scope: Scope) -> Response:
+        """ENTRY with rewritten references (source file when there is no build)."""
+        if self._entry:
+            return await self._built(self._entry, scope, REVALIDATE)
+        return await super().get_response(ENTRY, scope)
+
+def open_static(frontend_dir: Path) -> HashedStaticFiles:
+    return HashedStaticFiles(directory=frontend_dir, build_dir=STATIC_BUILD_DIR)
+
+def build_into(static: HashedStaticFiles, frontend_dir: Path) -> None:
+    """Startup hook: (re)build when sources changed and point `static` at it."""
+    if not STATIC_BUILD:
+        return
+    try:
+        static.load(build_static(frontend_dir, static.build_dir))
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"[static] WARN: build failed, serving {frontend_dir} as is: {e}")
+        static.load(None)
+
+# ---------- CLI ----------
+# python -m backend.utils.static_build [--force]   # 部署前先建好，啟動時就不用再壓縮
+if __name__ == "__main__":
+    import sys
+    mf = build_static(PROJECT_ROOT / "frontend", STATIC_BUILD_DIR, force="--force" in sys.argv)
+    for rel, name in mf["files"].items():
+        s = mf["sizes"][name]
+        print(f"{name:60s} " + "  ".join(f"{k} {v:>9,}" for k, v in s.items()))
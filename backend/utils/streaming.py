@@ -0,0 +1,16 @@
+# backend/utils/streaming.py — SSE / NDJSON framing for streamed responses
+from __future__ import annotations
+import json
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def ndjson(event: str, data) -> str:
+    return json.dumps({"type": event, **data}, ensure_ascii=False) + "\n"
+
+STREAM_FORMATS = {
+    "sse": (sse, "text/event-stream"),
+    "ndjson": (ndjson, "application/x-ndjson"),
+}
+# 關掉反向代理（nginx）緩衝，token 才會即時送到瀏覽器
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
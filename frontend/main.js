@@ -99,6 +99,7 @@ function setDefaultCard() {
 }
 
 let lastPlaceName = null;  // derived place string for wiki/history
+let lastWikiQid = null;    // Wikidata QID of the wiki card（歷史快取 key 用）
 
 init();
 animate();
@@ -131,8 +132,9 @@ async function init() {
   dir.position.set(5, 5, 5);
   scene.add(dir);
 
-  // 政治底圖 + ID 貼圖（UV 完全一致）
+  // 政治底圖 + ID 貼圖（UV 完全一致）：優先用伺服器烤好的 PNG，失敗才自己畫 GeoJSON
   const { baseTexture, idPicker, width: TEX_W, height: TEX_H } =
+    (await loadBakedGlobe('/api/globe')) ||
     await buildPoliticalBaseAndPicker('/static/assets/countries.geojson', {
       width: 2048, height: 1024,
       ocean: '#1b3a4e',
@@ -235,13 +237,12 @@ async function onPointerUp(e) {
   const lat = -90 + 180 * v;
 
   // 用 ID 貼圖取國家
-  const picked = picker.pickUV(u, v); // { feature, name, iso3 } 或 null
+  const picked = picker.pickUV(u, v); // { id, name, iso3 } 或 null
 
   // 先更新 HUD（國家）
   if (picked) {
     HUD.textContent = `Lat ${lat.toFixed(4)}°, Lon ${lon.toFixed(4)}° — ${picked.name}`;
-    highlightLayer.clear();
-    highlightLayer.paint(picked.feature);
+    highlightLayer.paint(picker, picked.id);
   } else {
     HUD.textContent = `Lat ${lat.toFixed(4)}°, Lon ${lon.toFixed(4)}°`;
     highlightLayer.clear();
@@ -256,6 +257,7 @@ async function onPointerUp(e) {
   const ctx = await enrichWithRevGeo(lat, lon, picked?.name);
   const place = ctx.place || picked?.name || `(${lat.toFixed(3)}, ${lon.toFixed(3)})`;
   lastPlaceName = place;
+  lastWikiQid = null;
   await fetchAndRenderPlaceInfo(place, lastCtx);
 
   // 只要有 city，就顯示「歷史事件」FAB（用 city 當關鍵字）
@@ -391,6 +393,9 @@ async function fetchAndRenderPlaceInfo(placeName, ctx) {
       return;
     }
 
+    // 只有卡片就是最細的那個地點時才沿用它的 QID（退回查國家時不算）
+    lastWikiQid = (result.query === (placeName || "").trim()) ? (result.wikidata_qid || null) : null;
+
     EL.title.textContent = result.title || primary || placeName;
     EL.desc.textContent = result.description || "";
     EL.summary.textContent = result.summary || "(no summary)";
@@ -433,15 +438,50 @@ async function runHistory(endpoint, place, language) {
   try {
     btns.forEach(b => b.disabled = true);
     EL.out.textContent = "Generating…";
-    const res = await fetch(endpoint, {
+    EL.out.title = "";
+    // 串流版本：NDJSON 一行一個事件，token 一到就顯示
+    const res = await fetch(`${endpoint}/stream?format=ndjson`, {
       method: "POST",
       headers: {"Content-Type": "application/json"},
-      body: JSON.stringify({ place, language })
+      body: JSON.stringify({ place, language, qid: lastWikiQid })
     });
-    if (!res.ok) throw new Error(`HTTP ${res.status}`);
-    const j = await res.json();
-    if (j.ok) EL.out.textContent = j.text || "(no content)";
-    else EL.out.textContent = `Error: ${j.error || "unknown error"}`;
+    if (res.status === 429) {
+      // 後端 LLM 佇列已滿：照 Retry-After 提示，不硬等
+      const wait = res.headers.get("Retry-After") || "a few";
+      EL.out.textContent = `Server is busy generating other histories — please retry in ${wait} s.`;
+      return;
+    }
+    if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buf = "", text = "";
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buf += decoder.decode(value, { stream: true });
+      let nl;
+      while ((nl = buf.indexOf("\n")) >= 0) {
+        const line = buf.slice(0, nl).trim();
+        buf = buf.slice(nl + 1);
+        if (!line) continue;
+        const ev = JSON.parse(line);
+        if (ev.type === "status" && ev.stage === "canonical") {
+          // 其他語言由 pivot 版本翻譯：第一次要先生成 pivot 版本
+          EL.out.textContent = `Researching (${ev.language}), then translating…`;
+        } else if (ev.type === "served") {
+          // 哪個模型回答的（備援 / hedge 時會和預設不同）
+          EL.out.title = `via ${ev.model || "?"}${ev.translator ? `, translated by ${ev.translator}` : ""}`
+            + (ev.fallback ? " (fallback)" : "");
+        } else if (ev.type === "delta") {
+          text += ev.text || "";
+          EL.out.textContent = text;
+        } else if (ev.type === "error") {
+          EL.out.textContent = text ? `${text}\n\n[Error: ${ev.error}]` : `Error: ${ev.error || "unknown error"}`;
+        }
+      }
+    }
+    if (!text && /^(Generating|Researching)/.test(EL.out.textContent)) EL.out.textContent = "(no content)";
   } catch (err) {
     console.error("[history]", err);
     EL.out.textContent = "Failed to generate history.";
@@ -703,22 +743,67 @@ async function buildPoliticalBaseAndPicker(url, opt) {
   baseTexture.wrapT = THREE.RepeatWrapping;
   baseTexture.needsUpdate = true;
 
-  const idPicker = {
-    W, H, canvas: idc, ctx: ictx, idMap,
+  const ids = ictx.getImageData(0, 0, W, H).data;
+  const idPicker = makeIdPicker(W, H, ids, (id) => {
+    const f = idMap.get(id);
+    return f ? { name: countryName(f.properties), iso3: countryISO3(f.properties), bbox: null } : null;
+  });
+
+  return { baseTexture, idPicker, width: W, height: H };
+}
+
+/* ---------- 伺服器烤好的底圖 + ID 圖（/api/globe） ---------- */
+async function loadBakedGlobe(url) {
+  try {
+    const res = await fetch(url);
+    if (!res.ok) return null;
+    const g = await res.json();
+    const W = g.width, H = g.height;
+
+    // ID 圖必須逐位元讀回：關掉色彩轉換與預乘 alpha
+    const [baseTexture, bitmap] = await Promise.all([
+      new THREE.TextureLoader().loadAsync(g.base),
+      fetch(g.ids).then(r => {
+        if (!r.ok) throw new Error(`HTTP ${r.status}`);
+        return r.blob();
+      }).then(b => createImageBitmap(b, { colorSpaceConversion: 'none', premultiplyAlpha: 'none' }))
+    ]);
+    const c = document.createElement('canvas'); c.width = W; c.height = H;
+    const ctx = c.getContext('2d', { willReadFrequently: true });
+    ctx.drawImage(bitmap, 0, 0);
+    bitmap.close?.();
+    const ids = ctx.getImageData(0, 0, W, H).data;   // 只讀一次，之後點擊直接查陣列
+
+    baseTexture.anisotropy = 4;
+    baseTexture.wrapS = THREE.RepeatWrapping;
+    baseTexture.wrapT = THREE.RepeatWrapping;
+
+    const idPicker = makeIdPicker(W, H, ids, (id) => {
+      const row = g.countries[id - 1];
+      return row ? { name: row[0], iso3: row[1], bbox: row[2] } : null;
+    });
+    return { baseTexture, idPicker, width: W, height: H };
+  } catch (e) {
+    console.warn('[globe] baked textures unavailable, rasterizing GeoJSON', e);
+    return null;
+  }
+}
+
+// ids：RGBA 像素（id = R | G<<8 | B<<16，0 = 海）；lookup(id) → { name, iso3, bbox } 或 null
+function makeIdPicker(W, H, ids, lookup) {
+  const idAt = (x, y) => { const i = (y * W + x) * 4; return ids[i] | (ids[i + 1] << 8) | (ids[i + 2] << 16); };
+  return {
+    W, H, idAt, lookup,
     pickUV: (u, v) => {
       let x = Math.floor(((u % 1 + 1) % 1) * W);
       let y = Math.floor((1 - ((v % 1 + 1) % 1)) * H);
       x = Math.min(Math.max(x, 0), W - 1);
       y = Math.min(Math.max(y, 0), H - 1);
-      const p = ictx.getImageData(x, y, 1, 1).data;
-      const colorInt = (p[0]) | (p[1] << 8) | (p[2] << 16);
-      const feature = idMap.get(colorInt);
-      if (!feature) return null;
-      return { feature, name: countryName(feature.properties), iso3: countryISO3(feature.properties) };
+      const id = idAt(x, y);
+      const info = id ? lookup(id) : null;
+      return info ? { id, name: info.name, iso3: info.iso3 } : null;
     }
   };
-
-  return { baseTexture, idPicker, width: W, height: H };
 }
 
 /* ---------- 高亮層（透明第二球） ---------- */
@@ -743,55 +828,25 @@ function makeHighlightLayer(W, H) {
 
   const clear = () => { ctx.clearRect(0, 0, W, H); texture.needsUpdate = true; };
 
-  const paint = (feature) => {
-    clear();
-    ctx.fillStyle = 'rgba(255, 215, 0, 0.30)';
-    ctx.strokeStyle = 'rgba(255, 255, 255, 0.95)';
-    ctx.lineWidth = 1.2;
-
-    const drawRings = (rings, shiftPx) => {
-      ctx.beginPath();
-      for (const ring of rings) {
-        const unwrapped = unwrapRing(ring);
-        unwrapped.forEach(([L, lat], i) => {
-          const x = ((L + 180) / 360) * W + shiftPx;
-          const y = ((90 - lat) / 180) * H;
-          if (i === 0) ctx.moveTo(x, y); else ctx.lineTo(x, y);
-        });
-        ctx.closePath();
-      }
-      // @ts-ignore
-      ctx.fill('evenodd');
-    };
-
-    const g = feature.geometry; if (!g) return;
-    if (g.type === 'Polygon') {
-      for (const s of [-W, 0, W]) drawRings(g.coordinates, s);
-      for (const s of [-W, 0, W]) {
-        ctx.beginPath();
-        const outer = unwrapRing(g.coordinates[0]);
-        outer.forEach(([L, lat], i) => {
-          const x = ((L + 180) / 360) * W + s;
-          const y = ((90 - lat) / 180) * H;
-          if (i === 0) ctx.moveTo(x, y); else ctx.lineTo(x, y);
-        });
-        ctx.closePath(); ctx.stroke();
-      }
-    } else if (g.type === 'MultiPolygon') {
-      for (const poly of g.coordinates) {
-        for (const s of [-W, 0, W]) drawRings(poly, s);
-        for (const s of [-W, 0, W]) {
-          ctx.beginPath();
-          const outer = unwrapRing(poly[0]);
-          outer.forEach(([L, lat], i) => {
-            const x = ((L + 180) / 360) * W + s;
-            const y = ((90 - lat) / 180) * H;
-            if (i === 0) ctx.moveTo(x, y); else ctx.lineTo(x, y);
-          });
-          ctx.closePath(); ctx.stroke();
-        }
+  // 直接用 ID 圖當遮罩：同 id 的像素填色，和鄰居不同的像素描邊（經度方向環繞）
+  const img = ctx.createImageData(W, H);
+  const paint = (picker, id) => {
+    const d = img.data;
+    d.fill(0);
+    const bb = picker.lookup(id)?.bbox;
+    const [x0, y0, x1, y1] = bb || [0, 0, W - 1, H - 1];
+    for (let y = y0; y <= y1; y++) {
+      for (let x = x0; x <= x1; x++) {
+        if (picker.idAt(x, y) !== id) continue;
+        const edge =
+          picker.idAt((x + 1) % W, y) !== id || picker.idAt((x + W - 1) % W, y) !== id ||
+          (y > 0 && picker.idAt(x, y - 1) !== id) || (y < H - 1 && picker.idAt(x, y + 1) !== id);
+        const i = (y * W + x) * 4;
+        if (edge) { d[i] = 255; d[i + 1] = 255; d[i + 2] = 255; d[i + 3] = 242; }
+        else      { d[i] = 255; d[i + 1] = 215; d[i + 2] = 0;   d[i + 3] = 77; }
       }
     }
+    ctx.putImageData(img, 0, 0);
     texture.needsUpdate = true;
   };
 
@@ -891,39 +946,68 @@ function renderEvents(items = []) {
     EV.list.appendChild(empty);
     return;
   }
-  for (const it of items) {
-    const a = document.createElement('a');
-    a.className = 'event-card';
-    a.href = it.url || '#';
-    a.target = '_blank'; a.rel = 'noopener';
-    a.innerHTML = `
-      <div class="thumb">
-        <img src="${escapeHtml(it.image || '/static/assets/default.jpg')}" alt="">
-      </div>
-      <div class="body">
-        <h3>${escapeHtml(it.title || '(untitled)')}</h3>
-        <p>${escapeHtml(it.summary || '')}</p>
-        <div class="meta">${escapeHtml([it.author, it.type].filter(Boolean).join(' · '))}</div>
-      </div>
-    `;
-    EV.list.appendChild(a);
-  }
+  for (const it of items) appendEventCard(it);
+}
+
+function appendEventCard(it) {
+  const a = document.createElement('a');
+  a.className = 'event-card';
+  a.href = it.url || '#';
+  a.target = '_blank'; a.rel = 'noopener';
+  a.innerHTML = `
+    <div class="thumb">
+      <img src="${escapeHtml(it.image || '/static/assets/default.jpg')}" alt="">
+    </div>
+    <div class="body">
+      <h3>${escapeHtml(it.title || '(untitled)')}</h3>
+      <p>${escapeHtml(it.summary || '')}</p>
+      <div class="meta">${escapeHtml([it.author, it.type].filter(Boolean).join(' · '))}</div>
+    </div>
+  `;
+  EV.list.appendChild(a);
 }
 
-async function fetchEventsFor(place, only_textual = true) {
+// 多頁串流版：第一頁解析完就開始出卡片，後面的頁數邊載入邊補上
+const EVENTS_PAGES = 3;
+async function streamEventsFor(place, only_textual = true) {
   const p = (place || "").trim();
   if (!p) return { ok: false, items: [], error: "empty place" };
 
-  const res = await fetch('/api/history/events', {
+  const res = await fetch('/api/history/events/stream?format=ndjson', {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ place: p, only_textual })
+    body: JSON.stringify({ place: p, only_textual, pages: EVENTS_PAGES })
   });
-  if (!res.ok) return { ok: false, items: [], error: `HTTP ${res.status}` };
-
-  const j = await res.json();
-  const items = Array.isArray(j.items) ? j.items : [];
-  return { ok: true, items, query: j.query || p };
+  if (!res.ok || !res.body) return { ok: false, items: [], error: `HTTP ${res.status}` };
+
+  const items = [];
+  let query = p, error = null;
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let nl;
+    while ((nl = buf.indexOf("\n")) >= 0) {
+      const line = buf.slice(0, nl).trim();
+      buf = buf.slice(nl + 1);
+      if (!line) continue;
+      const ev = JSON.parse(line);
+      if (ev.type === "meta") {
+        query = ev.query || p;
+      } else if (ev.type === "item") {
+        if (!items.length) EV.list.innerHTML = "";  // 第一張卡片到了：清掉 Loading
+        items.push(ev.item);
+        appendEventCard(ev.item);
+      } else if (ev.type === "error") {
+        error = ev.error;
+      }
+    }
+  }
+  if (error && !items.length) return { ok: false, items, error };
+  return { ok: true, items, query };
 }
 
 /* ---------- 逐幀 ---------- */
@@ -966,18 +1050,18 @@ if (EV.fab) {
 
     // 1) 先用「城市」查
     if (city) {
-      data = await fetchEventsFor(city, true);
+      data = await streamEventsFor(city, true);
       const hasCityResults = data && data.ok && data.items.length > 0;
 
       // 2) 城市失敗或沒結果 → 用「國家」查
       if (!hasCityResults && country) {
         usedFallback = true;
-        data = await fetchEventsFor(country, true);
+        data = await streamEventsFor(country, true);
       }
     } else {
       // 沒城市，但有國家 → 直接用「國家」
       usedFallback = true;
-      data = await fetchEventsFor(country, true);
+      data = await streamEventsFor(country, true);
     }
 
     // 3) 成功與否處理